@@ -0,0 +1,190 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2022-Present Marble
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+# End-to-end load test of the chat request path against the local stub LLM.
+#
+# Drives LLMScheduler + the OpenAI-compatible backend the way ChatModule
+# does, with simulated users, and reports throughput and latency
+# percentiles. No network or API key needed. From the repository root:
+#
+#     python -m benchmarks.chat_load --users 50 --messages 4 --rate-limit-rate 0.05
+#
+# With --hedge a second stub serves as the fallback model, compare the tail
+# with and without it when the primary stalls now and then:
+#
+#     python -m benchmarks.chat_load --tail-rate 0.05 --hedge
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+import aiohttp
+
+from llm.backends import OpenAIBackend
+from llm.context import estimate_tokens
+from llm.hedging import HedgedBackend, Route
+from llm.scheduler import LLMScheduler
+from llm.stub_server import StubServer, StubSettings
+
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))
+    return ordered[index]
+
+
+async def user(
+    user_id: int,
+    messages: int,
+    backend: OpenAIBackend | HedgedBackend,
+    scheduler: LLMScheduler,
+    stream: bool,
+    latencies: list[float],
+    first_tokens: list[float],
+    failures: list[str],
+) -> None:
+    for _ in range(messages):
+        await asyncio.sleep(random.uniform(0, 0.5))
+        prompt = [{"role": "user", "content": "benchmark question " * random.randint(1, 40)}]
+        tokens = sum(estimate_tokens(m["content"]) for m in prompt) + 150
+        started = time.monotonic()
+
+        async def request():
+            if not stream:
+                return await backend.complete(prompt)
+            async with backend.stream(prompt) as completion:
+                async for _ in completion:
+                    pass
+            if completion.first_token is not None:
+                first_tokens.append(completion.first_token)
+            return completion
+
+        try:
+            await scheduler.submit(user_id, tokens, request)
+            latencies.append(time.monotonic() - started)
+        except Exception as e:
+            failures.append(type(e).__name__)
+
+
+async def run(args: argparse.Namespace) -> None:
+    server = StubServer(
+        StubSettings(
+            latency=args.latency,
+            tokens_per_second=args.tokens_per_second,
+            completion_tokens=args.completion_tokens,
+            error_rate=args.error_rate,
+            rate_limit_rate=args.rate_limit_rate,
+            retry_after=args.retry_after,
+            tail_rate=args.tail_rate,
+        )
+    )
+    url = await server.start()
+    fallback = StubServer(
+        StubSettings(
+            latency=args.latency,
+            tokens_per_second=args.tokens_per_second,
+            completion_tokens=args.completion_tokens,
+        )
+    )
+    fallback_url = await fallback.start()
+    scheduler = LLMScheduler(
+        concurrency=args.concurrency,
+        requests_per_minute=args.rpm,
+        tokens_per_minute=args.tpm,
+        max_retries=args.retries,
+    )
+    latencies: list[float] = []
+    first_tokens: list[float] = []
+    failures: list[str] = []
+
+    async with aiohttp.ClientSession() as session:
+        backend = OpenAIBackend(session, model="stub", url=url)
+        if args.hedge:
+            second = OpenAIBackend(session, model="stub-fallback", url=fallback_url)
+            backend = HedgedBackend(
+                [Route(backend, backend.model), Route(second, second.model)],
+                min_hedge_delay=args.latency,
+            )
+        backend.on_headers = scheduler.update_from_headers
+        started = time.monotonic()
+        await asyncio.gather(
+            *(
+                user(i, args.messages, backend, scheduler, args.stream, latencies, first_tokens, failures)
+                for i in range(args.users)
+            )
+        )
+        elapsed = time.monotonic() - started
+
+    await scheduler.close()
+    await server.stop()
+    await fallback.stop()
+
+    total = args.users * args.messages
+    print(f"{total} requests from {args.users} users in {elapsed:.2f}s ({len(latencies) / elapsed:.1f} req/s)")
+    print(f"ok {len(latencies)}  failed {len(failures)} {sorted(set(failures))}  upstream rejections {server.rejected}")
+    if latencies:
+        print(
+            "latency  p50 {:.3f}s  p95 {:.3f}s  p99 {:.3f}s  max {:.3f}s  mean {:.3f}s".format(
+                percentile(latencies, 50),
+                percentile(latencies, 95),
+                percentile(latencies, 99),
+                max(latencies),
+                statistics.fmean(latencies),
+            )
+        )
+    if args.hedge:
+        print(f"hedged {backend.hedges}  failovers {backend.failovers}")
+    if first_tokens:
+        print(
+            "upstream first token  p50 {:.3f}s  p95 {:.3f}s".format(
+                percentile(first_tokens, 50), percentile(first_tokens, 95)
+            )
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Chat load test against the stub LLM")
+    parser.add_argument("--users", type=int, default=30)
+    parser.add_argument("--messages", type=int, default=3)
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--rpm", type=int, default=600)
+    parser.add_argument("--tpm", type=int, default=200_000)
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--tokens-per-second", type=float, default=500.0)
+    parser.add_argument("--completion-tokens", type=int, default=60)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=0.2)
+    parser.add_argument("--tail-rate", type=float, default=0.0)
+    parser.add_argument("--hedge", action="store_true")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
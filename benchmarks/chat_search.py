@@ -0,0 +1,101 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2022-Present Marble
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+# Relevance lookups over a large chat_memory.
+#
+# Fills a scratch database with synthetic history through the real schema
+# (so the FTS triggers do the indexing) and times Retriever lookups for
+# random users. Run from the repository root:
+#
+#     python -m benchmarks.chat_search --rows 1000000
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+
+import database
+from llm.retrieval import Retriever
+
+VOCABULARY = [f"word{i}" for i in range(20000)]
+
+
+def sentence(rng: random.Random) -> str:
+    return " ".join(rng.choices(VOCABULARY, k=rng.randint(5, 40)))
+
+
+async def run(args: argparse.Namespace) -> None:
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as directory:
+        pool = await database.create_pool(os.path.join(directory, "bench.db"))
+        await database.main(pool)
+        db = database.Repository(pool)
+
+        started = time.perf_counter()
+        insert = "INSERT INTO chat_memory(user_id, role, content, timestamp) VALUES(?,?,?,0)"
+        batch = 50_000
+        for offset in range(0, args.rows, batch):
+            await db.executemany(
+                insert,
+                [
+                    (rng.randrange(args.users), "user" if i % 2 == 0 else "assistant", sentence(rng))
+                    for i in range(offset, min(args.rows, offset + batch))
+                ],
+            )
+        print(f"inserted {args.rows} rows for {args.users} users in {time.perf_counter() - started:.1f}s")
+
+        retriever = Retriever(db, enabled=True)
+        timings = []
+        hits = 0
+        for _ in range(args.queries):
+            user_id = rng.randrange(args.users)
+            started = time.perf_counter()
+            turns = await retriever.history(user_id, sentence(rng), [])
+            timings.append(time.perf_counter() - started)
+            hits += len(turns)
+        timings.sort()
+        print(
+            "lookup  p50 {:.2f}ms  p95 {:.2f}ms  max {:.2f}ms  mean {:.2f}ms  ({:.1f} turns per lookup)".format(
+                timings[len(timings) // 2] * 1000,
+                timings[int(len(timings) * 0.95)] * 1000,
+                timings[-1] * 1000,
+                statistics.fmean(timings) * 1000,
+                hits / len(timings),
+            )
+        )
+        await pool.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="FTS5 chat history lookup benchmark")
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--users", type=int, default=2_000)
+    parser.add_argument("--queries", type=int, default=500)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2022-Present Marble
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+# Splitting large replies into Discord messages.
+#
+# Compares utils.chunker against the line loop ChatModule used before,
+# on complete replies and on a token stream, and checks the limits the
+# old loop could break. Run from the repository root:
+#
+#     python -m benchmarks.chunker
+
+import random
+import time
+
+from utils.chunker import Chunker, chunk_text, scan_fences
+
+
+def legacy_split(response: str) -> list[str]:
+    """The splitting loop from ChatModule.on_message, unchanged"""
+    chunks = []
+    current_chunk = ""
+    in_code_block = False
+
+    for line in response.split("\n"):
+        if line.strip().startswith("```"):
+            if in_code_block:
+                current_chunk += line + "\n"
+                if len(current_chunk) > 1900:
+                    chunks.append(current_chunk)
+                    current_chunk = ""
+                in_code_block = False
+            else:
+                if len(current_chunk) + len(line) + 1 > 1900:
+                    if current_chunk:
+                        chunks.append(current_chunk)
+                    current_chunk = line + "\n"
+                else:
+                    current_chunk += line + "\n"
+                in_code_block = True
+        else:
+            if len(current_chunk) + len(line) + 1 > 1900:
+                if current_chunk:
+                    chunks.append(current_chunk)
+                current_chunk = line + "\n"
+            else:
+                current_chunk += line + "\n"
+
+    if current_chunk:
+        chunks.append(current_chunk)
+    return chunks
+
+
+def reply(size: int, rng: random.Random) -> str:
+    parts = []
+    length = 0
+    while length < size:
+        roll = rng.random()
+        if roll < 0.3:
+            lines = "\n".join(
+                f"    value_{i} = compute({i}) + {'x' * rng.randint(0, 80)}"
+                for i in range(rng.randint(5, 150))
+            )
+            part = f"```python\n{lines}\n```\n"
+        elif roll < 0.35:
+            part = "y" * rng.randint(2500, 6000) + "\n"
+        else:
+            part = " ".join(rng.choice(("the", "bot", "reply", "splits", "text")) for _ in range(rng.randint(20, 300)))
+            part += "\n\n"
+        parts.append(part)
+        length += len(part)
+    return "".join(parts)
+
+
+def problems(chunks: list[str]) -> tuple[int, int]:
+    too_long = sum(len(chunk) > 2000 for chunk in chunks)
+    broken = sum(scan_fences(chunk, None) is not None for chunk in chunks)
+    return too_long, broken
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started
+
+
+def stream(text: str, delta: int) -> list[str]:
+    chunker = Chunker()
+    chunks = []
+    for i in range(0, len(text), delta):
+        chunks += chunker.feed(text[i : i + delta])
+    return chunks + chunker.flush()
+
+
+def main() -> None:
+    rng = random.Random(0)
+    for size in (10_000, 100_000, 1_000_000, 10_000_000):
+        text = reply(size, rng)
+        old, old_time = timed(legacy_split, text)
+        new, new_time = timed(chunk_text, text)
+        streamed, stream_time = timed(stream, text, 4)
+        assert streamed == new
+        print(
+            f"{len(text):>10} chars  legacy {old_time * 1000:8.2f}ms {len(old):>5} msgs, "
+            "{} over 2000, {} with an open fence".format(*problems(old))
+        )
+        print(
+            f"{'':>16}chunker {new_time * 1000:8.2f}ms {len(new):>5} msgs, "
+            "{} over 2000, {} with an open fence".format(*problems(new))
+        )
+        print(f"{'':>16} stream {stream_time * 1000:8.2f}ms (4 character deltas)")
+
+
+if __name__ == "__main__":
+    main()
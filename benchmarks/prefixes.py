@@ -0,0 +1,131 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2022-Present Marble
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+# Command prefix lookup, run for every message the bot sees.
+#
+# Compares utils.prefixes.PrefixResolver against the get_prefix Bot used
+# before, on a mix of guild and DM messages where most are chatter and a
+# few are commands. Run from the repository root:
+#
+#     python -m benchmarks.prefixes
+
+import asyncio
+import random
+import time
+from types import SimpleNamespace
+
+from utils.prefixes import PrefixResolver
+
+BOT_ID = 1000
+
+
+class FakeDB:
+    def __init__(self, prefixes: dict[int, list[str]]) -> None:
+        self._prefixes = prefixes
+
+    async def prefixes(self) -> dict[int, list[str]]:
+        return self._prefixes
+
+
+class LegacyBot:
+    """Bot.get_prefix as it was, plus the context lookup that follows it"""
+
+    def __init__(self, prefixes: dict[int, str]) -> None:
+        self.prefixes = prefixes
+
+    async def get_prefix(self, message):
+        prefix_list = ["yo bro"]
+        try:
+            prefix_list.append(self.prefixes[message.guild.id])
+        except KeyError:
+            pass
+        return prefix_list
+
+    async def process(self, message) -> bool:
+        try:
+            prefix = await self.get_prefix(message)
+        except AttributeError:
+            # DMs have no guild, the old lookup raised here
+            return False
+        return message.content.startswith(tuple(prefix))
+
+
+class ResolverBot:
+    def __init__(self, resolver: PrefixResolver) -> None:
+        self.prefixes = resolver
+
+    async def get_prefix(self, message):
+        return self.prefixes.get(message)
+
+    async def process(self, message) -> bool:
+        if not self.prefixes.may_match(message):
+            return False
+        prefix = await self.get_prefix(message)
+        return message.content.startswith(prefix)
+
+
+def messages(count: int, guilds: int, rng: random.Random) -> list:
+    chatter = ("lol", "anyone up?", "gg", "Did you see that", "hello there", ":)", "https://example.com")
+    result = []
+    for _ in range(count):
+        guild = None if rng.random() < 0.1 else SimpleNamespace(id=rng.randrange(guilds))
+        roll = rng.random()
+        if roll < 0.05:
+            content = "!ping"
+        elif roll < 0.08:
+            content = "yo bro help"
+        elif roll < 0.1:
+            content = f"<@{BOT_ID}> what's up"
+        else:
+            content = rng.choice(chatter)
+        result.append(SimpleNamespace(guild=guild, content=content))
+    return result
+
+
+async def timed(bot, batch: list) -> tuple[int, float]:
+    started = time.perf_counter()
+    matched = 0
+    for message in batch:
+        matched += await bot.process(message)
+    return matched, time.perf_counter() - started
+
+
+async def main() -> None:
+    rng = random.Random(0)
+    guilds = 5000
+    custom = {guild: "!" for guild in range(0, guilds, 2)}
+    resolver = PrefixResolver(FakeDB({guild: [prefix] for guild, prefix in custom.items()}))
+    await resolver.load()
+    resolver.set_user(BOT_ID)
+
+    batch = messages(500_000, guilds, rng)
+    for name, bot in (("legacy", LegacyBot(custom)), ("resolver", ResolverBot(resolver))):
+        matched, elapsed = await timed(bot, batch)
+        print(
+            f"{name:>8}  {elapsed * 1000:8.1f}ms  {elapsed / len(batch) * 1e9:6.0f}ns/message  "
+            f"{matched} commands"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,122 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2022-Present Marble
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+# Auto-response matching with 10k triggers in one channel.
+#
+# Compares TriggerIndex against the old approach of scanning every row of
+# the channel. Run from the repository root:
+#
+#     python -m benchmarks.triggers
+
+import random
+import string
+import time
+
+from utils.triggers import CONTAINS, EXACT, PREFIX, Trigger, TriggerIndex
+
+CHANNEL = 1
+TRIGGERS = 10_000
+MESSAGES = 2_000
+
+
+def word(rng: random.Random, low: int = 3, high: int = 10) -> str:
+    return "".join(rng.choices(string.ascii_lowercase, k=rng.randint(low, high)))
+
+
+def build_triggers(rng: random.Random) -> list[Trigger]:
+    triggers = []
+    for i in range(TRIGGERS):
+        roll = rng.random()
+        match_type = EXACT if roll < 0.7 else CONTAINS if roll < 0.9 else PREFIX
+        author = rng.choice((0, 0, 0, rng.randint(1, 50)))
+        triggers.append(
+            Trigger(i + 1, CHANNEL, author, word(rng, 5, 14), f"r{i}", match_type, rng.random() < 0.3)
+        )
+    return triggers
+
+
+def build_messages(rng: random.Random, triggers: list[Trigger]) -> list[str]:
+    messages = []
+    for _ in range(MESSAGES):
+        parts = [word(rng) for _ in range(rng.randint(1, 30))]
+        if rng.random() < 0.2:
+            parts.insert(rng.randrange(len(parts) + 1), rng.choice(triggers).message)
+        messages.append(" ".join(parts))
+    return messages
+
+
+def linear_match(triggers: list[Trigger], author_id: int, content: str):
+    """What message1 did before: look at every row of the channel"""
+    folded = content.casefold()
+    hits = []
+    for t in triggers:
+        text = folded if t.ignore_case else content
+        if t.match_type == EXACT:
+            matched = text == t.key
+        elif t.match_type == PREFIX:
+            matched = text.startswith(t.key)
+        else:
+            matched = t.key in text
+        if matched and t.author in (0, author_id):
+            hits.append(t)
+    return hits
+
+
+def timed(label: str, func, count: int) -> float:
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<32} {elapsed * 1e6 / count:>10.1f} us/op")
+    return elapsed
+
+
+def main() -> None:
+    rng = random.Random(0)
+    triggers = build_triggers(rng)
+    messages = build_messages(rng, triggers)
+    authors = [rng.randint(1, 50) for _ in messages]
+    print(f"{TRIGGERS} triggers, {MESSAGES} messages, avg {sum(map(len, messages)) // MESSAGES} chars")
+
+    index = TriggerIndex()
+    timed("index build (10k adds)", lambda: [index.add(t) for t in triggers], TRIGGERS)
+    timed("first match (automaton build)", lambda: index.match(CHANNEL, 1, messages[0]), 1)
+
+    def run_index():
+        for author, content in zip(authors, messages):
+            index.match(CHANNEL, author, content)
+
+    def run_linear():
+        for author, content in zip(authors, messages):
+            linear_match(triggers, author, content)
+
+    indexed = timed("TriggerIndex.match", run_index, MESSAGES)
+    linear = timed("linear scan", run_linear, MESSAGES)
+    print(f"speedup: {linear / indexed:.0f}x")
+
+    extra = Trigger(TRIGGERS + 1, CHANNEL, 0, "benchmark", "hit", CONTAINS)
+    timed("add + rematch (channel rebuild)", lambda: (index.add(extra), index.match(CHANNEL, 1, "x")), 1)
+    timed("remove + rematch", lambda: (index.remove(CHANNEL, "benchmark"), index.match(CHANNEL, 1, "x")), 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -21,5 +21,8 @@ LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
 FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 DEALINGS IN THE SOFTWARE.
 """
+from .auth import AuthCache, NoPerms, channel_blocked, disable_channel, perms
 from .bot import Bot
 from .config import config
+from .executor import HIGH, LOW, NORMAL, prioritized
+from .pipeline import MessageContext, message_handler
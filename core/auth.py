@@ -0,0 +1,107 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2022-Present Marble
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+from discord.ext import commands
+
+import database
+
+
+class NoPerms(commands.CommandError):
+    def __init__(self):
+        super().__init__("LO... No perm")
+
+
+class channel_blocked(commands.CommandError):
+    def __init__(self) -> None:
+        super().__init__("Disabled in channel")
+
+
+class AuthCache:
+    """In-memory copy of user grants and blocked channels
+
+    Loaded once at startup, every write goes to the database first and is
+    then applied here, so checks never touch SQLite.
+    """
+
+    def __init__(self, db: database.Repository) -> None:
+        self.db = db
+        self.users: set[int] = set()
+        self.blocked_channels: set[int] = set()
+
+    async def load(self) -> None:
+        self.users = await self.db.user_permissions()
+        self.blocked_channels = await self.db.blocked_channels()
+
+    def has_permission(self, user_id: int) -> bool:
+        return user_id in self.users
+
+    def is_channel_blocked(self, channel_id: int) -> bool:
+        return channel_id in self.blocked_channels
+
+    async def grant(self, user_id: int, name: str) -> bool:
+        """Give a user permissions, returns False if they already had them"""
+        if user_id in self.users:
+            return False
+        await self.db.add_permission(user_id, name)
+        self.users.add(user_id)
+        return True
+
+    async def revoke(self, user_id: int) -> bool:
+        if user_id not in self.users:
+            return False
+        await self.db.remove_permission(user_id)
+        self.users.discard(user_id)
+        return True
+
+    async def block(self, channel_id: int, name: str) -> bool:
+        """Block commands in a channel, returns False if it was already blocked"""
+        if channel_id in self.blocked_channels:
+            return False
+        await self.db.block_channel(channel_id, name)
+        self.blocked_channels.add(channel_id)
+        return True
+
+    async def unblock(self, channel_id: int) -> bool:
+        if channel_id not in self.blocked_channels:
+            return False
+        await self.db.unblock_channel(channel_id)
+        self.blocked_channels.discard(channel_id)
+        return True
+
+
+def perms():
+    def predicate(ctx):
+        if ctx.author.id in ctx.bot.auth.users:
+            return True
+        raise NoPerms()
+
+    return commands.check(predicate)
+
+
+def disable_channel():
+    def predicate(ctx):
+        if ctx.channel.id in ctx.bot.auth.blocked_channels:
+            raise channel_blocked()
+        return True
+
+    return commands.check(predicate)
@@ -24,14 +24,19 @@ DEALINGS IN THE SOFTWARE.
 import datetime
 import pathlib
 import logging
+import time
 
-import asqlite
 import aiohttp
 import discord
 from discord.ext import commands
 
 import database
-from . import config
+from utils.prefixes import PrefixResolver
+from .config import config
+from .auth import AuthCache
+from .executor import PriorityExecutor
+from . import metrics
+from .pipeline import MessageContext, MessagePipeline
 
 
 class Bot(commands.Bot):
@@ -50,8 +55,49 @@ class Bot(commands.Bot):
         self.started: datetime.datetime = datetime.datetime.now(
             tz=datetime.timezone.utc
         )
+        # Handler work by priority, sheds log spam first under load
+        self.executor = PriorityExecutor.from_config(config.get("EXECUTOR", {}))
+        # Cogs get messages through @message_handler, not on_message listeners
+        self.messages = MessagePipeline(self.executor)
+        # Prometheus /metrics, started in setup_hook unless disabled
+        self.metrics_server: metrics.MetricsServer | None = None
 
     async def setup_hook(self) -> None:
+        db_config = config.get("DATABASE", {})
+        self.database_file = db_config.get("file", "database.db")
+        self.session = aiohttp.ClientSession()
+        self.executor.start()
+        self._instrument_http()
+        metrics.LOOP_LAG.set_function(lambda: self.executor.lag)
+
+        metrics_config = config.get("METRICS", {})
+        if metrics_config.get("enabled", True):
+            server = metrics.MetricsServer(
+                host=metrics_config.get("host", "127.0.0.1"), port=metrics_config.get("port", 9108)
+            )
+            try:
+                await server.start()
+                self.metrics_server = server
+            except OSError as e:
+                print(f"Metrics endpoint not started! {e}")
+
+        # One pool for the lifetime of the bot, cogs go through self.db
+        self.pool = await database.create_pool(
+            self.database_file,
+            size=db_config.get("pool_size", 4),
+            pragmas=db_config.get("pragmas"),
+        )
+        self.db = database.Repository(self.pool, query_seconds=metrics.DB_QUERIES)
+        await database.main(self.pool)
+
+        # Caching prefixes and permissions
+        self.prefixes = PrefixResolver(self.db, is_command=lambda name: name in self.all_commands)
+        await self.prefixes.load()
+        if self.user is not None:
+            self.prefixes.set_user(self.user.id)
+        self.auth = AuthCache(self.db)
+        await self.auth.load()
+
         try:
             await self.load_extension("jishaku")
             modules: list[str] = [
@@ -62,31 +108,77 @@ class Bot(commands.Bot):
                 await self.load_extension(module)
         except Exception as e:
             print(f"Extension not loaded! {e}")
-        
-        self.database_file = "database.db"
-        self.session = aiohttp.ClientSession()
-        self.database = await database.main(self.database_file)
-
-        # Caching prefixes
-        async with asqlite.connect(self.database_file) as conn:
-            async with conn.cursor() as cursor:
-                await cursor.execute("SELECT * FROM prefix")
-                rows = await cursor.fetchall()
-                self.prefixes = {x[0]: x[1] for x in rows}
 
     async def on_ready(self) -> None:
         """called when the bot is ready"""
         print(f"Logged in as {self.user}(ID: {self.user.id})")
+        self.prefixes.set_user(self.user.id)
+
+    def _instrument_http(self) -> None:
+        """Time every Discord REST request, sends and edits included"""
+        request = self.http.request
+
+        async def timed_request(route, **kwargs):
+            started = time.perf_counter()
+            status = "error"
+            try:
+                response = await request(route, **kwargs)
+                status = "ok"
+                return response
+            except discord.HTTPException as e:
+                status = str(e.status)
+                raise
+            finally:
+                metrics.DISCORD_REQUESTS.labels(route.method, route.path, status).observe(
+                    time.perf_counter() - started
+                )
+
+        self.http.request = timed_request
+
+    async def invoke(self, ctx: commands.Context) -> None:
+        if ctx.command is None:
+            await super().invoke(ctx)
+            return
+        started = time.perf_counter()
+        try:
+            await super().invoke(ctx)
+        finally:
+            status = "error" if ctx.command_failed else "ok"
+            metrics.COMMANDS.labels(ctx.command.qualified_name, status).observe(time.perf_counter() - started)
+
+    async def _run_event(self, coro, event_name: str, *args, **kwargs) -> None:
+        # Every listener, cog listeners included, is awaited here
+        started = time.perf_counter()
+        try:
+            await super()._run_event(coro, event_name, *args, **kwargs)
+        finally:
+            metrics.LISTENERS.labels(event_name, coro.__qualname__).observe(time.perf_counter() - started)
+
+    async def add_cog(self, cog: commands.Cog, /, **kwargs) -> None:
+        await super().add_cog(cog, **kwargs)
+        self.messages.add_cog(cog)
+
+    async def remove_cog(self, name: str, /, **kwargs) -> commands.Cog | None:
+        cog = await super().remove_cog(name, **kwargs)
+        if cog is not None:
+            self.messages.remove_owner(cog)
+        return cog
+
+    async def on_message(self, message: discord.Message) -> None:
+        ctx = MessageContext(message, self.user, self.prefixes.match(message))
+        self.messages.dispatch(ctx)
+        # match() already turned away chatter, only commands get a context built
+        if ctx.prefix is not None and not ctx.is_bot:
+            await self.process_commands(message)
 
     async def get_prefix(self, message):
-        prefix_list = ["yo bro"]
-        try:
-            prefix_list.append(self.prefixes[message.guild.id])
-        except KeyError:
-            pass
-        return prefix_list
+        return self.prefixes.get(message)
 
     async def close(self) -> None:
         await super().close()
 
+        await self.executor.close()
+        if self.metrics_server is not None:
+            await self.metrics_server.stop()
         await self.session.close()
+        await self.pool.close()
@@ -0,0 +1,228 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2022-Present Marble
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+import asyncio
+import functools
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Mapping
+
+from .metrics import HANDLERS, HANDLERS_SHED
+
+log = logging.getLogger(__name__)
+
+HIGH = "high"
+NORMAL = "normal"
+LOW = "low"
+
+# Commands and chat never shed, log messages go first when things get busy
+DEFAULT_CLASSES: dict[str, dict[str, Any]] = {
+    HIGH: {"concurrency": 64, "queue_size": 1000},
+    NORMAL: {"concurrency": 16, "queue_size": 500, "shed_lag": 2.0, "sample": 2},
+    LOW: {"concurrency": 4, "queue_size": 200, "shed_lag": 0.25, "shed_depth": 50, "sample": 10, "max_wait": 30.0},
+}
+
+
+class PriorityClass:
+    """Limits and counters for one priority
+
+    Up to ``concurrency`` jobs run at once, the rest wait in a queue of at
+    most ``queue_size``. New work is shed once the event loop lags more
+    than ``shed_lag`` seconds or ``shed_depth`` jobs are waiting; while
+    shedding every ``sample``-th job is still admitted (0 drops them all).
+    Jobs that waited longer than ``max_wait`` are dropped instead of run.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        *,
+        concurrency: int = 8,
+        queue_size: int = 500,
+        shed_lag: float | None = None,
+        shed_depth: int | None = None,
+        sample: int = 0,
+        max_wait: float | None = None,
+    ) -> None:
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.shed_lag = shed_lag
+        self.shed_depth = shed_depth
+        self.sample = sample
+        self.max_wait = max_wait
+        self.queue: deque[tuple[float, str, Callable[[], Awaitable[Any]]]] = deque()
+        self.running = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        # reason -> jobs dropped, and job name -> jobs dropped
+        self.shed: dict[str, int] = {}
+        self.shed_by_name: dict[str, int] = {}
+        self._overloaded = 0
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "class": self.name,
+            "running": self.running,
+            "queued": len(self.queue),
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "shed": dict(self.shed),
+            "shed_by_name": dict(self.shed_by_name),
+        }
+
+
+class PriorityExecutor:
+    """Runs event handler work by priority class, shedding the least important
+
+    A monitor task measures how late the event loop wakes up. When it
+    falls behind, or a class' queue backs up, new low priority jobs are
+    dropped or sampled before they can add to the backlog, so commands and
+    chat replies keep their latency during raids and voice floods.
+    """
+
+    def __init__(self, classes: Mapping[str, Mapping[str, Any]] | None = None, *, lag_interval: float = 0.5) -> None:
+        classes = classes if classes is not None else DEFAULT_CLASSES
+        self.classes = {name: PriorityClass(name, **options) for name, options in classes.items()}
+        self.lag_interval = lag_interval
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self._monitor: asyncio.Task | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    @classmethod
+    def from_config(cls, executor_config: Mapping[str, Any]) -> "PriorityExecutor":
+        """``[EXECUTOR.<class>]`` tables override the defaults of that class"""
+        classes = {name: dict(options) for name, options in DEFAULT_CLASSES.items()}
+        for name, options in executor_config.items():
+            if isinstance(options, Mapping):
+                classes.setdefault(name, {}).update(options)
+        return cls(classes, lag_interval=executor_config.get("lag_interval", 0.5))
+
+    def start(self) -> None:
+        if self._monitor is None:
+            self._monitor = asyncio.create_task(self._measure_lag())
+
+    async def _measure_lag(self) -> None:
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.lag_interval)
+            lag = time.monotonic() - started - self.lag_interval
+            # Rises at once, decays over a few intervals
+            self.lag = max(lag, self.lag / 2)
+            self.max_lag = max(self.max_lag, lag)
+
+    def _shed_reason(self, priority: PriorityClass) -> str | None:
+        if len(priority.queue) >= priority.queue_size:
+            return "queue_full"
+        if priority.shed_lag is not None and self.lag > priority.shed_lag:
+            reason = "lag"
+        elif priority.shed_depth is not None and len(priority.queue) >= priority.shed_depth:
+            reason = "depth"
+        else:
+            return None
+        priority._overloaded += 1
+        if priority.sample and priority._overloaded % priority.sample == 0:
+            return None
+        return reason
+
+    def _drop(self, priority: PriorityClass, name: str, reason: str) -> None:
+        priority.shed[reason] = priority.shed.get(reason, 0) + 1
+        priority.shed_by_name[name] = priority.shed_by_name.get(name, 0) + 1
+        HANDLERS_SHED.labels(priority.name, reason).inc()
+
+    def submit(self, class_name: str, name: str, func: Callable[[], Awaitable[Any]]) -> bool:
+        """Run ``func`` in the given class, returns False if it was shed"""
+        priority = self.classes[class_name]
+        priority.submitted += 1
+        reason = self._shed_reason(priority)
+        if reason is not None:
+            self._drop(priority, name, reason)
+            return False
+        if priority.running < priority.concurrency:
+            self._start(priority, name, func)
+        else:
+            priority.queue.append((time.monotonic(), name, func))
+        return True
+
+    def _start(self, priority: PriorityClass, name: str, func: Callable[[], Awaitable[Any]]) -> None:
+        priority.running += 1
+        task = asyncio.create_task(self._run(priority, name, func), name=f"{priority.name}:{name}")
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, priority: PriorityClass, name: str, func: Callable[[], Awaitable[Any]]) -> None:
+        started = time.perf_counter()
+        try:
+            await func()
+            priority.completed += 1
+        except Exception:
+            priority.failed += 1
+            log.exception("%s failed", name)
+        finally:
+            HANDLERS.labels(priority.name, name).observe(time.perf_counter() - started)
+            priority.running -= 1
+            self._next(priority)
+
+    def _next(self, priority: PriorityClass) -> None:
+        now = time.monotonic()
+        while priority.queue and priority.running < priority.concurrency:
+            enqueued, name, func = priority.queue.popleft()
+            if priority.max_wait is not None and now - enqueued > priority.max_wait:
+                self._drop(priority, name, "stale")
+                continue
+            self._start(priority, name, func)
+
+    def stats(self) -> list[dict[str, Any]]:
+        return [priority.stats() for priority in self.classes.values()]
+
+    async def close(self) -> None:
+        tasks = list(self._tasks)
+        if self._monitor is not None:
+            tasks.append(self._monitor)
+            self._monitor = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def prioritized(class_name: str):
+    """Hand a cog listener's work to ``bot.executor`` instead of running it inline
+
+    The listener returns right away; the body runs, waits or is shed
+    according to ``class_name``.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(self, *args, **kwargs):
+            self.bot.executor.submit(
+                class_name, func.__qualname__, functools.partial(func, self, *args, **kwargs)
+            )
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,310 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2022-Present Marble
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+import bisect
+import logging
+import math
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Iterable, Iterator, Mapping
+
+from aiohttp import web
+
+log = logging.getLogger(__name__)
+
+# Seconds, from a cache hit to a slow LLM reply
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self) -> None:
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+
+class _GaugeChild:
+    __slots__ = ("value",)
+
+    def __init__(self) -> None:
+        self.value = 0.0
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.value -= amount
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: tuple[float, ...]) -> None:
+        self.bounds = bounds
+        # One slot per bound plus the +Inf overflow, not cumulative
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float | None:
+        """Estimate from the buckets, interpolating inside the one that holds it"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                if index == len(self.bounds):
+                    return self.bounds[-1]
+                lower = self.bounds[index - 1] if index else 0.0
+                return lower + (self.bounds[index] - lower) * (rank - seen) / count
+            seen += count
+        return self.bounds[-1]
+
+
+class Metric:
+    """A named metric, with one child per distinct set of label values"""
+
+    kind = "untyped"
+    _child: Callable[..., Any]
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.children: dict[tuple[str, ...], Any] = {}
+        if not self.labelnames:
+            self.children[()] = self._new_child()
+
+    def _new_child(self) -> Any:
+        return self._child()
+
+    def labels(self, *values: Any) -> Any:
+        child = self.children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            child = self.children[values] = self._new_child()
+        return child
+
+    def samples(self) -> Iterable[str]:
+        for values, child in self.children.items():
+            yield f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"
+
+
+class Counter(Metric):
+    kind = "counter"
+    _child = _CounterChild
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.children[()].inc(amount)
+
+
+class Gauge(Metric):
+    """A value that goes up and down, or is read from ``function`` when scraped"""
+
+    kind = "gauge"
+    _child = _GaugeChild
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()) -> None:
+        super().__init__(name, help, labelnames)
+        self.function: Callable[[], Mapping[tuple[str, ...], float] | float] | None = None
+
+    def set(self, value: float) -> None:
+        self.children[()].set(value)
+
+    def set_function(self, function: Callable[[], Mapping[tuple[str, ...], float] | float]) -> None:
+        """Compute the value on scrape, a mapping of label values for labelled gauges"""
+        self.function = function
+
+    def samples(self) -> Iterable[str]:
+        if self.function is None:
+            yield from super().samples()
+            return
+        values = self.function()
+        if not isinstance(values, Mapping):
+            values = {(): values}
+        for labels, value in values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, help: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS
+    ) -> None:
+        self.bounds = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames)
+
+    def _new_child(self) -> _HistogramChild:
+        return _HistogramChild(self.bounds)
+
+    def observe(self, value: float) -> None:
+        self.children[()].observe(value)
+
+    def samples(self) -> Iterable[str]:
+        for values, child in self.children.items():
+            cumulative = 0
+            for bound, count in zip((*self.bounds, math.inf), child.counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}"
+            labels = _format_labels(self.labelnames, values)
+            yield f"{self.name}_sum{labels} {_format_value(child.sum)}"
+            yield f"{self.name}_count{labels} {child.count}"
+
+
+@contextmanager
+def timed(histogram: Histogram, *labels: str) -> Iterator[None]:
+    """Observe how long the block took, with a last ``status`` label of ok or error"""
+    started = time.perf_counter()
+    status = "error"
+    try:
+        yield
+        status = "ok"
+    finally:
+        histogram.labels(*labels, status).observe(time.perf_counter() - started)
+
+
+class MetricsRegistry:
+    """Every metric the bot exports, rendered in the Prometheus text format
+
+    Observing is a dict lookup for the label values plus a few additions,
+    no locks and no allocation once a label set has been seen, so the
+    metrics stay on in production.
+    """
+
+    def __init__(self) -> None:
+        self.metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f"metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self.register(Gauge(name, help, labelnames))
+
+    def histogram(
+        self, name: str, help: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {_escape(metric.help)}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+COMMANDS = REGISTRY.histogram(
+    "bot_command_seconds", "Prefix command invocations by command and outcome", ("command", "status")
+)
+LISTENERS = REGISTRY.histogram(
+    "bot_listener_seconds", "Gateway event listener run time", ("event", "listener")
+)
+HANDLERS = REGISTRY.histogram(
+    "bot_handler_seconds", "Executor job run time by priority class and handler", ("class", "handler")
+)
+HANDLERS_SHED = REGISTRY.counter(
+    "bot_handler_shed_total", "Executor jobs dropped under load", ("class", "reason")
+)
+LOOP_LAG = REGISTRY.gauge("bot_event_loop_lag_seconds", "How late the event loop wakes up from a short sleep")
+DB_QUERIES = REGISTRY.histogram("bot_db_query_seconds", "Database statements by name", ("statement",))
+LLM_REQUESTS = REGISTRY.histogram(
+    "bot_llm_request_seconds",
+    "Upstream LLM requests until the full reply, by model and mode",
+    ("model", "mode", "status"),
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 7.5, 10.0, 15.0, 30.0, 60.0),
+)
+LLM_TOKENS = REGISTRY.counter("bot_llm_tokens_total", "Tokens reported by the upstream LLM", ("model", "kind"))
+DISCORD_REQUESTS = REGISTRY.histogram(
+    "bot_discord_request_seconds", "Discord REST requests by route and status", ("method", "route", "status")
+)
+START_TIME = REGISTRY.gauge("bot_start_time_seconds", "Unix time the process started")
+START_TIME.set(time.time())
+
+
+class MetricsServer:
+    """Serves ``/metrics`` over HTTP for a Prometheus scraper"""
+
+    def __init__(self, registry: MetricsRegistry = REGISTRY, *, host: str = "127.0.0.1", port: int = 9108) -> None:
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._runner: web.AppRunner | None = None
+
+    async def _metrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.registry.render(), content_type="text/plain", charset="utf-8")
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_get("/metrics", self._metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        log.info("Serving metrics on http://%s:%d/metrics", self.host, self.port)
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,260 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2022-Present Marble
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+from functools import partial
+from typing import Any, Awaitable, Callable, Iterable
+
+import discord
+
+from .executor import NORMAL, PriorityExecutor
+
+HANDLER_ATTR = "__message_handler__"
+
+
+class MessageContext:
+    """What every handler wants to know about a message, worked out once"""
+
+    __slots__ = (
+        "message",
+        "content",
+        "author_id",
+        "channel_id",
+        "guild_id",
+        "is_bot",
+        "is_dm",
+        "mentions_bot",
+        "prefix",
+    )
+
+    def __init__(self, message: discord.Message, bot_user: discord.ClientUser | None, prefix: str | None) -> None:
+        self.message = message
+        self.content = message.content
+        self.author_id = message.author.id
+        self.channel_id = message.channel.id
+        self.guild_id = message.guild.id if message.guild is not None else None
+        self.is_bot = message.author.bot
+        self.is_dm = message.guild is None
+        self.mentions_bot = bot_user is not None and bot_user in message.mentions
+        # The command prefix the message starts with, None for plain chatter
+        self.prefix = prefix
+
+
+class MessageHandler:
+    """A coroutine and the messages it wants
+
+    ``guilds``, ``channels`` and ``users`` are fixed id sets, the pipeline
+    indexes handlers by them. ``check`` is called last, for conditions
+    that change at runtime. ``priority`` is the executor class the
+    handler runs in.
+    """
+
+    __slots__ = (
+        "callback",
+        "name",
+        "priority",
+        "guilds",
+        "channels",
+        "users",
+        "dm_only",
+        "guild_only",
+        "mention_only",
+        "include_bots",
+        "check",
+    )
+
+    def __init__(
+        self,
+        callback: Callable[[MessageContext], Awaitable[Any]],
+        *,
+        name: str | None = None,
+        priority: str = NORMAL,
+        guilds: Iterable[int] | None = None,
+        channels: Iterable[int] | None = None,
+        users: Iterable[int] | None = None,
+        dm_only: bool = False,
+        guild_only: bool = False,
+        mention_only: bool = False,
+        include_bots: bool = False,
+        check: Callable[[MessageContext], bool] | None = None,
+    ) -> None:
+        self.callback = callback
+        self.name = name or getattr(callback, "__qualname__", repr(callback))
+        self.priority = priority
+        self.guilds = frozenset(guilds) if guilds is not None else None
+        self.channels = frozenset(channels) if channels is not None else None
+        self.users = frozenset(users) if users is not None else None
+        self.dm_only = dm_only
+        self.guild_only = guild_only
+        self.mention_only = mention_only
+        self.include_bots = include_bots
+        self.check = check
+
+    def accepts(self, ctx: MessageContext) -> bool:
+        if ctx.is_bot and not self.include_bots:
+            return False
+        if self.dm_only and not ctx.is_dm:
+            return False
+        if self.guild_only and ctx.is_dm:
+            return False
+        if self.mention_only and not ctx.mentions_bot:
+            return False
+        if self.guilds is not None and ctx.guild_id not in self.guilds:
+            return False
+        if self.channels is not None and ctx.channel_id not in self.channels:
+            return False
+        if self.users is not None and ctx.author_id not in self.users:
+            return False
+        return self.check is None or self.check(ctx)
+
+
+def message_handler(
+    *,
+    priority: str = NORMAL,
+    guilds: Iterable[int] | None = None,
+    channels: Iterable[int] | None = None,
+    users: Iterable[int] | None = None,
+    dm_only: bool = False,
+    guild_only: bool = False,
+    mention_only: bool = False,
+    include_bots: bool = False,
+    check: Callable[[Any, MessageContext], bool] | None = None,
+):
+    """Mark a cog method as a message handler, see :class:`MessageHandler`
+
+    The method is registered with the bot's pipeline when the cog is
+    added and removed with it. ``check`` gets the cog and the context.
+    """
+
+    def decorator(func):
+        setattr(
+            func,
+            HANDLER_ATTR,
+            dict(
+                priority=priority,
+                guilds=guilds,
+                channels=channels,
+                users=users,
+                dm_only=dm_only,
+                guild_only=guild_only,
+                mention_only=mention_only,
+                include_bots=include_bots,
+                check=check,
+            ),
+        )
+        return func
+
+    return decorator
+
+
+class MessagePipeline:
+    """Routes each message to the handlers that want it
+
+    Every handler sits in exactly one bucket, picked by its most selective
+    fixed filter: channel, user, guild, DMs, bot mentions, or everything.
+    A message only looks at the buckets for its own channel, author and
+    guild plus the general ones, so the work per message follows the
+    handlers that could match, not how many cogs are loaded. Matching
+    handlers are submitted to the executor under their priority.
+    """
+
+    def __init__(self, executor: PriorityExecutor) -> None:
+        self.executor = executor
+        self.by_channel: dict[int, list[MessageHandler]] = {}
+        self.by_user: dict[int, list[MessageHandler]] = {}
+        self.by_guild: dict[int, list[MessageHandler]] = {}
+        self.dm: list[MessageHandler] = []
+        self.mention: list[MessageHandler] = []
+        self.everything: list[MessageHandler] = []
+        self.owners: dict[Any, list[MessageHandler]] = {}
+
+    def _buckets(self, handler: MessageHandler) -> list[list[MessageHandler]]:
+        if handler.channels is not None:
+            return [self.by_channel.setdefault(id, []) for id in handler.channels]
+        if handler.users is not None:
+            return [self.by_user.setdefault(id, []) for id in handler.users]
+        if handler.guilds is not None:
+            return [self.by_guild.setdefault(id, []) for id in handler.guilds]
+        if handler.dm_only:
+            return [self.dm]
+        if handler.mention_only:
+            return [self.mention]
+        return [self.everything]
+
+    def add(self, handler: MessageHandler, owner: Any = None) -> MessageHandler:
+        for bucket in self._buckets(handler):
+            bucket.append(handler)
+        self.owners.setdefault(owner, []).append(handler)
+        return handler
+
+    def remove(self, handler: MessageHandler) -> None:
+        for bucket in self._buckets(handler):
+            if handler in bucket:
+                bucket.remove(handler)
+        for index in (self.by_channel, self.by_user, self.by_guild):
+            for key in [key for key, bucket in index.items() if not bucket]:
+                del index[key]
+
+    def add_cog(self, cog: Any) -> None:
+        """Register every method of ``cog`` marked with :func:`message_handler`"""
+        for name in dir(type(cog)):
+            spec = getattr(getattr(type(cog), name), HANDLER_ATTR, None)
+            if spec is None:
+                continue
+            spec = dict(spec)
+            check = spec.pop("check")
+            if check is not None:
+                check = check.__get__(cog)
+            method = getattr(cog, name)
+            self.add(
+                MessageHandler(method, name=f"{type(cog).__name__}.{name}", check=check, **spec),
+                owner=cog,
+            )
+
+    def remove_owner(self, owner: Any) -> None:
+        for handler in self.owners.pop(owner, ()):
+            self.remove(handler)
+
+    def handlers(self, ctx: MessageContext) -> list[MessageHandler]:
+        """Every handler that accepts the message"""
+        candidates = []
+        for index, key in (
+            (self.by_channel, ctx.channel_id),
+            (self.by_user, ctx.author_id),
+            (self.by_guild, ctx.guild_id),
+        ):
+            bucket = index.get(key)
+            if bucket:
+                candidates += bucket
+        if ctx.is_dm:
+            candidates += self.dm
+        if ctx.mentions_bot:
+            candidates += self.mention
+        candidates += self.everything
+        return [handler for handler in candidates if handler.accepts(ctx)]
+
+    def dispatch(self, ctx: MessageContext) -> int:
+        """Submit the matching handlers, returns how many were not shed"""
+        return sum(
+            self.executor.submit(handler.priority, handler.name, partial(handler.callback, ctx))
+            for handler in self.handlers(ctx)
+        )
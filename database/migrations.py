@@ -0,0 +1,271 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2022-Present Marble
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+import logging
+
+import asqlite
+
+log = logging.getLogger(__name__)
+
+# Ordered schema history. The index in this list + 1 is the version stored in
+# PRAGMA user_version, so only ever append: never edit or reorder a migration
+# that has shipped, existing database.db files depend on it.
+MIGRATIONS: list[tuple[str, tuple[str, ...]]] = [
+    (
+        "baseline schema",
+        (
+            """CREATE TABLE IF NOT EXISTS blocked (
+            name text NOT NULL,
+            user_id integer,
+            channel_id integer,
+            endtime text,
+            reason text)""",
+            """CREATE TABLE IF NOT EXISTS permissions (
+            name text NOT NULL,
+            user_id integer,
+            allowed integer)""",
+            """CREATE TABLE IF NOT EXISTS avatars (
+            name text NOT NULL,
+            user_id integer,count integer,url text)""",
+            """CREATE TABLE IF NOT EXISTS reactions (
+            name text NOT NULL,
+            user_id integer,
+            guild integer,
+            emote text,
+            start_count integer,
+            end_count integer)""",
+            """CREATE TABLE IF NOT EXISTS message (
+            channel integer NOT NULL,
+            author integer,
+            message text,
+            response text NOT NULL)""",
+            """CREATE TABLE IF NOT EXISTS prefix (
+            guild integer NOT NULL,
+            prefix text)""",
+            """CREATE TABLE IF NOT EXISTS chat_whitelist (
+            user_id integer PRIMARY KEY,
+            name text NOT NULL)""",
+            """CREATE TABLE IF NOT EXISTS chat_memory (
+            id integer PRIMARY KEY AUTOINCREMENT,
+            user_id integer NOT NULL,
+            role text NOT NULL,
+            content text NOT NULL,
+            timestamp text NOT NULL)""",
+        ),
+    ),
+    (
+        "keys, indexes and split permissions",
+        (
+            # permissions held users (allowed=1) and blocked channels (allowed=0)
+            # in the same user_id column, give each kind of row its own table
+            """CREATE TABLE user_permissions (
+            user_id integer PRIMARY KEY,
+            name text NOT NULL)""",
+            """CREATE TABLE blocked_channels (
+            channel_id integer PRIMARY KEY,
+            name text NOT NULL)""",
+            """INSERT OR IGNORE INTO user_permissions(user_id, name)
+            SELECT user_id, name FROM permissions WHERE allowed=1 AND user_id IS NOT NULL""",
+            """INSERT OR IGNORE INTO blocked_channels(channel_id, name)
+            SELECT user_id, name FROM permissions WHERE allowed=0 AND user_id IS NOT NULL""",
+            "DROP TABLE permissions",
+            # reactions are looked up by user on every message
+            """CREATE TABLE reactions_new (
+            id integer PRIMARY KEY,
+            name text NOT NULL,
+            user_id integer NOT NULL,
+            guild integer,
+            emote text NOT NULL,
+            start_count integer NOT NULL DEFAULT 0,
+            end_count integer NOT NULL DEFAULT 0)""",
+            """INSERT INTO reactions_new(name, user_id, guild, emote, start_count, end_count)
+            SELECT name, user_id, guild, emote, coalesce(start_count, 0), coalesce(end_count, 0)
+            FROM reactions WHERE user_id IS NOT NULL AND emote IS NOT NULL""",
+            "DROP TABLE reactions",
+            "ALTER TABLE reactions_new RENAME TO reactions",
+            "CREATE INDEX reactions_user_id_idx ON reactions(user_id)",
+            # one response per trigger, the unique index also serves channel lookups
+            """CREATE TABLE message_new (
+            id integer PRIMARY KEY,
+            channel integer NOT NULL,
+            author integer NOT NULL DEFAULT 0,
+            message text NOT NULL,
+            response text NOT NULL,
+            UNIQUE (channel, author, message))""",
+            """INSERT OR REPLACE INTO message_new(channel, author, message, response)
+            SELECT channel, coalesce(author, 0), message, response
+            FROM message WHERE message IS NOT NULL ORDER BY rowid""",
+            "DROP TABLE message",
+            "ALTER TABLE message_new RENAME TO message",
+            # one prefix per guild, keep the most recently written one
+            """CREATE TABLE prefix_new (
+            guild integer PRIMARY KEY,
+            prefix text NOT NULL)""",
+            """INSERT OR REPLACE INTO prefix_new(guild, prefix)
+            SELECT guild, prefix FROM prefix WHERE prefix IS NOT NULL ORDER BY rowid""",
+            "DROP TABLE prefix",
+            "ALTER TABLE prefix_new RENAME TO prefix",
+            "CREATE INDEX chat_memory_user_idx ON chat_memory(user_id, timestamp)",
+        ),
+    ),
+    (
+        "auto-response match modes",
+        (
+            "ALTER TABLE message ADD COLUMN match_type text NOT NULL DEFAULT 'exact'",
+            "ALTER TABLE message ADD COLUMN ignore_case integer NOT NULL DEFAULT 0",
+        ),
+    ),
+    (
+        "chat_memory epoch timestamps",
+        (
+            # ISO text sorted correctly only by accident of formatting, store
+            # unix seconds and order turns by their rowid instead
+            """CREATE TABLE chat_memory_new (
+            id integer PRIMARY KEY AUTOINCREMENT,
+            user_id integer NOT NULL,
+            role text NOT NULL,
+            content text NOT NULL,
+            timestamp integer NOT NULL)""",
+            """INSERT INTO chat_memory_new(id, user_id, role, content, timestamp)
+            SELECT id, user_id, role, content,
+            coalesce(CAST(strftime('%s', timestamp) AS integer), 0)
+            FROM chat_memory""",
+            "DROP TABLE chat_memory",
+            "ALTER TABLE chat_memory_new RENAME TO chat_memory",
+            "CREATE INDEX chat_memory_user_id_idx ON chat_memory(user_id, id)",
+        ),
+    ),
+    (
+        "chat_memory token estimates",
+        ("ALTER TABLE chat_memory ADD COLUMN tokens integer",),
+    ),
+    (
+        "chat response cache opt-outs",
+        (
+            """CREATE TABLE chat_cache_opt_out (
+            id integer NOT NULL,
+            kind text NOT NULL,
+            PRIMARY KEY (id, kind))""",
+        ),
+    ),
+    (
+        "rolling chat summaries",
+        (
+            # One summary per user covering every chat_memory row up to through_id
+            """CREATE TABLE chat_summary (
+            user_id integer PRIMARY KEY,
+            content text NOT NULL,
+            through_id integer NOT NULL,
+            tokens integer NOT NULL,
+            timestamp integer NOT NULL)""",
+        ),
+    ),
+    (
+        "full text search over chat_memory",
+        (
+            # Contentless, chat_memory holds the text. The owner column lets a
+            # search intersect with one user's rows inside the index instead
+            # of filtering every match afterwards.
+            """CREATE VIRTUAL TABLE chat_memory_fts USING fts5(
+            owner, content, content='', tokenize='porter unicode61')""",
+            """CREATE TRIGGER chat_memory_fts_insert AFTER INSERT ON chat_memory BEGIN
+            INSERT INTO chat_memory_fts(rowid, owner, content)
+            VALUES (new.id, new.user_id, new.content);
+            END""",
+            """CREATE TRIGGER chat_memory_fts_delete AFTER DELETE ON chat_memory BEGIN
+            INSERT INTO chat_memory_fts(chat_memory_fts, rowid, owner, content)
+            VALUES ('delete', old.id, old.user_id, old.content);
+            END""",
+            """CREATE TRIGGER chat_memory_fts_update AFTER UPDATE OF user_id, content ON chat_memory BEGIN
+            INSERT INTO chat_memory_fts(chat_memory_fts, rowid, owner, content)
+            VALUES ('delete', old.id, old.user_id, old.content);
+            INSERT INTO chat_memory_fts(rowid, owner, content)
+            VALUES (new.id, new.user_id, new.content);
+            END""",
+            # Backfill existing history
+            """INSERT INTO chat_memory_fts(rowid, owner, content)
+            SELECT id, user_id, content FROM chat_memory""",
+        ),
+    ),
+    (
+        "chat token usage",
+        (
+            # Tokens spent per user or guild (kind) in each minute (bucket,
+            # unix time // 60), only as far back as the longest quota window
+            """CREATE TABLE chat_usage (
+            kind text NOT NULL,
+            id integer NOT NULL,
+            bucket integer NOT NULL,
+            tokens integer NOT NULL,
+            PRIMARY KEY (kind, id, bucket)) WITHOUT ROWID""",
+            "CREATE INDEX chat_usage_bucket_idx ON chat_usage(bucket)",
+        ),
+    ),
+    (
+        "multiple prefixes per guild",
+        (
+            """CREATE TABLE prefix_new (
+            guild integer NOT NULL,
+            prefix text NOT NULL,
+            PRIMARY KEY (guild, prefix))""",
+            "INSERT INTO prefix_new(guild, prefix) SELECT guild, prefix FROM prefix",
+            "DROP TABLE prefix",
+            "ALTER TABLE prefix_new RENAME TO prefix",
+        ),
+    ),
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+async def migrate(pool: asqlite.Pool) -> int:
+    """Bring the database up to SCHEMA_VERSION, returns the starting version
+
+    Each migration runs in its own transaction together with the
+    user_version bump, so an interrupted upgrade leaves the file at the
+    last fully applied version and is simply resumed on the next start.
+    """
+    async with pool.acquire() as conn:
+        row = await conn.fetchone("PRAGMA user_version")
+        current = row[0]
+
+        if current > SCHEMA_VERSION:
+            raise RuntimeError(
+                f"database schema v{current} is newer than this bot (v{SCHEMA_VERSION})"
+            )
+
+        if current == 0 and await conn.fetchone("SELECT 1 FROM sqlite_schema") is None:
+            # auto_vacuum can only change with a VACUUM, which is instant while
+            # the file is empty. Lets retention hand freed pages back later.
+            await conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            await conn.execute("VACUUM")
+
+        for version, (name, statements) in enumerate(MIGRATIONS[current:], start=current + 1):
+            log.info("Applying database migration %d: %s", version, name)
+            async with conn.transaction():
+                for statement in statements:
+                    await conn.execute(statement)
+                # PRAGMA does not take parameters, version is always an int here
+                await conn.execute(f"PRAGMA user_version = {version}")
+
+    return current
@@ -0,0 +1,72 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2022-Present Marble
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+import sqlite3
+from typing import Any
+
+import asqlite
+
+# Tuned for a single-host bot: WAL lets readers run while a writer commits,
+# synchronous=NORMAL is durable under WAL except on power loss, and a
+# memory-mapped file plus a larger page cache keep hot tables out of read().
+DEFAULT_PRAGMAS: dict[str, Any] = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "temp_store": "MEMORY",
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64 * 1024,  # negative means KiB, so 64 MiB
+    "busy_timeout": 5000,
+}
+
+
+def _pragma_initializer(pragmas: dict[str, Any]):
+    def init(conn: sqlite3.Connection) -> None:
+        for name, value in pragmas.items():
+            conn.execute(f"PRAGMA {name}={value}")
+
+    return init
+
+
+async def create_pool(
+    database_file: str,
+    *,
+    size: int = 4,
+    pragmas: dict[str, Any] | None = None,
+    cached_statements: int = 256,
+) -> asqlite.Pool:
+    """Create the long-lived connection pool shared by every cog
+
+    Each connection keeps its own compiled statement cache, so the
+    parameterized queries in :mod:`database.repository` are only prepared
+    once per connection instead of once per call.
+    """
+    settings = dict(DEFAULT_PRAGMAS)
+    if pragmas:
+        settings.update(pragmas)
+
+    return await asqlite.create_pool(
+        database_file,
+        size=size,
+        init=_pragma_initializer(settings),
+        cached_statements=cached_statements,
+    )
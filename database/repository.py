@@ -0,0 +1,384 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2022-Present Marble
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+import time
+from contextlib import contextmanager
+from typing import Any, Iterable, Iterator
+
+import asqlite
+
+# Every statement the bot runs lives here so each pooled connection can keep
+# it in its prepared-statement cache. Never build SQL with string formatting.
+
+SELECT_USER_PERMISSIONS = "SELECT user_id FROM user_permissions"
+SELECT_USER_PERMISSION = "SELECT 1 FROM user_permissions WHERE user_id=?"
+INSERT_USER_PERMISSION = "INSERT OR IGNORE INTO user_permissions(user_id, name) VALUES(?,?)"
+DELETE_USER_PERMISSION = "DELETE FROM user_permissions WHERE user_id=?"
+
+SELECT_BLOCKED_CHANNELS = "SELECT channel_id FROM blocked_channels"
+SELECT_BLOCKED_CHANNEL = "SELECT 1 FROM blocked_channels WHERE channel_id=?"
+INSERT_BLOCKED_CHANNEL = "INSERT OR IGNORE INTO blocked_channels(channel_id, name) VALUES(?,?)"
+DELETE_BLOCKED_CHANNEL = "DELETE FROM blocked_channels WHERE channel_id=?"
+
+SELECT_REACTIONS = "SELECT id, user_id, guild, emote, start_count, end_count FROM reactions"
+SELECT_USER_REACTIONS = SELECT_REACTIONS + " WHERE user_id=?"
+INSERT_REACTION = """INSERT INTO reactions(name, user_id, guild, emote, start_count, end_count)
+                     VALUES(?,?,?,?,?,?)"""
+UPDATE_REACTION_COUNT = "UPDATE reactions SET start_count=? WHERE id=?"
+DELETE_REACTIONS = "DELETE FROM reactions WHERE user_id=?"
+
+SELECT_AUTO_RESPONSES = """SELECT id, channel, author, message, response, match_type, ignore_case
+                           FROM message"""
+SELECT_CHANNEL_AUTO_RESPONSES = SELECT_AUTO_RESPONSES + " WHERE channel=?"
+INSERT_AUTO_RESPONSE = """INSERT INTO message(channel, author, message, response, match_type, ignore_case)
+                          VALUES(?,?,?,?,?,?)
+                          ON CONFLICT(channel, author, message) DO UPDATE SET
+                          response=excluded.response,
+                          match_type=excluded.match_type,
+                          ignore_case=excluded.ignore_case
+                          RETURNING id"""
+DELETE_AUTO_RESPONSE = "DELETE FROM message WHERE channel=? AND message=?"
+
+SELECT_PREFIXES = "SELECT guild, prefix FROM prefix ORDER BY rowid"
+DELETE_GUILD_PREFIXES = "DELETE FROM prefix WHERE guild=?"
+INSERT_PREFIX = "INSERT OR IGNORE INTO prefix(guild, prefix) VALUES(?,?)"
+DELETE_PREFIX = "DELETE FROM prefix WHERE guild=? AND prefix=?"
+
+SELECT_WHITELIST = "SELECT user_id, name FROM chat_whitelist"
+SELECT_WHITELISTED = "SELECT 1 FROM chat_whitelist WHERE user_id=?"
+INSERT_WHITELIST = "INSERT INTO chat_whitelist(user_id, name) VALUES(?,?)"
+DELETE_WHITELIST = "DELETE FROM chat_whitelist WHERE user_id=?"
+
+SELECT_CACHE_OPT_OUTS = "SELECT id, kind FROM chat_cache_opt_out"
+INSERT_CACHE_OPT_OUT = "INSERT OR IGNORE INTO chat_cache_opt_out(id, kind) VALUES(?,?)"
+DELETE_CACHE_OPT_OUT = "DELETE FROM chat_cache_opt_out WHERE id=? AND kind=?"
+
+SELECT_HISTORY = """SELECT id, role, content, tokens FROM chat_memory
+                    WHERE user_id=? AND id>?
+                    ORDER BY id DESC
+                    LIMIT ?"""
+SELECT_OLDEST_TURNS = """SELECT id, role, content, tokens FROM chat_memory
+                         WHERE user_id=? AND id>?
+                         ORDER BY id
+                         LIMIT ?"""
+INSERT_CHAT_MESSAGE = """INSERT INTO chat_memory(user_id, role, content, timestamp, tokens)
+                         VALUES(?,?,?,?,?)"""
+DELETE_HISTORY = "DELETE FROM chat_memory WHERE user_id=?"
+# Best BM25 hits before ?3, each with the other half of its exchange. A
+# user turn is followed by its reply, both are inserted in one transaction.
+SEARCH_HISTORY = """WITH hits(id) AS (
+                        SELECT rowid FROM chat_memory_fts
+                        WHERE chat_memory_fts MATCH ?1 AND rowid < ?3
+                        ORDER BY bm25(chat_memory_fts, 0.0, 1.0)
+                        LIMIT ?2),
+                    wanted(id) AS (
+                        SELECT id FROM hits
+                        UNION SELECT id + 1 FROM hits
+                        UNION SELECT id - 1 FROM hits)
+                    SELECT m.id, m.role, m.content, m.tokens
+                    FROM wanted JOIN chat_memory m ON m.id = wanted.id
+                    WHERE m.user_id = ?4 AND m.id < ?3 AND (
+                        m.id IN hits
+                        OR (m.role = 'assistant' AND m.id - 1 IN hits)
+                        OR (m.role = 'user' AND m.id + 1 IN hits))
+                    ORDER BY m.id"""
+
+SELECT_SUMMARY = "SELECT content, through_id, tokens FROM chat_summary WHERE user_id=?"
+# Only stored while the last summarized turn still exists, so a summary
+# finishing after the history was cleared does not bring it back
+UPSERT_SUMMARY = """INSERT INTO chat_summary(user_id, content, through_id, tokens, timestamp)
+                    SELECT ?1, ?2, ?3, ?4, ?5
+                    WHERE EXISTS (SELECT 1 FROM chat_memory WHERE id=?3 AND user_id=?1)
+                    ON CONFLICT(user_id) DO UPDATE SET
+                    content=excluded.content, through_id=excluded.through_id,
+                    tokens=excluded.tokens, timestamp=excluded.timestamp"""
+DELETE_SUMMARY = "DELETE FROM chat_summary WHERE user_id=?"
+
+SELECT_USAGE = """SELECT kind, id, bucket, tokens FROM chat_usage
+                  WHERE bucket>=? ORDER BY bucket"""
+ADD_USAGE = """INSERT INTO chat_usage(kind, id, bucket, tokens) VALUES(?,?,?,?)
+               ON CONFLICT(kind, id, bucket) DO UPDATE SET tokens=tokens + excluded.tokens"""
+DELETE_OLD_USAGE = "DELETE FROM chat_usage WHERE bucket<?"
+
+
+# Statement text -> constant name, the label queries are timed under
+STATEMENT_NAMES = {sql: name for name, sql in globals().items() if name.isupper() and isinstance(sql, str)}
+
+
+class Repository:
+    """Typed access to the bot database over a shared connection pool
+
+    ``query_seconds`` is an optional histogram labelled by statement name,
+    every query is timed into it including the wait for a connection.
+    """
+
+    def __init__(self, pool: asqlite.Pool, query_seconds: Any = None) -> None:
+        self.pool = pool
+        self.query_seconds = query_seconds
+
+    @contextmanager
+    def timed(self, statement: str) -> Iterator[None]:
+        if self.query_seconds is None:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.query_seconds.labels(statement).observe(
+                time.perf_counter() - started
+            )
+
+    async def fetchall(self, sql: str, params: tuple = ()) -> list:
+        with self.timed(STATEMENT_NAMES.get(sql, "other")):
+            async with self.pool.acquire() as conn:
+                async with conn.execute(sql, params) as cursor:
+                    return await cursor.fetchall()
+
+    async def fetchone(self, sql: str, params: tuple = ()):
+        with self.timed(STATEMENT_NAMES.get(sql, "other")):
+            async with self.pool.acquire() as conn:
+                async with conn.execute(sql, params) as cursor:
+                    return await cursor.fetchone()
+
+    async def execute(self, sql: str, params: tuple = ()) -> int:
+        """Run a single write and return the number of affected rows"""
+        with self.timed(STATEMENT_NAMES.get(sql, "other")):
+            async with self.pool.acquire() as conn:
+                async with conn.execute(sql, params) as cursor:
+                    return cursor.get_cursor().rowcount
+
+    async def insert(self, sql: str, params: tuple = ()) -> int:
+        """Run a single insert and return the new rowid"""
+        with self.timed(STATEMENT_NAMES.get(sql, "other")):
+            async with self.pool.acquire() as conn:
+                async with conn.execute(sql, params) as cursor:
+                    return cursor.get_cursor().lastrowid
+
+    async def executemany(self, sql: str, params: Iterable[tuple]) -> None:
+        """Run a batch of writes in one transaction"""
+        with self.timed(STATEMENT_NAMES.get(sql, "other")):
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    await conn.executemany(sql, params)
+
+    # Permissions
+
+    async def user_permissions(self) -> set[int]:
+        return {row[0] for row in await self.fetchall(SELECT_USER_PERMISSIONS)}
+
+    async def has_permission(self, user_id: int) -> bool:
+        return await self.fetchone(SELECT_USER_PERMISSION, (user_id,)) is not None
+
+    async def add_permission(self, user_id: int, name: str) -> bool:
+        """Grant a user permissions, returns False if they already had them"""
+        return await self.execute(INSERT_USER_PERMISSION, (user_id, name)) > 0
+
+    async def remove_permission(self, user_id: int) -> bool:
+        return await self.execute(DELETE_USER_PERMISSION, (user_id,)) > 0
+
+    # Blocked channels
+
+    async def blocked_channels(self) -> set[int]:
+        return {row[0] for row in await self.fetchall(SELECT_BLOCKED_CHANNELS)}
+
+    async def is_channel_blocked(self, channel_id: int) -> bool:
+        return await self.fetchone(SELECT_BLOCKED_CHANNEL, (channel_id,)) is not None
+
+    async def block_channel(self, channel_id: int, name: str) -> bool:
+        """Block commands in a channel, returns False if it was already blocked"""
+        return await self.execute(INSERT_BLOCKED_CHANNEL, (channel_id, name)) > 0
+
+    async def unblock_channel(self, channel_id: int) -> bool:
+        return await self.execute(DELETE_BLOCKED_CHANNEL, (channel_id,)) > 0
+
+    # Reactions
+
+    async def reactions(self) -> list:
+        return await self.fetchall(SELECT_REACTIONS)
+
+    async def user_reactions(self, user_id: int) -> list:
+        return await self.fetchall(SELECT_USER_REACTIONS, (user_id,))
+
+    async def add_reaction(
+        self, name: str, user_id: int, guild: int, emote: str, start_count: int, end_count: int
+    ) -> int:
+        return await self.insert(INSERT_REACTION, (name, user_id, guild, emote, start_count, end_count))
+
+    async def set_reaction_counts(self, counts: Iterable[tuple[int, int]]) -> None:
+        """Persist (start_count, reaction id) pairs in one transaction"""
+        await self.executemany(UPDATE_REACTION_COUNT, counts)
+
+    async def remove_reactions(self, user_id: int) -> int:
+        return await self.execute(DELETE_REACTIONS, (user_id,))
+
+    # Auto responses
+
+    async def auto_responses(self) -> list:
+        return await self.fetchall(SELECT_AUTO_RESPONSES)
+
+    async def channel_auto_responses(self, channel_id: int) -> list:
+        return await self.fetchall(SELECT_CHANNEL_AUTO_RESPONSES, (channel_id,))
+
+    async def add_auto_response(
+        self,
+        channel_id: int,
+        author_id: int,
+        message: str,
+        response: str,
+        match_type: str = "exact",
+        ignore_case: bool = False,
+    ) -> int:
+        rows = await self.fetchall(
+            INSERT_AUTO_RESPONSE,
+            (channel_id, author_id, message, response, match_type, int(ignore_case)),
+        )
+        return rows[0][0]
+
+    async def remove_auto_response(self, channel_id: int, message: str) -> int:
+        return await self.execute(DELETE_AUTO_RESPONSE, (channel_id, message))
+
+    # Prefixes
+
+    async def prefixes(self) -> dict[int, list[str]]:
+        prefixes: dict[int, list[str]] = {}
+        for guild, prefix in await self.fetchall(SELECT_PREFIXES):
+            prefixes.setdefault(guild, []).append(prefix)
+        return prefixes
+
+    async def set_prefix(self, guild_id: int, prefix: str) -> bool:
+        """Replace all of a guild's prefixes, returns True if it had any"""
+        with self.timed("set_prefix"):
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    async with conn.execute(DELETE_GUILD_PREFIXES, (guild_id,)) as cursor:
+                        existing = cursor.get_cursor().rowcount
+                    await conn.execute(INSERT_PREFIX, (guild_id, prefix))
+        return existing > 0
+
+    async def add_prefix(self, guild_id: int, prefix: str) -> bool:
+        return await self.execute(INSERT_PREFIX, (guild_id, prefix)) > 0
+
+    async def remove_prefix(self, guild_id: int, prefix: str) -> bool:
+        return await self.execute(DELETE_PREFIX, (guild_id, prefix)) > 0
+
+    # Chat whitelist
+
+    async def whitelist(self) -> list:
+        return await self.fetchall(SELECT_WHITELIST)
+
+    async def is_whitelisted(self, user_id: int) -> bool:
+        return await self.fetchone(SELECT_WHITELISTED, (user_id,)) is not None
+
+    async def add_whitelist(self, user_id: int, name: str) -> None:
+        await self.execute(INSERT_WHITELIST, (user_id, name))
+
+    async def remove_whitelist(self, user_id: int) -> int:
+        return await self.execute(DELETE_WHITELIST, (user_id,))
+
+    # Chat response cache opt-outs, kind is "user" or "guild"
+
+    async def cache_opt_outs(self) -> list:
+        return await self.fetchall(SELECT_CACHE_OPT_OUTS)
+
+    async def add_cache_opt_out(self, id: int, kind: str) -> bool:
+        return await self.execute(INSERT_CACHE_OPT_OUT, (id, kind)) > 0
+
+    async def remove_cache_opt_out(self, id: int, kind: str) -> bool:
+        return await self.execute(DELETE_CACHE_OPT_OUT, (id, kind)) > 0
+
+    # Chat memory
+
+    async def conversation_history(self, user_id: int, limit: int, after_id: int = 0) -> list[dict[str, Any]]:
+        """The newest ``limit`` turns after ``after_id``, in chronological order"""
+        rows = await self.fetchall(SELECT_HISTORY, (user_id, after_id, limit))
+        # Newest first from the query, callers want chronological order
+        return [{"id": row[0], "role": row[1], "content": row[2], "tokens": row[3]} for row in reversed(rows)]
+
+    async def oldest_turns(self, user_id: int, after_id: int, limit: int) -> list[dict[str, Any]]:
+        """The oldest ``limit`` turns after ``after_id``, in chronological order"""
+        rows = await self.fetchall(SELECT_OLDEST_TURNS, (user_id, after_id, limit))
+        return [{"id": row[0], "role": row[1], "content": row[2], "tokens": row[3]} for row in rows]
+
+    async def search_history(
+        self, user_id: int, query: str, limit: int, before_id: int
+    ) -> list[dict[str, Any]]:
+        """Turns matching an FTS5 ``query`` older than ``before_id``, chronologically
+
+        ``query`` must already be restricted to the user's ``owner`` column.
+        """
+        rows = await self.fetchall(SEARCH_HISTORY, (query, limit, before_id, user_id))
+        return [{"id": row[0], "role": row[1], "content": row[2], "tokens": row[3]} for row in rows]
+
+    async def save_chat_messages(
+        self, user_id: int, messages: Iterable[dict[str, Any]], timestamp: int
+    ) -> list[int]:
+        """Store the turns of one exchange in a single transaction, returns their ids"""
+        ids = []
+        with self.timed("save_chat_messages"):
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    for m in messages:
+                        async with conn.execute(
+                            INSERT_CHAT_MESSAGE, (user_id, m["role"], m["content"], timestamp, m.get("tokens"))
+                        ) as cursor:
+                            ids.append(cursor.get_cursor().lastrowid)
+        return ids
+
+    async def clear_history(self, user_id: int) -> None:
+        """Forget a user's turns and their summary"""
+        with self.timed("clear_history"):
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    await conn.execute(DELETE_HISTORY, (user_id,))
+                    await conn.execute(DELETE_SUMMARY, (user_id,))
+
+    async def chat_summary(self, user_id: int) -> dict[str, Any] | None:
+        row = await self.fetchone(SELECT_SUMMARY, (user_id,))
+        if row is None:
+            return None
+        return {"content": row[0], "through_id": row[1], "tokens": row[2]}
+
+    async def save_chat_summary(
+        self, user_id: int, content: str, through_id: int, tokens: int, timestamp: int
+    ) -> bool:
+        """Store a summary of every turn up to ``through_id``
+
+        Returns False if that turn no longer exists, e.g. the history was
+        cleared while the summary was being written.
+        """
+        return await self.execute(UPSERT_SUMMARY, (user_id, content, through_id, tokens, timestamp)) > 0
+
+    # Chat token usage, kind is "user" or "guild"
+
+    async def chat_usage(self, since_bucket: int) -> list:
+        """Per minute token totals from ``since_bucket`` on, oldest first"""
+        return await self.fetchall(SELECT_USAGE, (since_bucket,))
+
+    async def add_chat_usage(self, rows: Iterable[tuple[str, int, int, int]], before_bucket: int) -> None:
+        """Add ``(kind, id, bucket, tokens)`` rows and drop buckets older than ``before_bucket``"""
+        with self.timed("add_chat_usage"):
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    await conn.executemany(ADD_USAGE, rows)
+                    await conn.execute(DELETE_OLD_USAGE, (before_bucket,))
@@ -0,0 +1,210 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2022-Present Marble
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Mapping
+
+import asqlite
+
+log = logging.getLogger(__name__)
+
+# Each batch is its own short write transaction, chat writes get in between
+DELETE_OLDEST_FOR_USER = """DELETE FROM chat_memory WHERE id IN (
+                            SELECT id FROM chat_memory WHERE user_id=? ORDER BY id LIMIT ?)
+                            RETURNING user_id"""
+# Ids grow with time, so walking them in order finds expired rows first
+DELETE_OLDER_THAN = """DELETE FROM chat_memory WHERE id IN (
+                       SELECT id FROM chat_memory WHERE timestamp < ? ORDER BY id LIMIT ?)
+                       RETURNING user_id"""
+DELETE_OLDEST = """DELETE FROM chat_memory WHERE id IN (
+                   SELECT id FROM chat_memory ORDER BY id LIMIT ?)
+                   RETURNING user_id"""
+DELETE_OLD_SUMMARIES = "DELETE FROM chat_summary WHERE timestamp < ? RETURNING user_id"
+SELECT_USERS_OVER = """SELECT user_id, count(*) - ? FROM chat_memory
+                       GROUP BY user_id HAVING count(*) > ?"""
+
+
+class RetentionReport:
+    """What one retention run removed and how much of the file it gave back"""
+
+    __slots__ = ("by_turns", "by_age", "by_cap", "summaries", "users", "size_before", "size_after", "duration")
+
+    def __init__(self) -> None:
+        self.by_turns = 0
+        self.by_age = 0
+        self.by_cap = 0
+        self.summaries = 0
+        # Users whose stored history changed, in-memory copies are stale
+        self.users: set[int] = set()
+        self.size_before = 0
+        self.size_after = 0
+        self.duration = 0.0
+
+    @property
+    def deleted(self) -> int:
+        return self.by_turns + self.by_age + self.by_cap
+
+    @property
+    def reclaimed(self) -> int:
+        return max(0, self.size_before - self.size_after)
+
+
+class Retention:
+    """Keeps chat_memory, and with it database.db, from growing without bound
+
+    Three independent limits, 0 disables each: ``max_turns_per_user``
+    keeps only a user's newest turns, ``max_age_days`` drops turns (and
+    summaries) older than that, and ``max_size_mb`` caps the database by
+    dropping the oldest turns of anyone until the pages in use fit. The
+    cap covers the whole file, but only chat turns are deleted to meet it.
+    Rows are deleted ``batch_size`` at a time with ``pause`` seconds
+    between batches, then freed pages are handed back to the filesystem
+    with an incremental vacuum.
+
+    Databases created before migrate() enabled auto_vacuum need one full VACUUM
+    to switch; that happens only when ``full_vacuum`` is set since it
+    rewrites the whole file and holds the write lock until done.
+    """
+
+    def __init__(
+        self,
+        pool: asqlite.Pool,
+        *,
+        max_turns_per_user: int = 0,
+        max_age_days: float = 0,
+        max_size_mb: float = 0,
+        batch_size: int = 500,
+        pause: float = 0.05,
+        full_vacuum: bool = False,
+    ) -> None:
+        self.pool = pool
+        self.max_turns_per_user = max_turns_per_user
+        self.max_age_days = max_age_days
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self.batch_size = batch_size
+        self.pause = pause
+        self.full_vacuum = full_vacuum
+
+    @classmethod
+    def from_config(cls, pool: asqlite.Pool, retention_config: Mapping[str, Any]) -> "Retention":
+        return cls(
+            pool,
+            max_turns_per_user=retention_config.get("max_turns_per_user", 0),
+            max_age_days=retention_config.get("max_age_days", 0),
+            max_size_mb=retention_config.get("max_size_mb", 0),
+            batch_size=retention_config.get("batch_size", 500),
+            pause=retention_config.get("pause", 0.05),
+            full_vacuum=retention_config.get("full_vacuum", False),
+        )
+
+    async def _delete(self, sql: str, params: tuple, report: RetentionReport) -> int:
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetchall(sql, params)
+        report.users.update(row[0] for row in rows)
+        if rows:
+            await asyncio.sleep(self.pause)
+        return len(rows)
+
+    async def _file_size(self) -> int:
+        async with self.pool.acquire() as conn:
+            page_count = (await conn.fetchone("PRAGMA page_count"))[0]
+            page_size = (await conn.fetchone("PRAGMA page_size"))[0]
+        return page_count * page_size
+
+    async def _used_size(self) -> int:
+        """Bytes in pages holding data, free pages waiting for the vacuum don't count"""
+        async with self.pool.acquire() as conn:
+            page_count = (await conn.fetchone("PRAGMA page_count"))[0]
+            free = (await conn.fetchone("PRAGMA freelist_count"))[0]
+            page_size = (await conn.fetchone("PRAGMA page_size"))[0]
+        return (page_count - free) * page_size
+
+    async def run(self) -> RetentionReport:
+        report = RetentionReport()
+        started = time.monotonic()
+        report.size_before = await self._file_size()
+
+        if self.max_turns_per_user:
+            async with self.pool.acquire() as conn:
+                over = await conn.fetchall(SELECT_USERS_OVER, (self.max_turns_per_user, self.max_turns_per_user))
+            for user_id, excess in over:
+                while excess > 0:
+                    deleted = await self._delete(
+                        DELETE_OLDEST_FOR_USER, (user_id, min(excess, self.batch_size)), report
+                    )
+                    if not deleted:
+                        break
+                    excess -= deleted
+                    report.by_turns += deleted
+
+        if self.max_age_days:
+            cutoff = int(time.time() - self.max_age_days * 86400)
+            while deleted := await self._delete(DELETE_OLDER_THAN, (cutoff, self.batch_size), report):
+                report.by_age += deleted
+            report.summaries = await self._delete(DELETE_OLD_SUMMARIES, (cutoff,), report)
+
+        if self.max_size:
+            # Deleting the oldest ids empties whole leaf pages, so the size
+            # in use goes down batch by batch
+            while await self._used_size() > self.max_size:
+                deleted = await self._delete(DELETE_OLDEST, (self.batch_size,), report)
+                if not deleted:
+                    break
+                report.by_cap += deleted
+
+        await self.vacuum()
+        report.size_after = await self._file_size()
+        report.duration = time.monotonic() - started
+        log.info(
+            "Retention removed %d chat turns and %d summaries, reclaimed %d bytes in %.1fs",
+            report.deleted,
+            report.summaries,
+            report.reclaimed,
+            report.duration,
+        )
+        return report
+
+    async def vacuum(self, pages_per_step: int = 1000) -> None:
+        """Return free pages to the filesystem a slice at a time"""
+        async with self.pool.acquire() as conn:
+            mode = (await conn.fetchone("PRAGMA auto_vacuum"))[0]
+            if mode != 2:
+                if not self.full_vacuum:
+                    return
+                log.info("Converting database to incremental auto_vacuum with a full VACUUM")
+                await conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                await conn.execute("VACUUM")
+                return
+
+        while True:
+            async with self.pool.acquire() as conn:
+                free = (await conn.fetchone("PRAGMA freelist_count"))[0]
+                if not free:
+                    # Under WAL the file only shrinks once the log is checkpointed
+                    await conn.fetchall("PRAGMA wal_checkpoint(TRUNCATE)")
+                    return
+                # Frees one page per step, fetch everything to run it to the end
+                await conn.fetchall(f"PRAGMA incremental_vacuum({min(free, pages_per_step)})")
+            await asyncio.sleep(self.pause)
@@ -0,0 +1,208 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2022-Present Marble
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+import time
+from typing import Any, AsyncIterator, Callable, Mapping
+
+import aiohttp
+
+from .scheduler import RateLimited, parse_duration
+from .streaming import sse_events
+
+
+class BackendError(Exception):
+    """The upstream answered with a non-retryable error status"""
+
+    def __init__(self, status: int, text: str) -> None:
+        super().__init__(f"API request failed with status {status}: {text}")
+        self.status = status
+        self.text = text
+
+
+class Completion:
+    """A finished chat completion"""
+
+    __slots__ = ("content", "model", "usage", "latency")
+
+    def __init__(self, content: str, model: str, usage: dict[str, int] | None, latency: float) -> None:
+        self.content = content
+        self.model = model
+        self.usage = usage
+        self.latency = latency
+
+
+class CompletionStream:
+    """Async iterator over the content deltas of a streamed completion
+
+    Entering the context sends the request and raises for error statuses,
+    so nothing is yielded unless the upstream accepted the request. The
+    usage block, if the upstream sends one, is available after iteration.
+    """
+
+    def __init__(self, backend: "OpenAIBackend", messages: list[dict[str, str]], model: str) -> None:
+        self.backend = backend
+        self.messages = messages
+        self.model = model
+        self.usage: dict[str, int] | None = None
+        self.first_token: float | None = None
+        self._started = 0.0
+        self._response: aiohttp.ClientResponse | None = None
+        self._request = None
+
+    async def __aenter__(self) -> "CompletionStream":
+        self._started = time.monotonic()
+        self._request = self.backend.session.post(
+            self.backend.url,
+            headers=self.backend.headers(),
+            json=self.backend.payload(self.messages, self.model, stream=True),
+        )
+        self._response = await self._request.__aenter__()
+        try:
+            await self.backend.check(self._response)
+        except BaseException:
+            await self._request.__aexit__(None, None, None)
+            raise
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self._request.__aexit__(*exc_info)
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        async for event in sse_events(self._response):
+            usage = self.backend.parse_usage(event)
+            if usage is not None:
+                self.usage = usage
+            choices = event.get("choices")
+            if not choices:
+                continue
+            content = choices[0].get("delta", {}).get("content")
+            if content:
+                if self.first_token is None:
+                    self.first_token = time.monotonic() - self._started
+                yield content
+
+
+class OpenAIBackend:
+    """Any server speaking the OpenAI chat completions protocol"""
+
+    name = "OpenAI-compatible"
+    default_url = "http://127.0.0.1:8080/v1/chat/completions"
+    # Ask for a final usage chunk when streaming
+    stream_usage_option = True
+
+    def __init__(
+        self,
+        session: aiohttp.ClientSession,
+        *,
+        api_key: str | None = None,
+        model: str,
+        url: str | None = None,
+        options: Mapping[str, Any] | None = None,
+    ) -> None:
+        self.session = session
+        self.api_key = api_key
+        self.model = model
+        self.url = url or self.default_url
+        # Extra request fields such as temperature or max_tokens
+        self.options = dict(options or {})
+        # Called with the response headers of every request, the scheduler
+        # hooks in here to follow the upstream's rate limit view
+        self.on_headers: Callable[[Mapping[str, str]], None] | None = None
+
+    def headers(self) -> dict[str, str]:
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        return headers
+
+    def payload(self, messages: list[dict[str, str]], model: str, *, stream: bool = False) -> dict[str, Any]:
+        payload = {**self.options, "model": model, "messages": messages}
+        if stream:
+            payload["stream"] = True
+            if self.stream_usage_option:
+                payload["stream_options"] = {"include_usage": True}
+        return payload
+
+    def parse_usage(self, data: Mapping[str, Any]) -> dict[str, int] | None:
+        return data.get("usage") or None
+
+    async def check(self, response: aiohttp.ClientResponse) -> None:
+        """Raise for anything but a 200, 429s become :class:`RateLimited`"""
+        if self.on_headers is not None:
+            self.on_headers(response.headers)
+        if response.status == 200:
+            return
+        if response.status == 429:
+            raise RateLimited(parse_duration(response.headers.get("retry-after")))
+        raise BackendError(response.status, await response.text())
+
+    async def complete(self, messages: list[dict[str, str]], *, model: str | None = None) -> Completion:
+        model = model or self.model
+        started = time.monotonic()
+        async with self.session.post(
+            self.url, headers=self.headers(), json=self.payload(messages, model)
+        ) as response:
+            await self.check(response)
+            data = await response.json()
+        return Completion(
+            data["choices"][0]["message"]["content"],
+            model,
+            self.parse_usage(data),
+            time.monotonic() - started,
+        )
+
+    def stream(self, messages: list[dict[str, str]], *, model: str | None = None) -> CompletionStream:
+        return CompletionStream(self, messages, model or self.model)
+
+
+class GroqBackend(OpenAIBackend):
+    name = "Groq"
+    default_url = "https://api.groq.com/openai/v1/chat/completions"
+    stream_usage_option = False
+
+    def parse_usage(self, data: Mapping[str, Any]) -> dict[str, int] | None:
+        # Streamed chunks carry usage under x_groq instead of the top level
+        return data.get("usage") or data.get("x_groq", {}).get("usage") or None
+
+
+BACKENDS: dict[str, type[OpenAIBackend]] = {
+    "groq": GroqBackend,
+    "openai": OpenAIBackend,
+}
+
+
+def backend_from_config(session: aiohttp.ClientSession, groq_config: Mapping[str, Any]) -> OpenAIBackend:
+    """Build the backend selected by ``[GROQ] backend``, Groq by default
+
+    Raises KeyError when the api key is missing for a backend that needs one.
+    """
+    kind = groq_config.get("backend", "groq")
+    cls = BACKENDS[kind]
+    api_key = groq_config["api_key"] if cls is GroqBackend else groq_config.get("api_key")
+    return cls(
+        session,
+        api_key=api_key,
+        model=groq_config.get("model", "llama-3.1-70b-versatile"),
+        url=groq_config.get("url"),
+        options=groq_config.get("options"),
+    )
@@ -0,0 +1,290 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2022-Present Marble
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+import hashlib
+import logging
+import re
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Mapping
+
+try:
+    import numpy as np
+except ImportError:
+    # The near-duplicate tier is optional, exact hits still work without it
+    np = None
+
+log = logging.getLogger(__name__)
+
+_punctuation_regex = re.compile(r"[^\w\s]")
+_space_regex = re.compile(r"\s+")
+# Words that only make sense against what was said before
+_follow_up_regex = re.compile(
+    r"\b(it|its|that|this|those|these|them|they|he|she|him|her|again|more|else|"
+    r"above|previous|earlier|same|also|too|instead|why|continue|shorter|longer)\b"
+)
+
+
+def normalize_prompt(text: str) -> str:
+    """Case, punctuation and spacing insensitive form of a prompt"""
+    text = _punctuation_regex.sub(" ", text.casefold())
+    return _space_regex.sub(" ", text).strip()
+
+
+def is_follow_up(prompt: str) -> bool:
+    """Whether a normalized prompt refers back to the conversation"""
+    return bool(_follow_up_regex.search(prompt))
+
+
+def context_fingerprint(history: list[dict[str, Any]], model: str, turns: int = 0, scope: str = "") -> int:
+    """64 bit digest of the model, a scope and the last ``turns`` turns of history
+
+    Replies are written with the asker's history and summary in the
+    prompt, so ``scope`` names who may share them, like ``"user:123"``. A
+    follow-up like "explain that again" only means the same thing after
+    the same conversation, so cached replies to those are also scoped to
+    the recent turns. Standalone prompts use ``turns=0``.
+    """
+    digest = hashlib.blake2b(model.encode() + b"\0" + scope.encode(), digest_size=8)
+    for turn in history[-turns:] if turns else ():
+        digest.update(b"\0" + turn["role"].encode() + b"\0" + turn["content"].encode())
+    return int.from_bytes(digest.digest(), "little")
+
+
+class CacheKey:
+    __slots__ = ("fingerprint", "prompt")
+
+    def __init__(self, fingerprint: int, prompt: str) -> None:
+        self.fingerprint = fingerprint
+        self.prompt = prompt
+
+
+class ExactCache:
+    """TTL + LRU map from (fingerprint, normalized prompt) to a reply"""
+
+    def __init__(self, *, max_entries: int = 2048, ttl: float = 3600) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[tuple[int, str], tuple[float, str]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: CacheKey) -> str | None:
+        k = (key.fingerprint, key.prompt)
+        entry = self._entries.get(k)
+        if entry is None:
+            return None
+        expires, response = entry
+        if expires < time.monotonic():
+            del self._entries[k]
+            return None
+        self._entries.move_to_end(k)
+        return response
+
+    def put(self, key: CacheKey, response: str) -> None:
+        k = (key.fingerprint, key.prompt)
+        self._entries[k] = (time.monotonic() + self.ttl, response)
+        self._entries.move_to_end(k)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+class NearDuplicateIndex:
+    """Cosine similarity over hashed character n-gram vectors
+
+    Prompts are embedded as L2 normalized counts of their character
+    trigrams hashed into ``dim`` buckets and kept as rows of one fixed size
+    matrix, so a lookup is a single matrix-vector product. Only rows with
+    the same context fingerprint can match. Storing a key that is already
+    indexed overwrites its row. When full, expired rows are reused first and
+    then the least recently used one.
+    """
+
+    def __init__(
+        self,
+        *,
+        capacity: int = 1024,
+        dim: int = 1024,
+        threshold: float = 0.88,
+        ttl: float = 3600,
+        ngram: int = 3,
+    ) -> None:
+        self.capacity = capacity
+        self.dim = dim
+        self.threshold = threshold
+        self.ttl = ttl
+        self.ngram = ngram
+        self.size = 0
+        self.matrix = np.zeros((capacity, dim), dtype=np.float32)
+        self.fingerprints = np.zeros(capacity, dtype=np.uint64)
+        self.expires = np.zeros(capacity, dtype=np.float64)
+        self.last_used = np.zeros(capacity, dtype=np.float64)
+        self.responses: list[str | None] = [None] * capacity
+        self.keys: list[tuple[int, str] | None] = [None] * capacity
+        self.slots: dict[tuple[int, str], int] = {}
+
+    def __len__(self) -> int:
+        return self.size
+
+    def vectorize(self, prompt: str) -> "np.ndarray":
+        text = f" {prompt} "
+        buckets = [
+            zlib.crc32(text[i : i + self.ngram].encode()) % self.dim
+            for i in range(max(1, len(text) - self.ngram + 1))
+        ]
+        vector = np.bincount(buckets, minlength=self.dim).astype(np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(self, key: CacheKey) -> str | None:
+        if not self.size:
+            return None
+        now = time.monotonic()
+        scores = self.matrix[: self.size] @ self.vectorize(key.prompt)
+        usable = (self.fingerprints[: self.size] == np.uint64(key.fingerprint)) & (
+            self.expires[: self.size] > now
+        )
+        scores[~usable] = -1.0
+        best = int(scores.argmax())
+        if scores[best] < self.threshold:
+            return None
+        self.last_used[best] = now
+        return self.responses[best]
+
+    def put(self, key: CacheKey, response: str) -> None:
+        now = time.monotonic()
+        k = (key.fingerprint, key.prompt)
+        slot = self.slots.get(k)
+        if slot is None:
+            if self.size < self.capacity:
+                slot = self.size
+                self.size += 1
+            else:
+                expired = np.flatnonzero(self.expires <= now)
+                slot = int(expired[0]) if len(expired) else int(self.last_used.argmin())
+                del self.slots[self.keys[slot]]
+            self.keys[slot] = k
+            self.slots[k] = slot
+        self.matrix[slot] = self.vectorize(key.prompt)
+        self.fingerprints[slot] = np.uint64(key.fingerprint)
+        self.expires[slot] = now + self.ttl
+        self.last_used[slot] = now
+        self.responses[slot] = response
+
+
+class ResponseCache:
+    """Exact tier in front of an optional near-duplicate tier
+
+    Hits cost no upstream tokens. The near-duplicate tier needs NumPy and
+    is skipped when it is not installed.
+
+    Entries are only shared by the same user unless ``scope`` is
+    ``"guild"``, which lets everyone in a guild get replies written for
+    someone else there. DMs are always scoped to the user.
+    """
+
+    def __init__(
+        self,
+        *,
+        enabled: bool = False,
+        ttl: float = 3600,
+        max_entries: int = 2048,
+        near_entries: int = 1024,
+        similarity: float = 0.88,
+        context_turns: int = 2,
+        scope: str = "user",
+    ) -> None:
+        if scope not in ("user", "guild"):
+            raise ValueError(f"unknown cache scope {scope!r}")
+        self.enabled = enabled
+        self.context_turns = context_turns
+        self.scope = scope
+        self.exact = ExactCache(max_entries=max_entries, ttl=ttl)
+        self.near: NearDuplicateIndex | None = None
+        if enabled and near_entries:
+            if np is None:
+                log.info("NumPy is not installed, near-duplicate response cache disabled")
+            else:
+                self.near = NearDuplicateIndex(capacity=near_entries, threshold=similarity, ttl=ttl)
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_config(cls, groq_config: Mapping[str, Any]) -> "ResponseCache":
+        return cls(
+            enabled=groq_config.get("cache", False),
+            ttl=groq_config.get("cache_ttl", 3600),
+            max_entries=groq_config.get("cache_size", 2048),
+            near_entries=groq_config.get("cache_near_size", 1024),
+            similarity=groq_config.get("cache_similarity", 0.88),
+            context_turns=groq_config.get("cache_context_turns", 2),
+            scope=groq_config.get("cache_scope", "user"),
+        )
+
+    def key(
+        self,
+        history: list[dict[str, Any]],
+        prompt: str,
+        model: str,
+        user_id: int,
+        guild_id: int | None = None,
+    ) -> CacheKey:
+        prompt = normalize_prompt(prompt)
+        turns = self.context_turns if is_follow_up(prompt) else 0
+        if self.scope == "guild" and guild_id is not None:
+            scope = f"guild:{guild_id}"
+        else:
+            scope = f"user:{user_id}"
+        return CacheKey(context_fingerprint(history, model, turns, scope), prompt)
+
+    def get(self, key: CacheKey) -> str | None:
+        response = self.exact.get(key)
+        if response is not None:
+            self.exact_hits += 1
+            return response
+        if self.near is not None:
+            response = self.near.get(key)
+            if response is not None:
+                self.near_hits += 1
+                # Promote so the next identical ask skips the matrix product
+                self.exact.put(key, response)
+                return response
+        self.misses += 1
+        return None
+
+    def put(self, key: CacheKey, response: str) -> None:
+        self.exact.put(key, response)
+        if self.near is not None:
+            self.near.put(key, response)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "exact_hits": self.exact_hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "exact_entries": len(self.exact),
+            "near_entries": len(self.near) if self.near is not None else 0,
+        }
@@ -0,0 +1,106 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2022-Present Marble
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+from typing import Any
+
+# Rough cost of the role and message framing the API adds around content
+MESSAGE_OVERHEAD = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate, about four characters per token for English
+
+    Deliberately errs high on short texts so budgets are not overrun by the
+    framing overhead of many small messages.
+    """
+    return len(text) // 4 + 1 + MESSAGE_OVERHEAD
+
+
+def turn_tokens(turn: dict[str, Any]) -> int:
+    """Token estimate for a stored turn, cached on the turn itself"""
+    tokens = turn.get("tokens")
+    if tokens is None:
+        tokens = turn["tokens"] = estimate_tokens(turn["content"])
+    return tokens
+
+
+SUMMARY_PREFIX = "Summary of the earlier conversation with this user:\n"
+
+
+class ContextBuilder:
+    """Assembles the messages for a request within a token budget
+
+    The current user message and the summary of older turns, if any, are
+    always sent. History is added from the newest turn backwards until the
+    next turn would not fit.
+    """
+
+    def __init__(
+        self,
+        *,
+        budget: int = 6000,
+        completion_reserve: int = 1024,
+        model_limits: dict[str, int] | None = None,
+    ) -> None:
+        self.budget = budget
+        self.completion_reserve = completion_reserve
+        self.model_limits = model_limits or {}
+
+    @classmethod
+    def from_config(cls, groq_config: dict[str, Any]) -> "ContextBuilder":
+        return cls(
+            budget=groq_config.get("context_budget", 6000),
+            completion_reserve=groq_config.get("completion_reserve", 1024),
+            model_limits=groq_config.get("model_limits"),
+        )
+
+    def budget_for(self, model: str) -> int:
+        limit = self.model_limits.get(model)
+        if limit is None:
+            return self.budget
+        return max(0, min(self.budget, limit - self.completion_reserve))
+
+    def build(
+        self,
+        history: list[dict[str, Any]],
+        message: str,
+        model: str,
+        summary: dict[str, Any] | None = None,
+    ) -> list[dict[str, str]]:
+        budget = self.budget_for(model)
+        used = estimate_tokens(message)
+        if summary is not None:
+            used += summary["tokens"]
+        picked = []
+        for turn in reversed(history):
+            cost = turn_tokens(turn)
+            if used + cost > budget:
+                break
+            used += cost
+            picked.append({"role": turn["role"], "content": turn["content"]})
+
+        if summary is not None:
+            picked.append({"role": "system", "content": SUMMARY_PREFIX + summary["content"]})
+        picked.reverse()
+        picked.append({"role": "user", "content": message})
+        return picked
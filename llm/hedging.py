@@ -0,0 +1,363 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2022-Present Marble
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+import asyncio
+import contextlib
+import logging
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Mapping
+
+import aiohttp
+
+from .backends import BackendError, Completion, CompletionStream, OpenAIBackend, backend_from_config
+from .scheduler import RateLimited
+
+log = logging.getLogger(__name__)
+
+
+class LatencyStats:
+    """Sliding window of recent latencies for one route"""
+
+    def __init__(self, window: int = 200) -> None:
+        self.samples: deque[float] = deque(maxlen=window)
+
+    def __len__(self) -> int:
+        return len(self.samples)
+
+    def observe(self, seconds: float) -> None:
+        self.samples.append(seconds)
+
+    def quantile(self, q: float) -> float | None:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Route:
+    """One model on one backend, with its own latency history"""
+
+    def __init__(self, backend: OpenAIBackend, model: str) -> None:
+        self.backend = backend
+        self.model = model
+        # Full response time for plain requests, time to first token for streams
+        self.latency = LatencyStats()
+        self.first_token = LatencyStats()
+        self.requests = 0
+        self.failures = 0
+        self.wins = 0
+        self.cooldown_until = 0.0
+
+    @property
+    def name(self) -> str:
+        return f"{self.backend.name}:{self.model}"
+
+    @property
+    def available(self) -> bool:
+        return time.monotonic() >= self.cooldown_until
+
+
+def should_fail_over(error: BaseException) -> bool:
+    """Errors another route might not have: 429s, 5xx and connection trouble"""
+    if isinstance(error, (RateLimited, aiohttp.ClientError, asyncio.TimeoutError)):
+        return True
+    return isinstance(error, BackendError) and error.status >= 500
+
+
+class _OpenStream:
+    """A stream that produced its first delta, kept open for the winner"""
+
+    def __init__(self, route: Route, stack: contextlib.AsyncExitStack, stream: CompletionStream) -> None:
+        self.route = route
+        self.stack = stack
+        self.stream = stream
+        self.iterator = stream.__aiter__()
+        self.first: str | None = None
+
+    async def close(self) -> None:
+        await self.stack.aclose()
+
+
+class HedgedStream:
+    """Stream from whichever route produced a first token first
+
+    Used like :class:`CompletionStream`. The race happens on entering the
+    context, so by the time deltas are yielded the losers are cancelled
+    and nothing from them reaches the caller.
+    """
+
+    def __init__(self, hedged: "HedgedBackend", messages: list[dict[str, str]]) -> None:
+        self.hedged = hedged
+        self.messages = messages
+        self._winner: _OpenStream | None = None
+
+    @property
+    def model(self) -> str | None:
+        return self._winner.route.model if self._winner else None
+
+    @property
+    def usage(self) -> dict[str, int] | None:
+        return self._winner.stream.usage if self._winner else None
+
+    @property
+    def first_token(self) -> float | None:
+        return self._winner.stream.first_token if self._winner else None
+
+    async def __aenter__(self) -> "HedgedStream":
+        self._winner = await self.hedged.race(self.hedged.open_stream, self.messages, stream=True)
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self._winner.close()
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        if self._winner.first is not None:
+            yield self._winner.first
+        async for delta in self._winner.iterator:
+            yield delta
+
+
+class HedgedBackend:
+    """Fans a request out over an ordered list of routes
+
+    The first route gets the request. If it hasn't answered once its p95
+    latency (time to first token for streams) has passed, the next route
+    gets a hedged copy and whichever finishes first wins, the other is
+    cancelled. 429s, 5xx and connection errors fail over to the next route
+    straight away. When every route is rate limited :class:`RateLimited`
+    is raised with the shortest retry-after, so the scheduler's retry and
+    pause logic still applies.
+
+    The scheduler only admits the first request, so ``on_extra_request``
+    is called with the messages for every hedged or failed-over copy to
+    let it charge those against its budget too.
+    """
+
+    def __init__(
+        self,
+        routes: list[Route],
+        *,
+        hedge: bool = True,
+        hedge_quantile: float = 0.95,
+        hedge_delay: float = 3.0,
+        min_hedge_delay: float = 0.5,
+        min_samples: int = 20,
+    ) -> None:
+        if not routes:
+            raise ValueError("at least one route is required")
+        self.routes = routes
+        self.hedge = hedge and len(routes) > 1
+        self.hedge_quantile = hedge_quantile
+        # Used until a route has min_samples latencies recorded
+        self.hedge_delay = hedge_delay
+        self.min_hedge_delay = min_hedge_delay
+        self.min_samples = min_samples
+        self.hedges = 0
+        self.failovers = 0
+        self.on_extra_request: Callable[[list[dict[str, str]]], None] | None = None
+
+    @property
+    def primary(self) -> Route:
+        return self.routes[0]
+
+    @property
+    def name(self) -> str:
+        return self.primary.backend.name
+
+    @property
+    def model(self) -> str:
+        return self.primary.model
+
+    @property
+    def on_headers(self) -> Callable[[Mapping[str, str]], None] | None:
+        return self.primary.backend.on_headers
+
+    @on_headers.setter
+    def on_headers(self, callback: Callable[[Mapping[str, str]], None] | None) -> None:
+        # Only the primary's limits describe the budget the scheduler manages
+        self.primary.backend.on_headers = callback
+
+    def delay_for(self, route: Route, *, stream: bool = False) -> float:
+        """Seconds to wait on ``route`` before sending a hedged copy"""
+        stats = route.first_token if stream else route.latency
+        if len(stats) < self.min_samples:
+            return self.hedge_delay
+        return max(self.min_hedge_delay, stats.quantile(self.hedge_quantile))
+
+    def stats(self) -> list[dict[str, Any]]:
+        return [
+            {
+                "route": route.name,
+                "requests": route.requests,
+                "wins": route.wins,
+                "failures": route.failures,
+                "p50": route.latency.quantile(0.5),
+                "p95": route.latency.quantile(0.95),
+                "first_token_p95": route.first_token.quantile(0.95),
+            }
+            for route in self.routes
+        ]
+
+    async def complete(self, messages: list[dict[str, str]]) -> Completion:
+        return await self.race(self._complete, messages)
+
+    def stream(self, messages: list[dict[str, str]]) -> HedgedStream:
+        return HedgedStream(self, messages)
+
+    async def _complete(self, route: Route, messages: list[dict[str, str]]) -> Completion:
+        completion = await route.backend.complete(messages, model=route.model)
+        route.latency.observe(completion.latency)
+        return completion
+
+    async def open_stream(self, route: Route, messages: list[dict[str, str]]) -> _OpenStream:
+        stack = contextlib.AsyncExitStack()
+        try:
+            stream = await stack.enter_async_context(route.backend.stream(messages, model=route.model))
+            opened = _OpenStream(route, stack, stream)
+            async for delta in opened.iterator:
+                opened.first = delta
+                break
+        except BaseException:
+            await stack.aclose()
+            raise
+        if stream.first_token is not None:
+            route.first_token.observe(stream.first_token)
+        return opened
+
+    async def race(
+        self,
+        attempt: Callable[[Route, list[dict[str, str]]], Awaitable[Any]],
+        messages: list[dict[str, str]],
+        *,
+        stream: bool = False,
+    ) -> Any:
+        routes = [route for route in self.routes if route.available] or self.routes[:1]
+        pending: dict[asyncio.Task, Route] = {}
+        started: dict[asyncio.Task, float] = {}
+        errors: list[BaseException] = []
+        next_route = 0
+        deadline = 0.0
+
+        def launch() -> None:
+            nonlocal next_route, deadline
+            route = routes[next_route]
+            if next_route and self.on_extra_request is not None:
+                self.on_extra_request(messages)
+            next_route += 1
+            route.requests += 1
+            task = asyncio.create_task(attempt(route, messages))
+            pending[task] = route
+            started[task] = time.monotonic()
+            deadline = started[task] + self.delay_for(route, stream=stream)
+
+        launch()
+        try:
+            while True:
+                if not pending:
+                    if next_route == len(routes):
+                        raise self._give_up(errors)
+                    self.failovers += 1
+                    launch()
+
+                timeout = None
+                if self.hedge and next_route < len(routes) and len(pending) == 1:
+                    timeout = max(0.0, deadline - time.monotonic())
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    self.hedges += 1
+                    log.info("Hedging slow request to %s", routes[next_route].name)
+                    launch()
+                    continue
+
+                winner = None
+                for task in done:
+                    route = pending.pop(task)
+                    if task.exception() is None:
+                        if winner is None:
+                            route.wins += 1
+                            winner = task.result()
+                        else:
+                            await self._discard(task.result())
+                        continue
+                    error = task.exception()
+                    errors.append(error)
+                    route.failures += 1
+                    if isinstance(error, RateLimited):
+                        route.cooldown_until = time.monotonic() + (error.retry_after or 1.0)
+                    if not should_fail_over(error) and not pending and winner is None:
+                        raise error
+                    log.info("%s failed: %r", route.name, error)
+                if winner is not None:
+                    return winner
+        finally:
+            for task in pending:
+                task.cancel()
+            results = await asyncio.gather(*pending, return_exceptions=True)
+            now = time.monotonic()
+            for (task, route), result in zip(pending.items(), results):
+                if isinstance(result, asyncio.CancelledError):
+                    # It would have taken at least this long, leaving it out
+                    # would make a slow route look fast and never get hedged
+                    stats = route.first_token if stream else route.latency
+                    stats.observe(now - started[task])
+                # A loser that finished before the cancel landed still holds a stream
+                await self._discard(result)
+
+    @staticmethod
+    async def _discard(result: Any) -> None:
+        if isinstance(result, _OpenStream):
+            await result.close()
+
+    @staticmethod
+    def _give_up(errors: list[BaseException]) -> BaseException:
+        if errors and all(isinstance(e, RateLimited) for e in errors):
+            waits = [e.retry_after for e in errors if e.retry_after is not None]
+            return RateLimited(min(waits) if waits else None)
+        return errors[-1]
+
+
+def hedged_backend_from_config(session: aiohttp.ClientSession, groq_config: Mapping[str, Any]) -> HedgedBackend:
+    """Build the route list from ``[GROQ] models``
+
+    Entries are model names on the main backend, or tables overriding any
+    of ``backend``, ``api_key``, ``url``, ``options`` and ``model`` for a
+    different endpoint. Without ``models`` the single ``model`` is used.
+    Raises KeyError when an api key is missing for a backend that needs one.
+    """
+    entries = groq_config.get("models") or [{}]
+    routes = []
+    for entry in entries:
+        if isinstance(entry, str):
+            entry = {"model": entry}
+        merged = {**groq_config, **entry}
+        # One backend object per route so each keeps its own header hook
+        backend = backend_from_config(session, merged)
+        routes.append(Route(backend, backend.model))
+    return HedgedBackend(
+        routes,
+        hedge=groq_config.get("hedge", True),
+        hedge_quantile=groq_config.get("hedge_quantile", 0.95),
+        hedge_delay=groq_config.get("hedge_delay", 3.0),
+        min_hedge_delay=groq_config.get("min_hedge_delay", 0.5),
+    )
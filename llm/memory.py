@@ -0,0 +1,120 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2022-Present Marble
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+import time
+from collections import OrderedDict, deque
+
+import database
+from .context import turn_tokens
+
+
+class _Conversation:
+    __slots__ = ("summary", "turns")
+
+    def __init__(self, summary: dict | None, turns: deque[dict]) -> None:
+        self.summary = summary
+        self.turns = turns
+
+
+class ConversationCache:
+    """Recent chat turns per user, kept in memory in front of chat_memory
+
+    Users are loaded lazily on their first message and evicted least
+    recently used once more than ``max_users`` are held. Each user keeps
+    at most ``max_turns`` turns, which is all the context builder ever
+    sends, so an active user's prompt is assembled without touching SQLite.
+    Turns already folded into the user's summary are not held.
+    """
+
+    def __init__(self, db: database.Repository, *, max_users: int = 512, max_turns: int = 40) -> None:
+        self.db = db
+        self.max_users = max_users
+        self.max_turns = max_turns
+        self._users: OrderedDict[int, _Conversation] = OrderedDict()
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._users
+
+    async def _load(self, user_id: int) -> _Conversation:
+        conversation = self._users.get(user_id)
+        if conversation is None:
+            summary = await self.db.chat_summary(user_id)
+            after_id = summary["through_id"] if summary else 0
+            rows = await self.db.conversation_history(user_id, self.max_turns, after_id)
+            # Another task may have loaded this user while we were waiting
+            conversation = self._users.setdefault(
+                user_id, _Conversation(summary, deque(rows, maxlen=self.max_turns))
+            )
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        self._users.move_to_end(user_id)
+        return conversation
+
+    async def get(self, user_id: int, limit: int | None = None) -> list[dict]:
+        """Chronological turns for a user, the newest ``limit`` if given"""
+        turns = (await self._load(user_id)).turns
+        if limit is None or limit >= len(turns):
+            return list(turns)
+        return list(turns)[-limit:]
+
+    async def summary(self, user_id: int) -> dict | None:
+        """The stored summary of the user's older turns, if there is one"""
+        return (await self._load(user_id)).summary
+
+    def unsummarized(self, user_id: int) -> int:
+        """Turns held for a loaded user that are not covered by the summary"""
+        conversation = self._users.get(user_id)
+        return len(conversation.turns) if conversation is not None else 0
+
+    async def append(self, user_id: int, *messages: dict) -> None:
+        """Record one exchange, in memory first and then in one transaction"""
+        turns = (await self._load(user_id)).turns
+        for message in messages:
+            turn_tokens(message)
+        turns.extend(messages)
+        ids = await self.db.save_chat_messages(user_id, messages, int(time.time()))
+        for message, id in zip(messages, ids):
+            message["id"] = id
+
+    async def set_summary(self, user_id: int, content: str, through_id: int, tokens: int) -> bool:
+        """Store a summary of every turn up to ``through_id`` and drop those turns
+
+        Returns False, changing nothing, if the history was cleared meanwhile.
+        """
+        if not await self.db.save_chat_summary(user_id, content, through_id, tokens, int(time.time())):
+            return False
+        conversation = self._users.get(user_id)
+        if conversation is not None:
+            conversation.summary = {"content": content, "through_id": through_id, "tokens": tokens}
+            # Turns still being saved have no id yet, they are newer anyway
+            while conversation.turns and conversation.turns[0].get("id", through_id + 1) <= through_id:
+                conversation.turns.popleft()
+        return True
+
+    def forget(self, user_id: int) -> None:
+        """Drop the in-memory copy, the next access reloads from the database"""
+        self._users.pop(user_id, None)
+
+    async def clear(self, user_id: int) -> None:
+        self._users.pop(user_id, None)
+        await self.db.clear_history(user_id)
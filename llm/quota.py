@@ -0,0 +1,201 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2022-Present Marble
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+import heapq
+import time
+from collections import deque
+from typing import Any, Iterable, Mapping
+
+BUCKET_SECONDS = 60
+HOUR = 3600
+DAY = 86400
+WINDOWS = {HOUR: "hour", DAY: "day"}
+
+
+class SlidingWindow:
+    """Tokens used over the last ``span`` seconds, kept in one minute buckets"""
+
+    __slots__ = ("span", "buckets", "total")
+
+    def __init__(self, span: int) -> None:
+        self.span = span
+        self.buckets: deque[list[int]] = deque()
+        self.total = 0
+
+    def expire(self, now: float) -> None:
+        # A bucket only leaves once all of its minute is older than the span
+        oldest = int(now - self.span) // BUCKET_SECONDS
+        while self.buckets and self.buckets[0][0] < oldest:
+            self.total -= self.buckets.popleft()[1]
+
+    def add(self, bucket: int, tokens: int) -> None:
+        if self.buckets and self.buckets[-1][0] >= bucket:
+            # Same minute, or a late record for one already counted
+            self.buckets[-1][1] += tokens
+        else:
+            self.buckets.append([bucket, tokens])
+        self.total += tokens
+
+    def retry_after(self, limit: int, now: float) -> float:
+        """Seconds until enough old buckets expire to get back under ``limit``"""
+        total = self.total
+        for bucket, tokens in self.buckets:
+            total -= tokens
+            if total < limit:
+                return max(0.0, (bucket + 1) * BUCKET_SECONDS + self.span - now)
+        return 0.0
+
+
+class QuotaExceeded:
+    """Why a request was turned away"""
+
+    __slots__ = ("kind", "span", "used", "limit", "retry_after")
+
+    def __init__(self, kind: str, span: int, used: int, limit: int, retry_after: float) -> None:
+        self.kind = kind
+        self.span = span
+        self.used = used
+        self.limit = limit
+        self.retry_after = retry_after
+
+    @property
+    def window(self) -> str:
+        return WINDOWS[self.span]
+
+
+class QuotaTracker:
+    """Token accounting per user and per guild over an hour and a day
+
+    Usage comes from the ``usage`` block of each completion. A limit of 0
+    leaves that window unlimited, usage is still tracked for
+    :meth:`top`. New usage is also collected for the database, see
+    :meth:`take_pending`, so the windows survive a restart.
+    """
+
+    def __init__(
+        self,
+        *,
+        user_hourly: int = 0,
+        user_daily: int = 0,
+        guild_hourly: int = 0,
+        guild_daily: int = 0,
+    ) -> None:
+        self.limits = {
+            "user": {HOUR: user_hourly, DAY: user_daily},
+            "guild": {HOUR: guild_hourly, DAY: guild_daily},
+        }
+        self.usage: dict[tuple[str, int], dict[int, SlidingWindow]] = {}
+        # (kind, id, bucket) -> tokens not written to the database yet
+        self.pending: dict[tuple[str, int, int], int] = {}
+        self.denied = 0
+
+    @classmethod
+    def from_config(cls, groq_config: Mapping[str, Any]) -> "QuotaTracker":
+        return cls(
+            user_hourly=groq_config.get("quota_user_hourly_tokens", 0),
+            user_daily=groq_config.get("quota_user_daily_tokens", 0),
+            guild_hourly=groq_config.get("quota_guild_hourly_tokens", 0),
+            guild_daily=groq_config.get("quota_guild_daily_tokens", 0),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return any(limit for limits in self.limits.values() for limit in limits.values())
+
+    def _windows(self, kind: str, id: int) -> dict[int, SlidingWindow]:
+        windows = self.usage.get((kind, id))
+        if windows is None:
+            windows = self.usage[(kind, id)] = {span: SlidingWindow(span) for span in WINDOWS}
+        return windows
+
+    def _add(self, kind: str, id: int, bucket: int, tokens: int) -> None:
+        for window in self._windows(kind, id).values():
+            window.add(bucket, tokens)
+
+    def load(self, rows: Iterable[tuple[str, int, int, int]]) -> None:
+        """Restore usage from ``(kind, id, bucket, tokens)`` rows, oldest first"""
+        for kind, id, bucket, tokens in rows:
+            self._add(kind, id, bucket, tokens)
+
+    def record(self, user_id: int, guild_id: int | None, tokens: int, now: float | None = None) -> None:
+        if tokens <= 0:
+            return
+        bucket = int(now if now is not None else time.time()) // BUCKET_SECONDS
+        subjects = [("user", user_id)]
+        if guild_id is not None:
+            subjects.append(("guild", guild_id))
+        for kind, id in subjects:
+            self._add(kind, id, bucket, tokens)
+            key = (kind, id, bucket)
+            self.pending[key] = self.pending.get(key, 0) + tokens
+
+    def check(self, user_id: int, guild_id: int | None, now: float | None = None) -> QuotaExceeded | None:
+        """The first exhausted quota for this user or guild, None if the request may go ahead"""
+        now = now if now is not None else time.time()
+        subjects = [("user", user_id)]
+        if guild_id is not None:
+            subjects.append(("guild", guild_id))
+        for kind, id in subjects:
+            windows = self.usage.get((kind, id))
+            if windows is None:
+                continue
+            for span, limit in self.limits[kind].items():
+                if not limit:
+                    continue
+                window = windows[span]
+                window.expire(now)
+                if window.total >= limit:
+                    self.denied += 1
+                    return QuotaExceeded(kind, span, window.total, limit, window.retry_after(limit, now))
+        return None
+
+    def prune(self, now: float | None = None) -> None:
+        """Expire old buckets and stop tracking users and guilds with nothing left"""
+        now = now if now is not None else time.time()
+        for key in list(self.usage):
+            windows = self.usage[key]
+            for window in windows.values():
+                window.expire(now)
+            if not windows[DAY].total:
+                del self.usage[key]
+
+    def top(self, kind: str, span: int = DAY, limit: int = 10, now: float | None = None) -> list[tuple[int, int]]:
+        """The ``limit`` biggest consumers as ``(id, tokens)`` over the window"""
+        self.prune(now)
+        totals = [
+            (key[1], windows[span].total)
+            for key, windows in self.usage.items()
+            if key[0] == kind and windows[span].total
+        ]
+        return heapq.nlargest(limit, totals, key=lambda item: item[1])
+
+    def take_pending(self) -> list[tuple[str, int, int, int]]:
+        """Hand over usage recorded since the last call as database rows"""
+        pending, self.pending = self.pending, {}
+        return [(kind, id, bucket, tokens) for (kind, id, bucket), tokens in pending.items()]
+
+    def restore_pending(self, rows: Iterable[tuple[str, int, int, int]]) -> None:
+        """Put back rows that could not be written"""
+        for kind, id, bucket, tokens in rows:
+            key = (kind, id, bucket)
+            self.pending[key] = self.pending.get(key, 0) + tokens
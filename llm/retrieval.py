@@ -0,0 +1,99 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2022-Present Marble
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+import re
+from typing import Any, Mapping
+
+import database
+
+_word_regex = re.compile(r"\w+")
+
+# Words too common to say anything about relevance
+STOPWORDS = frozenset(
+    """
+    about after again also and any are because been before but can could did does doing
+    for from had has have her him his how into its just like more most not now off once
+    only other our out over own same she should some such than that the their them then
+    there these they this those through too under until very was were what when where
+    which while who whom why will with would you your yours yo bro
+    """.split()
+)
+
+# Largest rowid SQLite can store, "before" for users with no recent window
+MAX_ROWID = 2**63 - 1
+
+
+def match_query(user_id: int, text: str, max_terms: int = 16) -> str | None:
+    """FTS5 query for any of the meaningful words in ``text``, within one user's turns"""
+    terms = []
+    for word in _word_regex.findall(text.casefold()):
+        if len(word) < 3 or word in STOPWORDS or word in terms:
+            continue
+        terms.append(word)
+        if len(terms) == max_terms:
+            break
+    if not terms:
+        return None
+    # \w never matches a double quote, so quoting each term is enough escaping
+    return f'owner:"{user_id}" AND (' + " OR ".join(f'"{term}"' for term in terms) + ")"
+
+
+class Retriever:
+    """Picks past turns relevant to the question instead of only the latest ones
+
+    The context becomes the ``max_hits`` best BM25 matches from everything
+    the user said before (each with the other half of its exchange), plus
+    the newest ``recent_turns`` turns so the conversation still flows.
+    """
+
+    def __init__(
+        self,
+        db: database.Repository,
+        *,
+        enabled: bool = False,
+        recent_turns: int = 6,
+        max_hits: int = 6,
+    ) -> None:
+        self.db = db
+        self.enabled = enabled
+        self.recent_turns = recent_turns
+        self.max_hits = max_hits
+
+    @classmethod
+    def from_config(cls, db: database.Repository, groq_config: Mapping[str, Any]) -> "Retriever":
+        return cls(
+            db,
+            enabled=groq_config.get("retrieval", False),
+            recent_turns=groq_config.get("retrieval_recent_turns", 6),
+            max_hits=groq_config.get("retrieval_hits", 6),
+        )
+
+    async def history(self, user_id: int, question: str, recent: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        """Relevant older turns followed by the recent window, chronologically"""
+        window = recent[-self.recent_turns :] if self.recent_turns else []
+        query = match_query(user_id, question)
+        if query is None:
+            return window
+        before_id = next((turn["id"] for turn in window if "id" in turn), MAX_ROWID)
+        relevant = await self.db.search_history(user_id, query, self.max_hits, before_id)
+        return relevant + window
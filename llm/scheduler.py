@@ -0,0 +1,318 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2022-Present Marble
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+import asyncio
+import logging
+import random
+import re
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Mapping
+
+log = logging.getLogger(__name__)
+
+_duration_regex = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_duration_units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_duration(value: str | None) -> float | None:
+    """Parse ``retry-after`` / ``x-ratelimit-reset-*`` values like ``7.66s`` or ``1m2s``"""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    matches = _duration_regex.findall(value)
+    if not matches:
+        return None
+    return sum(float(amount) * _duration_units[unit] for amount, unit in matches)
+
+
+class RateLimited(Exception):
+    """Raised by a request when the upstream answered 429"""
+
+    def __init__(self, retry_after: float | None = None) -> None:
+        super().__init__(f"Rate limited, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Continuous refill limiter sized in units per minute"""
+
+    def __init__(self, per_minute: float, capacity: float | None = None) -> None:
+        self.rate = per_minute / 60
+        self.capacity = capacity or per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount: float) -> float:
+        """Seconds until ``amount`` can be taken"""
+        self._refill()
+        # A request bigger than the bucket would wait forever, let it drain it
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float) -> None:
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+    def sync(self, remaining: float) -> None:
+        """Trust the upstream's view when it has less left than we think"""
+        self._refill()
+        self.tokens = min(self.tokens, remaining)
+
+
+class _Job:
+    __slots__ = ("user_id", "tokens", "func", "future", "enqueued")
+
+    def __init__(self, user_id: int, tokens: int, func: Callable[[], Awaitable[Any]]) -> None:
+        self.user_id = user_id
+        self.tokens = tokens
+        self.func = func
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.enqueued = time.monotonic()
+
+
+class LLMScheduler:
+    """Admission control for upstream LLM requests
+
+    Requests wait in one FIFO queue per user and are dispatched round-robin
+    across users, so a user firing many mentions cannot starve everyone
+    else. Dispatch is gated by a global concurrency cap and by request and
+    token buckets sized to the provider's per-minute limits. A request that
+    raises :class:`RateLimited` is retried after the advertised delay plus
+    jitter, and the whole scheduler pauses for that long.
+    """
+
+    def __init__(
+        self,
+        *,
+        concurrency: int = 4,
+        requests_per_minute: int = 30,
+        tokens_per_minute: int = 6000,
+        max_retries: int = 3,
+    ) -> None:
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+
+        self._queues: dict[int, deque[_Job]] = {}
+        # Users with queued jobs, in round-robin order
+        self._order: deque[int] = deque()
+        self._running = 0
+        self._tasks: set[asyncio.Task] = set()
+        self._paused_until = 0.0
+        self._wakeup: asyncio.Event | None = None
+        self._dispatcher: asyncio.Task | None = None
+
+        # Exponentially weighted average of request durations, for wait estimates
+        self.service_time = 2.0
+        self.last_wait = 0.0
+
+    @classmethod
+    def from_config(cls, groq_config: Mapping[str, Any]) -> "LLMScheduler":
+        return cls(
+            concurrency=groq_config.get("max_concurrency", 4),
+            requests_per_minute=groq_config.get("requests_per_minute", 30),
+            tokens_per_minute=groq_config.get("tokens_per_minute", 6000),
+            max_retries=groq_config.get("max_retries", 3),
+        )
+
+    @property
+    def pending(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    def position(self, user_id: int) -> int:
+        """How many queued jobs will be dispatched before the user's newest one"""
+        queue = self._queues.get(user_id)
+        if not queue:
+            return 0
+        depth = len(queue)
+        return depth - 1 + sum(
+            min(len(q), depth) for uid, q in self._queues.items() if uid != user_id
+        )
+
+    def estimated_wait(self, position: int) -> float:
+        paused = max(0.0, self._paused_until - time.monotonic())
+        return paused + (position + 1) * self.service_time / self.concurrency
+
+    def update_from_headers(self, headers: Mapping[str, str]) -> None:
+        """Apply the provider's ``x-ratelimit-*`` view of our remaining budget"""
+        try:
+            remaining_tokens = headers.get("x-ratelimit-remaining-tokens")
+            if remaining_tokens is not None:
+                self.tokens.sync(float(remaining_tokens))
+                if float(remaining_tokens) <= 0:
+                    self.pause(parse_duration(headers.get("x-ratelimit-reset-tokens")) or 1.0)
+            remaining_requests = headers.get("x-ratelimit-remaining-requests")
+            if remaining_requests is not None and float(remaining_requests) <= 0:
+                self.pause(parse_duration(headers.get("x-ratelimit-reset-requests")) or 1.0)
+        except ValueError:
+            pass
+
+    def charge(self, tokens: int) -> None:
+        """Count a request that went upstream without being submitted, like a hedged copy"""
+        self.requests.consume(1)
+        self.tokens.consume(tokens)
+
+    def pause(self, seconds: float) -> None:
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def backoff(self, retry_after: float | None, attempt: int) -> float:
+        if retry_after is not None:
+            return retry_after * random.uniform(1.0, 1.25)
+        # Full jitter exponential backoff when the upstream gave no hint
+        return random.uniform(0, min(30.0, 2.0 ** (attempt + 1)))
+
+    async def submit(
+        self,
+        user_id: int,
+        tokens: int,
+        func: Callable[[], Awaitable[Any]],
+        *,
+        on_queued: Callable[[int, float], Awaitable[None]] | None = None,
+    ) -> Any:
+        """Queue ``func`` and return its result once it has run
+
+        ``on_queued`` is awaited with the queue position and the estimated
+        wait in seconds when the request cannot start right away.
+        """
+        if self._dispatcher is None or self._dispatcher.done():
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+        job = _Job(user_id, tokens, func)
+        queue = self._queues.get(user_id)
+        if queue is None:
+            queue = self._queues[user_id] = deque()
+            self._order.append(user_id)
+        queue.append(job)
+        self._wakeup.set()
+
+        busy = (
+            self._running + self.pending > self.concurrency
+            or time.monotonic() < self._paused_until
+        )
+        if on_queued is not None and busy:
+            position = self.position(user_id)
+            try:
+                await on_queued(position, self.estimated_wait(position))
+            except Exception as e:
+                log.warning("Queue notification failed: %s", e)
+
+        return await job.future
+
+    def _next_job(self) -> _Job | None:
+        while self._order:
+            user_id = self._order.popleft()
+            queue = self._queues[user_id]
+            job = queue.popleft()
+            if queue:
+                self._order.append(user_id)
+            else:
+                del self._queues[user_id]
+            # Skip callers that gave up while waiting
+            if not job.future.done():
+                return job
+        return None
+
+    async def _dispatch(self) -> None:
+        while True:
+            if not self._order or self._running >= self.concurrency:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            job = self._next_job()
+            if job is None:
+                continue
+
+            while True:
+                delay = max(
+                    self._paused_until - time.monotonic(),
+                    self.requests.delay(1),
+                    self.tokens.delay(job.tokens),
+                )
+                if delay <= 0:
+                    break
+                await asyncio.sleep(delay)
+
+            self.requests.consume(1)
+            self.tokens.consume(job.tokens)
+            self._running += 1
+            self.last_wait = time.monotonic() - job.enqueued
+            task = asyncio.create_task(self._run(job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, job: _Job) -> None:
+        started = time.monotonic()
+        try:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    result = await job.func()
+                    break
+                except RateLimited as e:
+                    if attempt == self.max_retries:
+                        raise
+                    delay = self.backoff(e.retry_after, attempt)
+                    log.info("LLM request rate limited, retrying in %.1fs", delay)
+                    self.pause(delay)
+                    await asyncio.sleep(delay)
+            if not job.future.done():
+                job.future.set_result(result)
+        except asyncio.CancelledError:
+            # Closing the scheduler cancels running work, don't leave the caller waiting
+            job.future.cancel()
+            raise
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+        finally:
+            self._running -= 1
+            self.service_time = 0.8 * self.service_time + 0.2 * (time.monotonic() - started)
+            self._wakeup.set()
+
+    async def close(self) -> None:
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+        for task in tuple(self._tasks):
+            task.cancel()
+        for queue in self._queues.values():
+            for job in queue:
+                job.future.cancel()
+        self._queues.clear()
+        self._order.clear()
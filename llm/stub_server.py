@@ -0,0 +1,219 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2022-Present Marble
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from typing import Any
+
+from aiohttp import web
+
+from .context import estimate_tokens
+
+WORDS = (
+    "the bot replies with a plausible sounding sentence so that clients have "
+    "something to split render and store while measuring latency"
+).split()
+
+
+class StubSettings:
+    """Knobs for the fake upstream, all probabilities are per request"""
+
+    def __init__(
+        self,
+        *,
+        latency: float = 0.3,
+        jitter: float = 0.1,
+        tokens_per_second: float = 250.0,
+        completion_tokens: int = 120,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        retry_after: float = 1.0,
+        requests_per_minute: int = 0,
+        tail_rate: float = 0.0,
+        tail_latency: float = 5.0,
+    ) -> None:
+        self.latency = latency
+        self.jitter = jitter
+        self.tokens_per_second = tokens_per_second
+        self.completion_tokens = completion_tokens
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        # 0 disables the sliding window limiter
+        self.requests_per_minute = requests_per_minute
+        # Share of requests that stall for tail_latency, to exercise hedging
+        self.tail_rate = tail_rate
+        self.tail_latency = tail_latency
+
+
+class StubServer:
+    """Local stand-in for an OpenAI-compatible chat completions endpoint
+
+    Simulates time to first token, a steady token rate, random 5xx errors
+    and 429s (random or from a real per-minute window) so the chat path
+    can be load tested without network access or API keys.
+    """
+
+    def __init__(self, settings: StubSettings | None = None) -> None:
+        self.settings = settings or StubSettings()
+        self.app = web.Application()
+        self.app.router.add_post("/v1/chat/completions", self.completions)
+        self.requests: list[float] = []
+        self.served = 0
+        self.rejected = 0
+        self._runner: web.AppRunner | None = None
+        self.url: str | None = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}/v1/chat/completions"
+        return self.url
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def _limited(self) -> bool:
+        s = self.settings
+        if random.random() < s.rate_limit_rate:
+            return True
+        if not s.requests_per_minute:
+            return False
+        now = time.monotonic()
+        self.requests = [t for t in self.requests if now - t < 60]
+        if len(self.requests) >= s.requests_per_minute:
+            return True
+        self.requests.append(now)
+        return False
+
+    def _text(self) -> list[str]:
+        return [random.choice(WORDS) + " " for _ in range(self.settings.completion_tokens)]
+
+    async def completions(self, request: web.Request) -> web.StreamResponse:
+        s = self.settings
+        body: dict[str, Any] = await request.json()
+        model = body.get("model", "stub")
+        prompt_tokens = sum(estimate_tokens(m.get("content", "")) for m in body.get("messages", ()))
+
+        if self._limited():
+            self.rejected += 1
+            return web.json_response(
+                {"error": {"message": "Rate limit reached", "type": "rate_limit"}},
+                status=429,
+                headers={"retry-after": str(s.retry_after)},
+            )
+        if random.random() < s.error_rate:
+            self.rejected += 1
+            return web.json_response({"error": {"message": "Injected failure"}}, status=503)
+
+        await asyncio.sleep(max(0.0, random.gauss(s.latency, s.jitter)))
+        if random.random() < s.tail_rate:
+            await asyncio.sleep(s.tail_latency)
+        tokens = self._text()
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(tokens),
+            "total_tokens": prompt_tokens + len(tokens),
+        }
+        self.served += 1
+
+        if not body.get("stream"):
+            await asyncio.sleep(len(tokens) / s.tokens_per_second)
+            return web.json_response(
+                {
+                    "model": model,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)}}],
+                    "usage": usage,
+                }
+            )
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        try:
+            await response.prepare(request)
+            for token in tokens:
+                chunk = {"model": model, "choices": [{"index": 0, "delta": {"content": token}}]}
+                await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                await asyncio.sleep(1 / s.tokens_per_second)
+            if body.get("stream_options", {}).get("include_usage"):
+                await response.write(f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n".encode())
+            await response.write(b"data: [DONE]\n\n")
+            await response.write_eof()
+        except ConnectionResetError:
+            # The client went away, e.g. a hedged request that lost the race
+            pass
+        return response
+
+
+async def _serve(settings: StubSettings, host: str, port: int) -> None:
+    server = StubServer(settings)
+    url = await server.start(host, port)
+    print(f"Stub LLM listening on {url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible stand-in for load testing")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.3, help="mean seconds to first token")
+    parser.add_argument("--jitter", type=float, default=0.1, help="stddev of the latency")
+    parser.add_argument("--tokens-per-second", type=float, default=250.0)
+    parser.add_argument("--completion-tokens", type=int, default=120)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered 503")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="share of requests answered 429")
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--rpm", type=int, default=0, help="real requests per minute limit, 0 for none")
+    parser.add_argument("--tail-rate", type=float, default=0.0, help="share of requests that stall")
+    parser.add_argument("--tail-latency", type=float, default=5.0, help="seconds a stalled request adds")
+    args = parser.parse_args()
+
+    settings = StubSettings(
+        latency=args.latency,
+        jitter=args.jitter,
+        tokens_per_second=args.tokens_per_second,
+        completion_tokens=args.completion_tokens,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after,
+        requests_per_minute=args.rpm,
+        tail_rate=args.tail_rate,
+        tail_latency=args.tail_latency,
+    )
+    try:
+        asyncio.run(_serve(settings, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
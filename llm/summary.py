@@ -0,0 +1,166 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2022-Present Marble
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+import asyncio
+import logging
+from typing import Any, Mapping
+
+from .context import SUMMARY_PREFIX, estimate_tokens, turn_tokens
+from .memory import ConversationCache
+from .quota import QuotaTracker
+from .scheduler import LLMScheduler
+
+log = logging.getLogger(__name__)
+
+SUMMARY_INSTRUCTIONS = (
+    "You maintain a running summary of a chat between a Discord user and an "
+    "assistant. Merge the new part of the conversation into the existing "
+    "summary. Keep facts about the user, their preferences, open questions "
+    "and anything the assistant promised. Drop small talk. Write plain prose "
+    "in the third person, at most {words} words, and reply with the summary only."
+)
+
+
+class Summarizer:
+    """Folds old turns into a per-user summary in the background
+
+    Once a user has ``summarize_after`` unsummarized turns, everything but
+    the newest ``keep_recent`` is summarized together with the previous
+    summary, ``batch_tokens`` worth of turns per request. Requests go
+    through the scheduler under the user's own id, so compaction is paced
+    by the same rate limits and fairness as replies and never delays the
+    reply that triggered it.
+    """
+
+    def __init__(
+        self,
+        memory: ConversationCache,
+        backend: Any,
+        scheduler: LLMScheduler,
+        *,
+        enabled: bool = True,
+        summarize_after: int = 30,
+        keep_recent: int = 10,
+        batch_tokens: int = 3000,
+        summary_words: int = 250,
+        quota: QuotaTracker | None = None,
+    ) -> None:
+        self.memory = memory
+        self.backend = backend
+        self.scheduler = scheduler
+        self.enabled = enabled and backend is not None
+        self.summarize_after = summarize_after
+        self.keep_recent = keep_recent
+        self.batch_tokens = batch_tokens
+        self.summary_words = summary_words
+        # Summaries are spent on the user's behalf and count against their quota
+        self.quota = quota
+        self._tasks: dict[int, asyncio.Task] = {}
+
+    @classmethod
+    def from_config(
+        cls,
+        memory: ConversationCache,
+        backend: Any,
+        scheduler: LLMScheduler,
+        groq_config: Mapping[str, Any],
+        quota: QuotaTracker | None = None,
+    ) -> "Summarizer":
+        return cls(
+            memory,
+            backend,
+            scheduler,
+            enabled=groq_config.get("summarize", True),
+            summarize_after=groq_config.get("summarize_after", 30),
+            keep_recent=groq_config.get("summary_keep_recent", 10),
+            batch_tokens=groq_config.get("summary_batch_tokens", 3000),
+            summary_words=groq_config.get("summary_words", 250),
+            quota=quota,
+        )
+
+    def maybe_compact(self, user_id: int) -> None:
+        """Start compaction for the user if enough turns piled up"""
+        if not self.enabled or user_id in self._tasks:
+            return
+        # The cache never holds more than max_turns, a larger threshold would never trip
+        if self.memory.unsummarized(user_id) < min(self.summarize_after, self.memory.max_turns):
+            return
+        task = asyncio.create_task(self._compact(user_id))
+        self._tasks[user_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(user_id, None))
+
+    async def _compact(self, user_id: int) -> None:
+        try:
+            while await self.compact_once(user_id):
+                pass
+        except Exception as e:
+            log.warning("Summarizing chat history for %s failed: %r", user_id, e)
+
+    async def compact_once(self, user_id: int) -> bool:
+        """Summarize one batch of old turns, returns False when there is nothing left"""
+        summary = await self.memory.summary(user_id)
+        after_id = summary["through_id"] if summary else 0
+        turns = await self.memory.db.oldest_turns(user_id, after_id, self.keep_recent + 100)
+        old = turns[: max(0, len(turns) - self.keep_recent)]
+        if not old:
+            return False
+
+        batch = []
+        used = 0
+        for turn in old:
+            cost = turn_tokens(turn)
+            if batch and used + cost > self.batch_tokens:
+                break
+            batch.append(turn)
+            used += cost
+        # End on a reply so the summary never holds a dangling question
+        while len(batch) > 1 and batch[-1]["role"] != "assistant":
+            batch.pop()
+
+        content = await self.summarize(user_id, summary["content"] if summary else None, batch)
+        tokens = estimate_tokens(SUMMARY_PREFIX + content)
+        if not await self.memory.set_summary(user_id, content, batch[-1]["id"], tokens):
+            return False
+        log.info("Summarized %d chat turns for %s", len(batch), user_id)
+        return len(turns) - len(batch) > self.keep_recent
+
+    async def summarize(self, user_id: int, summary: str | None, turns: list[dict[str, Any]]) -> str:
+        transcript = "\n".join(f"{turn['role']}: {turn['content']}" for turn in turns)
+        messages = [
+            {"role": "system", "content": SUMMARY_INSTRUCTIONS.format(words=self.summary_words)},
+            {
+                "role": "user",
+                "content": f"Existing summary:\n{summary or '(none yet)'}\n\nNew conversation:\n{transcript}",
+            },
+        ]
+        tokens = sum(estimate_tokens(m["content"]) for m in messages) + self.summary_words * 2
+        completion = await self.scheduler.submit(user_id, tokens, lambda: self.backend.complete(messages))
+        if self.quota is not None:
+            self.quota.record(user_id, None, (completion.usage or {}).get("total_tokens", tokens))
+        return completion.content.strip()
+
+    async def close(self) -> None:
+        tasks = tuple(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -21,13 +21,39 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
-import asqlite
+import io
+import logging
+import time
+from datetime import timedelta
+
 import discord
-import datetime
-from typing import Union, List, Dict
-from discord.ext import commands
+from typing import Literal, Union, List, Dict
+from discord.ext import commands, tasks
 
 import core
+from core import HIGH, MessageContext, message_handler
+from core.metrics import LLM_REQUESTS, LLM_TOKENS, timed
+from llm.backends import BackendError
+from llm.cache import ResponseCache
+from llm.context import ContextBuilder, estimate_tokens
+from llm.hedging import hedged_backend_from_config
+from llm.memory import ConversationCache
+from llm.quota import DAY, HOUR, QuotaTracker
+from llm.retrieval import Retriever
+from llm.scheduler import LLMScheduler, RateLimited
+from llm.summary import Summarizer
+from utils.chunker import Chunker, chunk_text
+from utils.coalesce import Coalescer
+from utils.paginator import Paginator
+
+log = logging.getLogger(__name__)
+
+MESSAGE_LIMIT = 2000
+# Size of the preview sent along with a reply spilled into a file
+PREVIEW_LIMIT = 1500
+# Statuses an endpoint answers with when it can't stream, or rejects the
+# stream options, so the plain request is worth trying instead
+STREAM_UNSUPPORTED = {400, 404, 405, 422, 501}
 
 
 class FetchedUser(commands.Converter):
@@ -44,131 +70,383 @@ class FetchedUser(commands.Converter):
             ) from None
 
 
+class StreamingReply:
+    """Posts a reply as it streams in, editing the message progressively
+
+    The first message is sent as soon as the first tokens arrive, after
+    that edits are spaced ``interval`` seconds apart to stay clear of the
+    channel rate limit. Text past the 2000 character limit rolls over into
+    a new message, split by the same chunker as complete replies. After
+    ``max_messages`` messages the rest is only collected, and handed to
+    ``on_overflow`` with the full text once the reply is complete.
+    """
+
+    def __init__(
+        self,
+        channel: discord.abc.Messageable,
+        *,
+        interval: float = 1.5,
+        max_messages: int = 0,
+        on_overflow=None,
+    ) -> None:
+        self.channel = channel
+        self.interval = interval
+        self.max_messages = max_messages
+        self.on_overflow = on_overflow
+        self.message: discord.Message | None = None
+        self.chunker = Chunker(MESSAGE_LIMIT)
+        self.parts: list[str] = []
+        self.sent = 0
+        self.overflow: list[str] | None = None
+        self.started = False
+        self._last_edit = 0.0
+        self._shown = ""
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+    async def feed(self, delta: str) -> None:
+        self.parts.append(delta)
+        chunks = self.chunker.feed(delta)
+        if self.overflow is not None:
+            self.overflow += chunks
+            return
+        for index, chunk in enumerate(chunks):
+            await self._show(chunk)
+            self._next_message()
+            if self.max_messages and self.sent >= self.max_messages and self.on_overflow is not None:
+                self.overflow = chunks[index + 1 :]
+                return
+        if self.message is None or time.monotonic() - self._last_edit >= self.interval:
+            await self._show(self.chunker.preview())
+
+    async def finish(self) -> None:
+        chunks = self.chunker.flush()
+        if self.overflow is not None:
+            if self.overflow or chunks:
+                await self.on_overflow(self.text, self.overflow + chunks)
+            return
+        for index, chunk in enumerate(chunks):
+            await self._show(chunk)
+            if index < len(chunks) - 1:
+                self._next_message()
+
+    def _next_message(self) -> None:
+        self.message = None
+        self._shown = ""
+        self.sent += 1
+
+    async def _show(self, text: str | None) -> None:
+        if text is None or text == self._shown:
+            return
+        if self.message is None:
+            self.message = await self.channel.send(text)
+            self.started = True
+        else:
+            await self.message.edit(content=text)
+        self._shown = text
+        self._last_edit = time.monotonic()
+
+
 class ChatModule(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-
-    async def is_user_whitelisted(self, user_id: int) -> bool:
+        self.whitelist_ids: set[int] = set()
+        # Users and guilds whose prompts never go through the response cache
+        self.cache_opt_out_users: set[int] = set()
+        self.cache_opt_out_guilds: set[int] = set()
+        groq_config = core.config.get("GROQ", {})
+        self.memory = ConversationCache(
+            bot.db,
+            max_users=groq_config.get("memory_users", 512),
+            max_turns=groq_config.get("memory_turns", 40),
+        )
+        self.context = ContextBuilder.from_config(groq_config)
+        self.cache = ResponseCache.from_config(groq_config)
+        self.retriever = Retriever.from_config(bot.db, groq_config)
+        self.stream = groq_config.get("stream", True)
+        self.stream_edit_interval = groq_config.get("stream_edit_interval", 1.5)
+        # Replies longer than long_reply_chunks messages go out as a file,
+        # a paginator, or ("messages") one message per chunk regardless
+        self.long_reply = groq_config.get("long_reply", "file")
+        self.long_reply_chunks = groq_config.get("long_reply_chunks", 3)
+        self.scheduler = LLMScheduler.from_config(groq_config)
+        # Token usage per user and guild, checked before a request is queued
+        self.quota = QuotaTracker.from_config(groq_config)
+        self.expected_completion_tokens = groq_config.get("expected_completion_tokens", 300)
+        # Mentions from one user in one channel in quick succession become a
+        # single request, and one user's exchanges never overlap
+        self.bursts = Coalescer(
+            self.respond,
+            window=groq_config.get("coalesce_window", 1.0),
+            max_wait=groq_config.get("coalesce_max_wait", 4.0),
+            max_items=groq_config.get("coalesce_max_messages", 8),
+            serialize_by=lambda key: key[1],
+        )
+        try:
+            self.backend = hedged_backend_from_config(bot.session, groq_config)
+            self.backend.on_headers = self.scheduler.update_from_headers
+            self.backend.on_extra_request = lambda messages: self.scheduler.charge(
+                self.request_tokens(messages)
+            )
+        except KeyError:
+            self.backend = None
+        self.summarizer = Summarizer.from_config(
+            self.memory, self.backend, self.scheduler, groq_config, quota=self.quota
+        )
+
+    async def cog_load(self):
+        self.whitelist_ids = {row[0] for row in await self.bot.db.whitelist()}
+        for id, kind in await self.bot.db.cache_opt_outs():
+            (self.cache_opt_out_users if kind == "user" else self.cache_opt_out_guilds).add(id)
+        self.quota.load(await self.bot.db.chat_usage(int(time.time() - DAY) // 60))
+        self.flush_usage.start()
+
+    async def cog_unload(self):
+        await self.bursts.close()
+        await self.summarizer.close()
+        await self.scheduler.close()
+        self.flush_usage.cancel()
+        await self.flush_usage()
+
+    @tasks.loop(seconds=60)
+    async def flush_usage(self):
+        """Write token usage recorded since the last flush in one batch"""
+        self.quota.prune()
+        rows = self.quota.take_pending()
+        if not rows:
+            return
+        try:
+            await self.bot.db.add_chat_usage(rows, int(time.time() - DAY) // 60)
+        except Exception:
+            log.exception("Usage flush failed")
+            self.quota.restore_pending(rows)
+
+    def request_tokens(self, messages: List[Dict[str, str]]) -> int:
+        """Estimated tokens a request will count against the per-minute budget"""
+        prompt = sum(estimate_tokens(m["content"]) for m in messages)
+        return prompt + self.expected_completion_tokens
+
+    def record_usage(self, user_id: int, guild_id: int | None, usage, messages, reply: str):
+        """Count a completion against the quotas, estimated if the upstream sent no usage"""
+        if usage:
+            for kind in ("prompt_tokens", "completion_tokens"):
+                LLM_TOKENS.labels(self.backend.model, kind.removesuffix("_tokens")).inc(usage.get(kind, 0))
+        tokens = (usage or {}).get("total_tokens")
+        if tokens is None:
+            tokens = sum(estimate_tokens(m["content"]) for m in messages) + estimate_tokens(reply)
+        self.quota.record(user_id, guild_id, tokens)
+
+    def is_user_whitelisted(self, user_id: int) -> bool:
         """Check if a user is whitelisted for chat"""
-        async with asqlite.connect(self.bot.database_file) as conn:
-            async with conn.cursor() as cursor:
-                await cursor.execute(
-                    "SELECT * FROM chat_whitelist WHERE user_id=?", (user_id,)
-                )
-                rows = await cursor.fetchall()
-                return len(rows) > 0
+        return user_id in self.whitelist_ids
+
+    def use_cache(self, message: discord.Message) -> bool:
+        """Whether this message may be answered from, and stored in, the response cache"""
+        return (
+            self.cache.enabled
+            and message.author.id not in self.cache_opt_out_users
+            and (message.guild is None or message.guild.id not in self.cache_opt_out_guilds)
+        )
 
     async def get_conversation_history(self, user_id: int, limit: int = 20) -> List[Dict[str, str]]:
         """Get conversation history for a user"""
-        async with asqlite.connect(self.bot.database_file) as conn:
-            async with conn.cursor() as cursor:
-                await cursor.execute(
-                    """SELECT role, content FROM chat_memory 
-                       WHERE user_id = ? 
-                       ORDER BY timestamp DESC 
-                       LIMIT ?""",
-                    (user_id, limit * 2)  # Get more to account for pairs
-                )
-                rows = await cursor.fetchall()
-                # Reverse to get chronological order
-                messages = [{"role": row[0], "content": row[1]} for row in reversed(rows)]
-                return messages
-
-    async def save_message(self, user_id: int, role: str, content: str):
-        """Save a message to conversation history"""
-        timestamp = datetime.datetime.now(tz=datetime.timezone.utc).isoformat()
-        async with asqlite.connect(self.bot.database_file) as conn:
-            async with conn.cursor() as cursor:
-                await cursor.execute(
-                    """INSERT INTO chat_memory (user_id, role, content, timestamp) 
-                       VALUES (?, ?, ?, ?)""",
-                    (user_id, role, content, timestamp)
-                )
-                await conn.commit()
+        # Get more to account for pairs
+        return await self.memory.get(user_id, limit * 2)
+
+    async def save_exchange(self, user_id: int, user_content: str, assistant_content: str):
+        """Save a user message and the reply to conversation history"""
+        await self.memory.append(
+            user_id,
+            {"role": "user", "content": user_content},
+            {"role": "assistant", "content": assistant_content},
+        )
+        # Runs as a background task, never delays the reply
+        self.summarizer.maybe_compact(user_id)
 
     async def clear_conversation_history(self, user_id: int):
         """Clear conversation history for a user"""
-        async with asqlite.connect(self.bot.database_file) as conn:
-            async with conn.cursor() as cursor:
-                await cursor.execute(
-                    "DELETE FROM chat_memory WHERE user_id = ?",
-                    (user_id,)
-                )
-                await conn.commit()
-
-    def fix_markdown(self, text: str) -> str:
-        """Fix markdown formatting for Discord"""
-        # Discord markdown is mostly compatible, but we need to ensure:
-        # 1. Proper line breaks (Discord needs \n)
-        # 2. Code blocks are properly formatted
-        
-        # Normalize line breaks
-        text = text.replace('\r\n', '\n').replace('\r', '\n')
-        
-        # Ensure code blocks are properly formatted
-        # Check for unclosed code blocks
-        code_block_count = text.count('```')
-        if code_block_count % 2 != 0:
-            # Unclosed code block, close it
-            text += '\n```'
-        
-        return text
-
-    async def get_groq_response(self, message_content: str, user_id: int) -> str:
+        await self.memory.clear(user_id)
+
+    async def get_groq_response(
+        self,
+        message_content: str,
+        user_id: int,
+        on_queued=None,
+        use_cache: bool = False,
+        guild_id: int | None = None,
+    ) -> str:
         """Get response from Groq API with conversation history"""
-        try:
-            api_key = core.config["GROQ"]["api_key"]
-            model = core.config["GROQ"].get("model", "llama-3.1-70b-versatile")
-        except KeyError:
+        if self.backend is None:
             return "Error: Groq API configuration not found in config.toml"
 
         # Get conversation history
-        history = await self.get_conversation_history(user_id)
-        
-        # Build messages list with history + current message
-        messages = history.copy()
-        messages.append({"role": "user", "content": message_content})
-
-        url = "https://api.groq.com/openai/v1/chat/completions"
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json",
-        }
-        payload = {
-            "model": model,
-            "messages": messages,
-        }
+        history = await self.memory.get(user_id)
+
+        cache_key = (
+            self.cache.key(history, message_content, self.backend.model, user_id, guild_id)
+            if use_cache
+            else None
+        )
+        if cache_key is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                await self.save_exchange(user_id, message_content, cached)
+                return cached
+
+        # Build messages list with as much history as fits the token budget
+        summary = await self.memory.summary(user_id)
+        if self.retriever.enabled:
+            history = await self.retriever.history(user_id, message_content, history)
+        messages = self.context.build(history, message_content, self.backend.model, summary)
+
+        async def request():
+            with timed(LLM_REQUESTS, self.backend.model, "complete"):
+                return await self.backend.complete(messages)
 
         try:
-            async with self.bot.session.post(
-                url, headers=headers, json=payload
-            ) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    response_content = data["choices"][0]["message"]["content"]
-                    
-                    # Save user message and assistant response to history
-                    await self.save_message(user_id, "user", message_content)
-                    await self.save_message(user_id, "assistant", response_content)
-                    
-                    return response_content
-                elif response.status == 401:
-                    return "Error: Invalid Groq API key"
-                elif response.status == 429:
-                    return "Error: Rate limit exceeded. Please try again later."
-                else:
-                    error_text = await response.text()
-                    return f"Error: API request failed with status {response.status}: {error_text}"
+            completion = await self.scheduler.submit(
+                user_id,
+                self.request_tokens(messages),
+                request,
+                on_queued=on_queued,
+            )
         except Exception as e:
-            return f"Error: Failed to connect to Groq API: {str(e)}"
+            return self.request_error(e)
+
+        self.record_usage(user_id, guild_id, completion.usage, messages, completion.content)
+        if cache_key is not None:
+            self.cache.put(cache_key, completion.content)
+
+        # Save user message and assistant response to history
+        await self.save_exchange(user_id, message_content, completion.content)
+        return completion.content
+
+    async def stream_groq_response(
+        self,
+        message_content: str,
+        user_id: int,
+        channel: discord.abc.Messageable,
+        on_queued=None,
+        use_cache: bool = False,
+        guild_id: int | None = None,
+    ) -> str | None:
+        """Stream a response from Groq straight into the channel
+
+        Errors are reported in the channel like the regular request does.
+        Returns None when the endpoint doesn't support streaming, so the
+        caller can fall back to the regular request.
+        """
+        if self.backend is None:
+            return None
+
+        history = await self.memory.get(user_id)
+        reply = StreamingReply(
+            channel,
+            interval=self.stream_edit_interval,
+            max_messages=self.long_reply_chunks if self.long_reply != "messages" else 0,
+            on_overflow=lambda text, rest: self.spill_reply(channel, user_id, text, rest),
+        )
+
+        cache_key = (
+            self.cache.key(history, message_content, self.backend.model, user_id, guild_id)
+            if use_cache
+            else None
+        )
+        if cache_key is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                await reply.feed(cached)
+                await reply.finish()
+                await self.save_exchange(user_id, message_content, cached)
+                return cached
+
+        summary = await self.memory.summary(user_id)
+        if self.retriever.enabled:
+            history = await self.retriever.history(user_id, message_content, history)
+        messages = self.context.build(history, message_content, self.backend.model, summary)
+
+        usage = None
+
+        async def request():
+            nonlocal usage
+            parts = []
+            with timed(LLM_REQUESTS, self.backend.model, "stream"):
+                async with self.backend.stream(messages) as stream:
+                    async for delta in stream:
+                        parts.append(delta)
+                        await reply.feed(delta)
+            usage = stream.usage
+            return "".join(parts)
 
-    def should_respond_to_message(self, message: discord.Message) -> bool:
-        """Check if bot should respond to this message"""
-        # Check if bot is mentioned
-        if self.bot.user in message.mentions:
-            return True
+        try:
+            response_content = await self.scheduler.submit(
+                user_id, self.request_tokens(messages), request, on_queued=on_queued
+            )
+        except Exception as e:
+            if not reply.started:
+                if isinstance(e, BackendError) and e.status in STREAM_UNSUPPORTED:
+                    return None
+                error = self.request_error(e)
+                await channel.send(error)
+                return error
+            self.record_usage(user_id, guild_id, None, messages, reply.text)
+            # Keep what was already shown but don't remember a partial answer
+            await reply.feed(f"\n\nError: stream interrupted: {str(e)}")
+            await reply.finish()
+            return reply.text
+
+        if not response_content:
+            # Accepted but no events, the endpoint ignored the stream flag
+            return None
+
+        await reply.finish()
+        self.record_usage(user_id, guild_id, usage, messages, response_content)
+        if cache_key is not None:
+            self.cache.put(cache_key, response_content)
+        await self.save_exchange(user_id, message_content, response_content)
+        return response_content
+
+    def request_error(self, error: Exception) -> str:
+        """What to tell the user when a request to the backend failed"""
+        if isinstance(error, RateLimited):
+            return "Error: Rate limit exceeded. Please try again later."
+        if isinstance(error, BackendError):
+            if error.status == 401:
+                return f"Error: Invalid {self.backend.name} API key"
+            return f"Error: {error}"
+        return f"Error: Failed to connect to {self.backend.name} API: {str(error)}"
+
+    async def send_reply(self, channel: discord.abc.Messageable, user_id: int, text: str):
+        """Send a complete reply, spilling it if it runs past long_reply_chunks messages"""
+        chunks = chunk_text(text, MESSAGE_LIMIT)
+        if len(chunks) <= self.long_reply_chunks or self.long_reply == "messages":
+            for chunk in chunks:
+                await channel.send(chunk)
+            return
+        preview = chunk_text(text, PREVIEW_LIMIT)[0]
+        await self.spill_reply(channel, user_id, text, chunks, preview)
+
+    async def spill_reply(
+        self,
+        channel: discord.abc.Messageable,
+        user_id: int,
+        text: str,
+        pages: List[str],
+        preview: str | None = None,
+    ):
+        """Deliver a long reply, or what is left of it, in a single message
 
-        return False
+        ``pages`` are the chunks not shown yet, ``text`` the whole reply.
+        """
+        if self.long_reply == "paginate":
+            await Paginator(pages, author_id=user_id).send(channel)
+            return
+        note = f"📄 Full reply attached ({len(text):,} characters)"
+        content = f"{preview}\n\n{note}" if preview else note
+        file = discord.File(io.BytesIO(text.encode()), filename="reply.md")
+        await channel.send(content, file=file)
 
     # @commands.group(invoke_without_command=True)
     # async def chat(self, ctx):
@@ -191,28 +469,19 @@ class ChatModule(commands.Cog):
                 return
 
             try:
-                async with asqlite.connect(ctx.bot.database_file) as conn:
-                    async with conn.cursor() as cursor:
-                        for user in users:
-                            await cursor.execute(
-                                "SELECT * FROM chat_whitelist WHERE user_id=?", (user.id,)
-                            )
-                            rows = await cursor.fetchall()
-                            if not rows:
-                                try:
-                                    await cursor.execute(
-                                        "INSERT INTO chat_whitelist VALUES(?,?)",
-                                        (user.id, str(user)),
-                                    )
-                                    await conn.commit()
-                                    await ctx.send(f"Added {user.mention} to chat whitelist! 👍🏿")
-                                except Exception as e:
-                                    print(e)
-                                    await ctx.send(f"Error adding {user.mention}: {str(e)}")
-                            else:
-                                await ctx.send(
-                                    f"{user.mention} is already whitelisted!"
-                                )
+                for user in users:
+                    if not self.is_user_whitelisted(user.id):
+                        try:
+                            await self.bot.db.add_whitelist(user.id, str(user))
+                            self.whitelist_ids.add(user.id)
+                            await ctx.send(f"Added {user.mention} to chat whitelist! 👍🏿")
+                        except Exception as e:
+                            print(e)
+                            await ctx.send(f"Error adding {user.mention}: {str(e)}")
+                    else:
+                        await ctx.send(
+                            f"{user.mention} is already whitelisted!"
+                        )
             except Exception as e:
                 print(e)
                 await ctx.send("An error occurred while adding users to whitelist.")
@@ -230,26 +499,17 @@ class ChatModule(commands.Cog):
                 return
 
             try:
-                async with asqlite.connect(ctx.bot.database_file) as conn:
-                    async with conn.cursor() as cursor:
-                        for user in users:
-                            await cursor.execute(
-                                "SELECT * FROM chat_whitelist WHERE user_id=?", (user.id,)
-                            )
-                            rows = await cursor.fetchall()
-                            if rows:
-                                try:
-                                    await cursor.execute(
-                                        "DELETE FROM chat_whitelist WHERE user_id=?",
-                                        (user.id,),
-                                    )
-                                    await conn.commit()
-                                    await ctx.send(f"Removed {user.mention} from chat whitelist! 👍🏿")
-                                except Exception as e:
-                                    print(e)
-                                    await ctx.send(f"Error removing {user.mention}: {str(e)}")
-                            else:
-                                await ctx.send(f"{user.mention} is not whitelisted!")
+                for user in users:
+                    if self.is_user_whitelisted(user.id):
+                        try:
+                            await self.bot.db.remove_whitelist(user.id)
+                            self.whitelist_ids.discard(user.id)
+                            await ctx.send(f"Removed {user.mention} from chat whitelist! 👍🏿")
+                        except Exception as e:
+                            print(e)
+                            await ctx.send(f"Error removing {user.mention}: {str(e)}")
+                    else:
+                        await ctx.send(f"{user.mention} is not whitelisted!")
             except Exception as e:
                 print(e)
                 await ctx.send("An error occurred while removing users from whitelist.")
@@ -261,30 +521,130 @@ class ChatModule(commands.Cog):
         """List all whitelisted users"""
         if ctx.message.author.id == 450647525469454336:
             try:
-                async with asqlite.connect(ctx.bot.database_file) as conn:
-                    async with conn.cursor() as cursor:
-                        await cursor.execute("SELECT * FROM chat_whitelist")
-                        rows = await cursor.fetchall()
-                        if rows:
-                            user_list = "\n".join([f"• {row[1]} (ID: {row[0]})" for row in rows])
-                            embed = discord.Embed(
-                                title="Chat Whitelist",
-                                description=user_list,
-                                colour=discord.Colour.green(),
-                            )
-                            await ctx.send(embed=embed)
-                        else:
-                            await ctx.send("No users are currently whitelisted.")
+                rows = await self.bot.db.whitelist()
+                if rows:
+                    user_list = "\n".join([f"• {row[1]} (ID: {row[0]})" for row in rows])
+                    embed = discord.Embed(
+                        title="Chat Whitelist",
+                        description=user_list,
+                        colour=discord.Colour.green(),
+                    )
+                    await ctx.send(embed=embed)
+                else:
+                    await ctx.send("No users are currently whitelisted.")
             except Exception as e:
                 print(e)
                 await ctx.send("An error occurred while fetching the whitelist.")
         else:
             await ctx.send("You don't have permissions to use this command!")
 
+    @commands.command(pass_context=True)
+    async def chat_stats(self, ctx):
+        """Show latency and failover stats per model (Admin only)"""
+        if ctx.message.author.id != 450647525469454336:
+            await ctx.send("You don't have permissions to use this command!")
+            return
+        if self.backend is None:
+            await ctx.send("Chat is not configured.")
+            return
+
+        def seconds(value):
+            return "-" if value is None else f"{value:.2f}s"
+
+        embed = discord.Embed(
+            title="Chat Models",
+            description=f"Hedged requests: {self.backend.hedges} • Failovers: {self.backend.failovers}",
+            colour=discord.Colour.green(),
+        )
+        if self.cache.enabled:
+            cache = self.cache.stats()
+            embed.add_field(
+                name="Response cache",
+                value=(
+                    f"Hits: {cache['exact_hits']} exact, {cache['near_hits']} similar • Misses: {cache['misses']}\n"
+                    f"Entries: {cache['exact_entries']} exact, {cache['near_entries']} similar"
+                ),
+                inline=False,
+            )
+        for stats in self.backend.stats():
+            embed.add_field(
+                name=stats["route"],
+                value=(
+                    f"Requests: {stats['requests']} (won {stats['wins']}, failed {stats['failures']})\n"
+                    f"p50 {seconds(stats['p50'])} • p95 {seconds(stats['p95'])}\n"
+                    f"First token p95 {seconds(stats['first_token_p95'])}"
+                ),
+                inline=False,
+            )
+        await ctx.send(embed=embed)
+
+    @commands.command(pass_context=True)
+    async def chat_usage(self, ctx, limit: int = 10):
+        """Show who used the most chat tokens today (Admin only)"""
+        if ctx.message.author.id != 450647525469454336:
+            await ctx.send("You don't have permissions to use this command!")
+            return
+        # Keeps each embed field under Discord's 1024 character limit
+        limit = max(1, min(limit, 15))
+
+        def rows(kind, lookup):
+            hourly = dict(self.quota.top(kind, HOUR, limit=len(self.quota.usage)))
+            lines = []
+            for rank, (id, tokens) in enumerate(self.quota.top(kind, DAY, limit), start=1):
+                target = lookup(id)
+                name = target.name if target else id
+                lines.append(f"{rank}. {name}: {tokens:,} today, {hourly.get(id, 0):,} this hour")
+            return "\n".join(lines) or "No usage yet"
+
+        limits = self.quota.limits
+        embed = discord.Embed(
+            title="Chat Token Usage",
+            description=(
+                f"Quota per user: {limits['user'][HOUR] or '∞'}/hour, {limits['user'][DAY] or '∞'}/day\n"
+                f"Quota per server: {limits['guild'][HOUR] or '∞'}/hour, {limits['guild'][DAY] or '∞'}/day\n"
+                f"Requests turned away: {self.quota.denied}"
+            ),
+            colour=discord.Colour.green(),
+        )
+        embed.add_field(name="Users", value=rows("user", self.bot.get_user), inline=False)
+        embed.add_field(name="Servers", value=rows("guild", self.bot.get_guild), inline=False)
+        await ctx.send(embed=embed)
+
+    @commands.group(invoke_without_command=True)
+    async def chat_cache(self, ctx):
+        """Opt in or out of answers from the response cache"""
+        pass
+
+    @chat_cache.command(name="user")
+    async def chat_cache_user(self, ctx, state: Literal["on", "off"]):
+        """Turn the response cache on or off for your own messages"""
+        if state == "off":
+            await self.bot.db.add_cache_opt_out(ctx.author.id, "user")
+            self.cache_opt_out_users.add(ctx.author.id)
+            await ctx.send("Your messages will no longer use the response cache. 👍🏿")
+        else:
+            await self.bot.db.remove_cache_opt_out(ctx.author.id, "user")
+            self.cache_opt_out_users.discard(ctx.author.id)
+            await ctx.send("Your messages can use the response cache again. 👍🏿")
+
+    @chat_cache.command(name="server")
+    @commands.guild_only()
+    @commands.has_permissions(manage_guild=True)
+    async def chat_cache_server(self, ctx, state: Literal["on", "off"]):
+        """Turn the response cache on or off for this server"""
+        if state == "off":
+            await self.bot.db.add_cache_opt_out(ctx.guild.id, "guild")
+            self.cache_opt_out_guilds.add(ctx.guild.id)
+            await ctx.send("Messages in this server will no longer use the response cache. 👍🏿")
+        else:
+            await self.bot.db.remove_cache_opt_out(ctx.guild.id, "guild")
+            self.cache_opt_out_guilds.discard(ctx.guild.id)
+            await ctx.send("Messages in this server can use the response cache again. 👍🏿")
+
     @commands.command(pass_context=True)
     async def clear_memory(self, ctx):
         """Clear your conversation history with the bot"""
-        if not await self.is_user_whitelisted(ctx.author.id):
+        if not self.is_user_whitelisted(ctx.author.id):
             await ctx.send("You are not whitelisted to use chat features.")
             return
         
@@ -307,103 +667,85 @@ class ChatModule(commands.Cog):
         await self.clear_conversation_history(user.id)
         await ctx.send(f"Cleared conversation history for {user.mention}! 👍🏿")
 
-    @commands.Cog.listener()
-    async def on_message(self, message: discord.Message):
+    # Only guild messages that mention the bot, from whitelisted users,
+    # and not "@bot <command>" which goes to the command instead
+    @message_handler(
+        priority=HIGH,
+        guild_only=True,
+        mention_only=True,
+        check=lambda self, ctx: self.is_user_whitelisted(ctx.author_id)
+        and ctx.prefix not in self.bot.prefixes.mentions,
+    )
+    async def on_mention(self, ctx: MessageContext):
         """Handle messages from whitelisted users"""
-        # Ignore bots and DMs
-        if message.author.bot or message.guild is None:
-            return
-
-        # Check if user is whitelisted
-        if not await self.is_user_whitelisted(message.author.id):
-            return
-
-        # Check if bot should respond (mentioned or prefix used)
-        if not self.should_respond_to_message(message):
-            return
-
-        # Extract message content (remove mention/prefix)
-        content = message.content
+        message = ctx.message
 
         # Remove bot mention
-        if self.bot.user in message.mentions:
-            content = content.replace(f"<@{self.bot.user.id}>", "").replace(
-                f"<@!{self.bot.user.id}>", ""
-            )
-            content = content.strip()
+        content = message.content.replace(f"<@{self.bot.user.id}>", "").replace(
+            f"<@!{self.bot.user.id}>", ""
+        )
+        content = content.strip()
 
         # Remove prefix if present
-        if message.guild:
-            try:
-                prefix = self.bot.prefixes[message.guild.id]
-                if content.startswith(prefix):
-                    content = content[len(prefix) :].strip()
-            except KeyError:
-                pass
-
-        if content.startswith("yo bro"):
-            content = content[7:].strip()
+        for prefix in self.bot.prefixes.get(message):
+            if content.startswith(prefix):
+                content = content[len(prefix) :].strip()
+                break
 
         # Don't process empty messages
         if not content:
             return
 
+        self.bursts.push((message.channel.id, message.author.id), (message, content))
+
+    async def respond(self, key: tuple[int, int], burst: List[tuple[discord.Message, str]]):
+        """Answer a burst of mentions from one user with a single reply"""
+        # Reply to the latest message, with everything said so far as the prompt
+        message = burst[-1][0]
+        content = "\n".join(text for _, text in burst)
+
+        async def on_queued(position: int, wait: float):
+            await message.reply(
+                f"Busy right now, you're #{position + 1} in the queue (about {wait:.0f}s) ⏳",
+                mention_author=False,
+                delete_after=max(wait, 5),
+            )
+
+        guild_id = message.guild.id if message.guild else None
+        exceeded = self.quota.check(message.author.id, guild_id)
+        if exceeded is not None:
+            retry_at = discord.utils.utcnow() + timedelta(seconds=exceeded.retry_after)
+            who = "You've" if exceeded.kind == "user" else "This server has"
+            await message.reply(
+                f"{who} used up the chat allowance for this {exceeded.window}, "
+                f"try again {discord.utils.format_dt(retry_at, 'R')} ⏳",
+                mention_author=False,
+            )
+            return
+
+        use_cache = self.use_cache(message)
+
         # Show typing indicator
         async with message.channel.typing():
+            if self.stream:
+                streamed = await self.stream_groq_response(
+                    content,
+                    message.author.id,
+                    message.channel,
+                    on_queued=on_queued,
+                    use_cache=use_cache,
+                    guild_id=guild_id,
+                )
+                if streamed is not None:
+                    return
+
             # Get response from Groq API with conversation history
-            response = await self.get_groq_response(content, message.author.id)
+            response = await self.get_groq_response(
+                content, message.author.id, on_queued=on_queued, use_cache=use_cache, guild_id=guild_id
+            )
             
-            # Fix markdown formatting for Discord
-            response = self.fix_markdown(response)
-
-            # Send response (split if too long)
             # Discord has a 2000 character limit per message
-            if len(response) > 2000:
-                # Split into chunks, trying to preserve code blocks
-                chunks = []
-                current_chunk = ""
-                in_code_block = False
-                code_block_lang = ""
-                
-                for line in response.split('\n'):
-                    # Check if line starts/ends code blocks
-                    if line.strip().startswith('```'):
-                        if in_code_block:
-                            # Ending code block
-                            current_chunk += line + '\n'
-                            if len(current_chunk) > 1900:
-                                chunks.append(current_chunk)
-                                current_chunk = ""
-                            in_code_block = False
-                            code_block_lang = ""
-                        else:
-                            # Starting code block - extract language
-                            code_block_lang = line.strip()[3:].strip()
-                            if len(current_chunk) + len(line) + 1 > 1900:
-                                if current_chunk:
-                                    chunks.append(current_chunk)
-                                current_chunk = line + '\n'
-                            else:
-                                current_chunk += line + '\n'
-                            in_code_block = True
-                    else:
-                        # Regular line
-                        if len(current_chunk) + len(line) + 1 > 1900:
-                            if current_chunk:
-                                chunks.append(current_chunk)
-                            current_chunk = line + '\n'
-                        else:
-                            current_chunk += line + '\n'
-                
-                # Add remaining chunk
-                if current_chunk:
-                    chunks.append(current_chunk)
-                
-                # Send chunks
-                for chunk in chunks:
-                    await message.channel.send(chunk)
-            else:
-                await message.channel.send(response)
+            await self.send_reply(message.channel, message.author.id, response)
 
 
 async def setup(bot):
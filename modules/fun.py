@@ -22,39 +22,19 @@ SOFTWARE.
 """
 
 
-import asqlite
 import discord
 from discord.ext import commands
 import asyncio
 
+from core import LOW, MessageContext, message_handler, prioritized
 
-class channel_blocked(commands.CommandError):
-    def __init__(self) -> None:
-        super().__init__("Disabled in channel")
-
-
-def disable_channel():
-    async def predicate(ctx):
-        async with asqlite.connect(ctx.bot.database_file) as conn:
-            async with conn.cursor() as cursor:
-                await cursor.execute(
-                    "SELECT * FROM permissions WHERE user_id=?", (ctx.channel.id)
-                )
-                rows = await cursor.fetchall()
-                if rows:
-                    for row in rows:
-                        if ctx.channel.id not in row:
-                            raise channel_blocked()
-                else:
-                    return True
-
-    return commands.check(predicate)
+THEGHO_CHANNELS = (493063429133697024, 621609685539225622)
 
 
 class fun(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.channelids = [493063429133697024, 621609685539225622]
+        self.channelids = list(THEGHO_CHANNELS)
 
     async def cog_load(self):
         asyncio.create_task(self.get_cache())
@@ -78,31 +58,36 @@ class fun(commands.Cog):
         theghoemoji = discord.utils.get(theghoguild.emojis, name="thegho")
         klpdemoji = discord.utils.get(theghoguild.emojis, name="klpd")
 
-    @commands.Cog.listener()
-    async def on_message(self, message):
-        if message.guild is None and not message.author.bot:
-            if message.attachments:
-                for attachment in message.attachments:
-                    await channel.send(attachment.url)
-            embed = discord.Embed(
-                description=message.content, colour=discord.Colour.random()
-            )
-            embed.set_footer(
-                text=f"""By {message.author},
+    @message_handler(dm_only=True, priority=LOW)
+    async def log_dm(self, ctx: MessageContext):
+        message = ctx.message
+        if message.attachments:
+            for attachment in message.attachments:
+                await channel.send(attachment.url)
+        embed = discord.Embed(
+            description=message.content, colour=discord.Colour.random()
+        )
+        embed.set_footer(
+            text=f"""By {message.author},
                                       ID = {message.author.id} messageID = {message.id}"""
-            )
-            await channel.send(embed=embed)
-
-        if (
-            message.content.lower() == "thegho"
-            and message.channel.id in self.channelids
-            and girlrole not in message.author.roles
-        ):
+        )
+        await channel.send(embed=embed)
+
+    @message_handler(
+        channels=THEGHO_CHANNELS,
+        include_bots=True,
+        priority=LOW,
+        check=lambda self, ctx: ctx.content.lower() == "thegho",
+    )
+    async def thegho(self, ctx: MessageContext):
+        message = ctx.message
+        if girlrole not in message.author.roles:
             for i in (letterg, letterh, lettero, theghoemoji, "🤨"):
                 if message.author.id != 687745796506255453:
                     await message.add_reaction(str(i))
 
     @commands.Cog.listener()
+    @prioritized(LOW)
     async def on_message_delete(self, msg):
         if not msg.attachments:
             await channel.send(
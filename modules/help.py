@@ -1,6 +1,6 @@
 import discord
 from discord.ext import commands
-from .useful import disable_channel
+from core import disable_channel
 
 
 class MyHelp(commands.HelpCommand):
@@ -2,11 +2,14 @@ import asyncio
 import asqlite
 import discord
 from discord.ext import commands
+from functools import partial
 import math
 from datetime import datetime
 import re
 import io
 
+from core import LOW
+
 time_regex = re.compile(r"(?:(\d{1,5})(h|s|m|d))+?")
 time_dict = {"h": 3600, "s": 1, "m": 60, "d": 86400}
 
@@ -54,18 +57,22 @@ class Listeners(commands.Cog):
             1415311402608103484: self.spike_league_open_role,
         }
 
+    def log(self, text: str):
+        """Post to the log channel, shed first when the bot is under load"""
+        self.bot.executor.submit(LOW, "Listeners.log", partial(self.log_channel.send, text))
+
     @commands.Cog.listener(name="on_voice_state_update")
     async def voice_join(self, member, before, after):
         if after.channel is not None and after.channel.id in self.spikeleague_channel_ids:
             
-            await self.log_channel.send(f"{member} joined {after.channel.name}")
+            self.log(f"{member} joined {after.channel.name}")
             
             if any(role not in member.roles for role in self.channel_role_mapping.values()):
                 # Check if the channel ID matches one of the keys in the mapping
                 if after.channel.id in self.channel_role_mapping:
                     role_to_add = self.channel_role_mapping[after.channel.id]
                     await member.add_roles(role_to_add)
-                    await self.log_channel.send(f"Added role {role_to_add.name} to {member}.")
+                    self.log(f"Added role {role_to_add.name} to {member}.")
 
 
     @commands.Cog.listener(name="on_voice_state_update")
@@ -73,36 +80,36 @@ class Listeners(commands.Cog):
         # Condition 1: Member leaves a voice channel that is in spikeleague_channel_ids
         if after.channel is None and before.channel.id in self.spikeleague_channel_ids:
             # Log the channel the member left
-            await self.log_channel.send(f"{member} left {before.channel.name}")
+            self.log(f"{member} left {before.channel.name}")
 
             # Look up the role to remove based on the before.channel.id
             role_to_remove = self.channel_role_mapping.get(before.channel.id)
 
             if role_to_remove and role_to_remove in member.roles:
                 await member.remove_roles(role_to_remove)
-                await self.log_channel.send(f"Removed {role_to_remove.name} role from {member}")
+                self.log(f"Removed {role_to_remove.name} role from {member}")
 
         elif after.channel is not None and before.channel.id in self.spikeleague_channel_ids:
             # Log the channel the member left
-            await self.log_channel.send(f"{member} left {before.channel.name}")
+            self.log(f"{member} left {before.channel.name}")
 
             # Look up the role to remove based on the before.channel.id
             role_to_remove = self.channel_role_mapping.get(before.channel.id)
 
             if role_to_remove and role_to_remove in member.roles:
                 await member.remove_roles(role_to_remove)
-                await self.log_channel.send(f"Removed {role_to_remove.name} role from {member}")
+                self.log(f"Removed {role_to_remove.name} role from {member}")
 
         # Condition 2: If the member leaves a channel that is not in spikeleague_channel_ids or other conditions
         elif after.channel is None or (after.channel.id not in self.spikeleague_channel_ids and before.channel is not None):
             # Log the channel the member left
-            await self.log_channel.send(f"{member} left {before.channel.name}")
+            self.log(f"{member} left {before.channel.name}")
 
             # Loop through the channel-role mapping and remove the corresponding role
             for channel_id, role in self.channel_role_mapping.items():
                 if before.channel.id == channel_id and role in member.roles:
                     await member.remove_roles(role)
-                    await self.log_channel.send(f"Removed {role.name} role from {member}")
+                    self.log(f"Removed {role.name} role from {member}")
 
 async def setup(bot):
     await bot.add_cog(Listeners(bot))
@@ -0,0 +1,262 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2022-Present Marble
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+
+import asyncio
+import io
+import logging
+import marshal
+from typing import Literal
+
+import discord
+from discord.ext import commands, tasks
+
+import core
+from core import metrics, perms
+from database.retention import Retention, RetentionReport
+from utils.profiling import format_stats, run_cprofile, sample_stacks, short_path, trace_allocations
+
+log = logging.getLogger(__name__)
+
+
+def top_timings(histogram: metrics.Histogram, limit: int = 5, by_total: bool = False) -> str:
+    """The busiest label sets of a histogram, one line each"""
+    children = sorted(
+        histogram.children.items(),
+        key=lambda item: item[1].sum if by_total else item[1].count,
+        reverse=True,
+    )
+    lines = []
+    for labels, child in children[:limit]:
+        if not child.count:
+            continue
+        lines.append(
+            f"`{' '.join(labels)}` ×{child.count} • p50 {child.quantile(0.5) * 1000:.0f}ms • "
+            f"p95 {child.quantile(0.95) * 1000:.0f}ms • total {child.sum:.1f}s"
+        )
+    return "\n".join(lines) or "Nothing yet"
+
+
+def text_file(text: str, filename: str) -> discord.File:
+    return discord.File(io.BytesIO(text.encode()), filename=filename)
+
+
+def human_size(size: int) -> str:
+    for unit in ("B", "KiB", "MiB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GiB"
+
+
+class Maintenance(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+        retention_config = core.config.get("DATABASE", {}).get("retention", {})
+        self.retention = Retention.from_config(bot.pool, retention_config)
+        self.enforce_retention.change_interval(minutes=retention_config.get("interval_minutes", 60))
+        self.last_report: RetentionReport | None = None
+        # One profile at a time, they would measure each other
+        self.profiling = asyncio.Lock()
+
+    async def cog_load(self):
+        self.enforce_retention.start()
+
+    async def cog_unload(self):
+        self.enforce_retention.cancel()
+
+    async def run_retention(self) -> RetentionReport:
+        report = await self.retention.run()
+        self.last_report = report
+        # Cached conversations may hold turns that are gone now
+        chat = self.bot.get_cog("ChatModule")
+        if chat is not None:
+            for user_id in report.users:
+                chat.memory.forget(user_id)
+        return report
+
+    @tasks.loop(minutes=60)
+    async def enforce_retention(self):
+        try:
+            await self.run_retention()
+        except Exception:
+            log.exception("Retention run failed")
+
+    @enforce_retention.before_loop
+    async def before_enforce_retention(self):
+        await self.bot.wait_until_ready()
+
+    @commands.command(hidden=True)
+    @perms()
+    async def retention(self, ctx):
+        """Apply the chat history retention policy now and report what it freed"""
+        async with ctx.typing():
+            report = await self.run_retention()
+        embed = discord.Embed(title="Retention", colour=discord.Colour.green())
+        embed.add_field(
+            name="Chat turns removed",
+            value=(
+                f"{report.deleted} ({report.by_turns} over the per-user limit, "
+                f"{report.by_age} too old, {report.by_cap} over the size cap)"
+            ),
+            inline=False,
+        )
+        embed.add_field(name="Summaries removed", value=str(report.summaries))
+        embed.add_field(name="Users affected", value=str(len(report.users)))
+        embed.add_field(
+            name="Database size",
+            value=(
+                f"{human_size(report.size_before)} → {human_size(report.size_after)} "
+                f"(reclaimed {human_size(report.reclaimed)})"
+            ),
+            inline=False,
+        )
+        embed.set_footer(text=f"Took {report.duration:.1f}s")
+        await ctx.send(embed=embed)
+
+    @commands.command(hidden=True, name="metrics")
+    @commands.is_owner()
+    async def metrics_summary(self, ctx):
+        """Summarize the busiest commands, queries, LLM calls and Discord requests"""
+        embed = discord.Embed(
+            title="Metrics",
+            description=f"Event loop lag: {self.bot.executor.lag * 1000:.0f}ms",
+            colour=discord.Colour.green(),
+        )
+        for name, histogram, by_total in (
+            ("Commands", metrics.COMMANDS, False),
+            ("Database statements (by total time)", metrics.DB_QUERIES, True),
+            ("LLM requests", metrics.LLM_REQUESTS, False),
+            ("Discord requests", metrics.DISCORD_REQUESTS, False),
+            ("Handlers (by total time)", metrics.HANDLERS, True),
+        ):
+            # Field values are capped at 1024 characters
+            embed.add_field(name=name, value=top_timings(histogram, by_total=by_total)[:1024], inline=False)
+        tokens = ", ".join(
+            f"{model} {kind} {child.value:,.0f}" for (model, kind), child in metrics.LLM_TOKENS.children.items()
+        )
+        shed = sum(child.value for child in metrics.HANDLERS_SHED.children.values())
+        embed.add_field(name="LLM tokens", value=tokens or "None yet", inline=False)
+        embed.add_field(name="Handler jobs shed", value=f"{shed:,.0f}", inline=False)
+        await ctx.send(embed=embed)
+
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def profile(
+        self, ctx, mode: Literal["sample", "cprofile", "memory"] = "sample", seconds: float = 10.0
+    ):
+        """Profile the running bot for a few seconds and attach the results
+
+        sample: low overhead stack sampling of the event loop from a thread,
+        with a collapsed-stack file for flamegraph tools. cprofile: exact
+        call counts and times, slower while it runs. memory: tracemalloc
+        top allocation sites and what grew during the window.
+        """
+        if self.profiling.locked():
+            await ctx.send("A profile is already running.")
+            return
+        seconds = max(1.0, min(seconds, 120.0))
+        async with self.profiling:
+            await ctx.send(f"Profiling ({mode}) for {seconds:.0f}s…")
+            if mode == "sample":
+                summary, files = await self.profile_sample(seconds)
+            elif mode == "cprofile":
+                summary, files = await self.profile_cprofile(seconds)
+            else:
+                summary, files = await self.profile_memory(seconds)
+        await ctx.send(f"```\n{summary[:1900]}\n```", files=files)
+
+    async def profile_sample(self, seconds: float) -> tuple[str, list[discord.File]]:
+        sampler = await sample_stacks(seconds)
+        cumulative, own = sampler.top(20)
+        total = max(sampler.samples, 1)
+
+        def table(rows):
+            return "\n".join(f"{count:>7} {count / total:7.1%}  {label}" for label, count in rows)
+
+        report = (
+            f"{sampler.samples} samples over {seconds:.0f}s\n\n"
+            f"Cumulative (on the stack)\n{table(cumulative)}\n\n"
+            f"Self (top of the stack)\n{table(own)}\n"
+        )
+        summary = f"{sampler.samples} samples\nSelf\n{table(own[:10])}"
+        return summary, [text_file(report, "profile.txt"), text_file(sampler.collapsed(), "stacks.folded")]
+
+    async def profile_cprofile(self, seconds: float) -> tuple[str, list[discord.File]]:
+        stats = await run_cprofile(seconds)
+        cumulative = format_stats(stats, "cumulative", 25)
+        own = format_stats(stats, "tottime", 25)
+        header = f"{stats.total_calls} calls in {stats.total_tt:.3f}s over {seconds:.0f}s\n\n"
+        report = f"{header}By cumulative time\n{cumulative}\nBy own time\n{own}"
+        summary = header + format_stats(stats, "tottime", 8)
+        # Loadable with pstats.Stats, snakeviz or similar
+        raw = discord.File(io.BytesIO(marshal.dumps(stats.stats)), filename="profile.prof")
+        return summary, [text_file(report, "profile.txt"), raw]
+
+    async def profile_memory(self, seconds: float) -> tuple[str, list[discord.File]]:
+        report = await trace_allocations(seconds, limit=25)
+
+        def site(frame):
+            return f"{short_path(frame.filename)}:{frame.lineno}"
+
+        top = "\n".join(
+            f"{human_size(stat.size):>10} {stat.count:>8} blocks  {site(stat.traceback[0])}" for stat in report.top
+        )
+        growth = "\n".join(
+            f"{'+' + human_size(diff.size_diff):>10} {diff.count_diff:>+8} blocks  {site(diff.traceback[0])}"
+            for diff in report.growth
+        )
+        text = (
+            f"Traced {human_size(report.traced)}, peak {human_size(report.peak)} "
+            f"(only allocations made while tracing)\n\n"
+            f"Top allocation sites\n{top or 'none'}\n\n"
+            f"Growth over {seconds:.0f}s\n{growth or 'none'}\n"
+        )
+        return text, [text_file(text, "memory.txt")]
+
+    @commands.command(hidden=True)
+    @perms()
+    async def load_stats(self, ctx):
+        """Show event loop lag and what the handler executor queued and shed"""
+        executor = self.bot.executor
+        embed = discord.Embed(
+            title="Load",
+            description=f"Event loop lag: {executor.lag * 1000:.0f}ms (max {executor.max_lag * 1000:.0f}ms)",
+            colour=discord.Colour.green(),
+        )
+        for stats in executor.stats():
+            shed = ", ".join(f"{count} {reason}" for reason, count in stats["shed"].items()) or "none"
+            top = sorted(stats["shed_by_name"].items(), key=lambda item: item[1], reverse=True)[:3]
+            value = (
+                f"Running {stats['running']} • Queued {stats['queued']}\n"
+                f"Done {stats['completed']} • Failed {stats['failed']} of {stats['submitted']}\n"
+                f"Shed: {shed}"
+            )
+            if top:
+                value += "\n" + ", ".join(f"{name} ×{count}" for name, count in top)
+            embed.add_field(name=stats["class"].capitalize(), value=value, inline=False)
+        await ctx.send(embed=embed)
+
+
+async def setup(bot):
+    await bot.add_cog(Maintenance(bot))
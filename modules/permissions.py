@@ -22,7 +22,6 @@ SOFTWARE.
 """
 
 
-import asqlite
 import discord
 from typing import Union
 from discord.ext import commands
@@ -56,27 +55,13 @@ class permission_control(commands.Cog):
     ):
         if ctx.message.author.id == 450647525469454336:
             try:
-                async with asqlite.connect(ctx.bot.database_file) as conn:
-                    async with conn.cursor() as cursor:
-                        for user in users:
-                            await cursor.execute(
-                                "SELECT * FROM permissions WHERE user_id=?", (user.id)
-                            )
-                            rows = await cursor.fetchall()
-                            if not rows:
-                                try:
-                                    await cursor.execute(
-                                        "INSERT INTO permissions VALUES(?,?,?)",
-                                        (str(user), user.id, 1),
-                                    )
-                                    await conn.commit()
-                                except Exception as e:
-                                    print(e)
-                                await ctx.send("👍🏿")
-                            else:
-                                await ctx.send(
-                                    f"{user.mention} already have permissions!"
-                                )
+                for user in users:
+                    if await self.bot.auth.grant(user.id, str(user)):
+                        await ctx.send("👍🏿")
+                    else:
+                        await ctx.send(
+                            f"{user.mention} already have permissions!"
+                        )
             except:
                 pass
         else:
@@ -88,23 +73,9 @@ class permission_control(commands.Cog):
     ):
         if ctx.message.author.id == 450647525469454336:
             try:
-                async with asqlite.connect(ctx.bot.database_file) as conn:
-                    async with conn.cursor() as cursor:
-                        for user in users:
-                            await cursor.execute(
-                                "SELECT * FROM permissions WHERE user_id=?", (user.id)
-                            )
-                            rows = await cursor.fetchall()
-                            if rows:
-                                try:
-                                    await cursor.execute(
-                                        "DELETE FROM permissions WHERE user_id=?",
-                                        (user.id),
-                                    )
-                                    await conn.commit()
-                                    await ctx.send("👍🏿")
-                                except Exception as e:
-                                    print(e)
+                for user in users:
+                    if await self.bot.auth.revoke(user.id):
+                        await ctx.send("👍🏿")
             except Exception as e:
                 print(e)
 
@@ -119,26 +90,11 @@ class permission_control(commands.Cog):
     async def block(self, ctx, channels: commands.Greedy[discord.TextChannel]):
         if ctx.message.author.id == 450647525469454336:
             try:
-                async with asqlite.connect(ctx.bot.database_file) as conn:
-                    async with conn.cursor() as cursor:
-                        for channel in channels:
-                            await cursor.execute(
-                                "SELECT * FROM permissions WHERE user_id=?",
-                                (channel.id),
-                            )
-                            rows = await cursor.fetchall()
-                            if not rows:
-                                try:
-                                    await cursor.execute(
-                                        "INSERT INTO permissions VALUES(?,?,?)",
-                                        (str(channel), channel.id, 0),
-                                    )
-                                    await conn.commit()
-                                except Exception as e:
-                                    print(e)
-                                await ctx.send("👍🏿")
-                            else:
-                                await ctx.send(f"Already blocked in {channel.mention}")
+                for channel in channels:
+                    if await self.bot.auth.block(channel.id, str(channel)):
+                        await ctx.send("👍🏿")
+                    else:
+                        await ctx.send(f"Already blocked in {channel.mention}")
             except:
                 pass
         else:
@@ -148,24 +104,9 @@ class permission_control(commands.Cog):
     async def unblock(self, ctx, channels: commands.Greedy[discord.TextChannel]):
         if ctx.message.author.id == 450647525469454336:
             try:
-                async with asqlite.connect(ctx.bot.database_file) as conn:
-                    async with conn.cursor() as cursor:
-                        for channel in channels:
-                            await cursor.execute(
-                                "SELECT * FROM permissions WHERE user_id=?",
-                                (channel.id),
-                            )
-                            rows = await cursor.fetchall()
-                            if rows:
-                                try:
-                                    await cursor.execute(
-                                        "DELETE FROM permissions WHERE user_id=?",
-                                        (channel.id),
-                                    )
-                                    await conn.commit()
-                                    await ctx.send("👍🏿")
-                                except Exception as e:
-                                    print(e)
+                for channel in channels:
+                    if await self.bot.auth.unblock(channel.id):
+                        await ctx.send("👍🏿")
             except:
                 pass
         else:
@@ -22,10 +22,9 @@ SOFTWARE.
 """
 
 
-import asqlite
 import discord
 from discord.ext import commands
-from .useful import NoPerms
+from core import perms
 from os import listdir
 from os.path import isfile, join
 
@@ -33,24 +32,6 @@ from os.path import isfile, join
 cogs_dir = "modules"
 
 
-def perms():
-    async def predicate(ctx):
-        async with asqlite.connect(ctx.bot.database_file) as conn:
-            async with conn.cursor() as cursor:
-                await cursor.execute(
-                    "SELECT * FROM permissions WHERE user_id=?", (ctx.author.id)
-                )
-                rows = await cursor.fetchall()
-                if rows:
-                    for row in rows:
-                        if ctx.author.id in row:
-                            return True
-                else:
-                    raise NoPerms()
-
-    return commands.check(predicate)
-
-
 class reload(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
@@ -21,13 +21,16 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
-import asqlite
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 import math
 from datetime import datetime
 import re
 import io
+from typing import Literal, Optional
+
+from core import MessageContext, NoPerms, disable_channel, message_handler, perms
+from utils.triggers import Trigger, TriggerIndex
 
 time_regex = re.compile(r"(?:(\d{1,5})(h|s|m|d))+?")
 time_dict = {"h": 3600, "s": 1, "m": 60, "d": 86400}
@@ -64,56 +67,52 @@ class FetchedUser(commands.Converter):
             ) from None
 
 
-class NoPerms(commands.CommandError):
-    def __init__(self):
-        super().__init__("LO... No perm")
-
-
-class channel_blocked(commands.CommandError):
-    def __init__(self) -> None:
-        super().__init__("Disabled in channel")
+class ReactionRule:
+    """A reaction on every ``end_count + 1``th message of a user"""
 
+    __slots__ = ("id", "guild", "emote", "count", "end_count")
 
-def perms():
-    async def predicate(ctx):
-        async with asqlite.connect(ctx.bot.database_file) as conn:
-            async with conn.cursor() as cursor:
-                await cursor.execute(
-                    "SELECT * FROM permissions WHERE user_id=?", (ctx.author.id)
-                )
-                rows = await cursor.fetchall()
-                if rows:
-                    for row in rows:
-                        if ctx.author.id in row:
-                            return True
-                else:
-                    raise NoPerms()
-
-    return commands.check(predicate)
-
-
-def disable_channel():
-    async def predicate(ctx):
-        async with asqlite.connect(ctx.bot.database_file) as conn:
-            async with conn.cursor() as cursor:
-                await cursor.execute(
-                    "SELECT * FROM permissions WHERE user_id=?", (ctx.channel.id)
-                )
-                rows = await cursor.fetchall()
-                if rows:
-                    for row in rows:
-                        if ctx.channel.id not in row:
-                            raise channel_blocked()
-                else:
-                    return True
-
-    return commands.check(predicate)
+    def __init__(self, id: int, guild: int, emote: str, count: int, end_count: int) -> None:
+        self.id = id
+        self.guild = guild
+        self.emote = emote
+        self.count = count
+        self.end_count = end_count
 
 
 class botcmnds(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         # self.update_members.start()
+        self.reaction_rules: dict[int, list[ReactionRule]] = {}
+        # Rules whose count changed since the last flush
+        self.dirty_reactions: set[ReactionRule] = set()
+        self.auto_responses = TriggerIndex()
+
+    async def cog_load(self):
+        for id, user_id, guild, emote, count, end_count in await self.bot.db.reactions():
+            rule = ReactionRule(id, guild, emote, count, end_count)
+            self.reaction_rules.setdefault(user_id, []).append(rule)
+        self.auto_responses = TriggerIndex(
+            [Trigger(*row) for row in await self.bot.db.auto_responses()]
+        )
+        self.flush_reaction_counts.start()
+
+    async def cog_unload(self):
+        self.flush_reaction_counts.cancel()
+        await self.flush_reaction_counts()
+
+    @tasks.loop(seconds=30)
+    async def flush_reaction_counts(self):
+        """Write the in-memory reaction counters back in one batch"""
+        if not self.dirty_reactions:
+            return
+        dirty, self.dirty_reactions = self.dirty_reactions, set()
+        try:
+            await self.bot.db.set_reaction_counts([(r.count, r.id) for r in dirty])
+        except Exception as e:
+            print(e)
+            self.dirty_reactions |= dirty
 
     async def cog_command_error(self, ctx, error):
         if isinstance(error, NoPerms):
@@ -180,44 +179,37 @@ class botcmnds(commands.Cog):
         else:
             emoji = emoji
 
-        reactiondata = (
-            user.name,
-            user.id,
-            ctx.guild.id,
-            str(emoji).lstrip("<").rstrip(">"),
-            0,
-            endcount,
-        )
-        async with asqlite.connect(ctx.bot.database_file) as conn:
-            async with conn.cursor() as cursor:
-                try:
-                    await cursor.execute(
-                        """INSERT INTO reactions(name,user_id,guild,emote,
-                                            start_count,end_count)VALUES(?,?,?,?,?,?)""",
-                        reactiondata,
-                    )
-                    await conn.commit()
-                    await ctx.send(
-                        f"Started reacting {emoji} on {user} messages!", ephemeral=True
-                    )
-                except Exception as e:
-                    print(e)
+        emote = str(emoji).lstrip("<").rstrip(">")
+        try:
+            rule_id = await self.bot.db.add_reaction(
+                user.name,
+                user.id,
+                ctx.guild.id,
+                emote,
+                0,
+                endcount,
+            )
+            self.reaction_rules.setdefault(user.id, []).append(
+                ReactionRule(rule_id, ctx.guild.id, emote, 0, endcount)
+            )
+            await ctx.send(
+                f"Started reacting {emoji} on {user} messages!", ephemeral=True
+            )
+        except Exception as e:
+            print(e)
 
     @reactions.command()
     @perms()
     async def stop(self, ctx, user: discord.Member = None):
-        async with asqlite.connect(ctx.bot.database_file) as conn:
-            async with conn.cursor() as cursor:
-                try:
-                    await cursor.execute(
-                        "DELETE FROM reactions WHERE user_id=?", (user.id)
-                    )
-                    await conn.commit()
-                    await ctx.send(
-                        f"Stopped Reacting on {user} messages!", ephemeral=True
-                    )
-                except Exception as e:
-                    print(e)
+        try:
+            await self.bot.db.remove_reactions(user.id)
+            for rule in self.reaction_rules.pop(user.id, ()):
+                self.dirty_reactions.discard(rule)
+            await ctx.send(
+                f"Stopped Reacting on {user} messages!", ephemeral=True
+            )
+        except Exception as e:
+            print(e)
 
     @commands.hybrid_group(invoke_without_command=True)
     async def message(self, ctx):
@@ -230,112 +222,102 @@ class botcmnds(commands.Cog):
         ctx,
         response: str,
         message: str,
-        author: discord.User = None,
+        author: Optional[discord.User] = None,
+        match: Literal["exact", "prefix", "contains"] = "exact",
+        ignore_case: bool = False,
     ):
         if author is None:
             authorid = 0
         else:
             authorid = author.id
-        async with asqlite.connect(ctx.bot.database_file) as conn:
-            async with conn.cursor() as cursor:
-                try:
-                    await cursor.execute(
-                        """INSERT INTO message(channel,author,message,response)
-                                            VALUES(?,?,?,?)""",
-                        (ctx.channel.id, authorid, message, response),
-                    )
-                    await conn.commit()
-                    await ctx.send("Added message response!", ephemeral=True)
-                except Exception as e:
-                    print(e)
+        try:
+            trigger_id = await self.bot.db.add_auto_response(
+                ctx.channel.id, authorid, message, response, match, ignore_case
+            )
+            self.auto_responses.add(
+                Trigger(trigger_id, ctx.channel.id, authorid, message, response, match, ignore_case)
+            )
+            await ctx.send("Added message response!", ephemeral=True)
+        except Exception as e:
+            print(e)
 
     @message.command()
     @perms()
     async def stop(self, ctx, channel: discord.TextChannel, message):
         try:
-            async with asqlite.connect(ctx.bot.database_file) as conn:
-                async with conn.cursor() as cursor:
-                    try:
-                        await cursor.execute(
-                            "DELETE FROM message WHERE channel=? AND message=?",
-                            (channel.id, message),
-                        )
-                        await conn.commit()
-                        await ctx.send("Stopped!", ephemeral=True)
-                    except Exception as e:
-                        print(e)
+            await self.bot.db.remove_auto_response(channel.id, message)
+            self.auto_responses.remove(channel.id, message)
+            await ctx.send("Stopped!", ephemeral=True)
         except Exception as e:
             print(e)
 
-    @commands.Cog.listener(name="on_message")
-    async def message1(self, m):
-        async with asqlite.connect(self.bot.database_file) as conn:
-            async with conn.cursor() as cursor:
-                await cursor.execute("SELECT * FROM reactions")
-                data = await cursor.fetchall()
-                await cursor.execute("SELECT * FROM message")
-                messagedata = await cursor.fetchall()
-                if [x for x in data if m.author.id in x]:
-                    await cursor.execute(
-                        "SELECT * FROM reactions WHERE user_id=?", (m.author.id)
-                    )
-                    reactiondata = await cursor.fetchall()
-                    for i in reactiondata:
-                        if i[4] != i[5]:
-                            await cursor.execute(
-                                """UPDATE reactions set start_count=?
-                                                     where user_id=?""",
-                                (i[4] + 1, m.author.id),
-                            )
-                            await conn.commit()
-                        elif i[4] == i[5]:
-                            await cursor.execute(
-                                """UPDATE reactions set start_count=?
-                                                    where user_id=?""",
-                                (0, m.author.id),
-                            )
-                            await conn.commit()
-                            await m.add_reaction(i[3])
-                if not m.author.bot:
-                    if [x for x in messagedata if m.channel.id in x]:
-                        await cursor.execute(
-                            "SELECT * FROM message where channel=?", (m.channel.id)
-                        )
-                        messages = await cursor.fetchall()
-                        for i in messages:
-                            if m.author.id == i[1] and m.content == i[2]:
-                                await m.reply(i[3], mention_author=False)
-                                return
-                            elif i[1] == 0 and m.content == i[2]:
-                                await m.channel.send(i[3])
+    @message_handler(include_bots=True, check=lambda self, ctx: ctx.author_id in self.reaction_rules)
+    async def count_reactions(self, ctx: MessageContext):
+        for rule in self.reaction_rules.get(ctx.author_id, ()):
+            self.dirty_reactions.add(rule)
+            if rule.count != rule.end_count:
+                rule.count += 1
+            else:
+                rule.count = 0
+                await ctx.message.add_reaction(rule.emote)
+
+    @message_handler(check=lambda self, ctx: ctx.channel_id in self.auto_responses.channels)
+    async def auto_respond(self, ctx: MessageContext):
+        m = ctx.message
+        personal, public = self.auto_responses.match(ctx.channel_id, ctx.author_id, ctx.content)
+        if personal is not None:
+            await m.reply(personal.response, mention_author=False)
+            return
+        for trigger in public:
+            await m.channel.send(trigger.response)
+
+    # No checks on the group itself, so "prefix list" stays open to everyone
+    @commands.group(invoke_without_command=True)
+    @commands.guild_only()
+    async def prefix(self, ctx):
+        await ctx.invoke(self.prefix_list)
+
+    @prefix.command(name="set")
+    @commands.guild_only()
+    @commands.has_permissions(manage_guild=True)
+    async def prefix_set(self, ctx, newprefix):
+        try:
+            if await self.bot.prefixes.set(ctx.guild.id, newprefix):
+                await ctx.send("Changed the bot prefix to ``%s``" % (newprefix))
+            else:
+                await ctx.send("Added ``%s`` as bot prefix" % newprefix)
+        except Exception as e:
+            print(e)
 
-    @commands.command()
+    @prefix.command(name="add")
+    @commands.guild_only()
     @commands.has_permissions(manage_guild=True)
-    async def prefix(self, ctx, newprefix):
-        async with asqlite.connect(self.bot.database_file) as conn:
-            async with conn.cursor() as cursor:
-                try:
-                    await cursor.execute(
-                        "SELECT * FROM prefix WHERE guild=?", (ctx.guild.id)
-                    )
-                    rows = await cursor.fetchall()
-                    if rows:
-                        await cursor.execute(
-                            "UPDATE prefix set prefix=? WHERE guild=?",
-                            (newprefix, ctx.guild.id),
-                        )
-                        await conn.commit()
-                        await ctx.send("Changed the bot prefix to ``%s``" % (newprefix))
-                    else:
-                        await cursor.execute(
-                            "INSERT INTO prefix(guild,prefix) VALUES(?,?)",
-                            (ctx.guild.id, newprefix),
-                        )
-                        await conn.commit()
-                        await ctx.send("Added ``%s`` as bot prefix" % newprefix)
-                except Exception as e:
-                    print(e)
-                self.bot.prefixes.update({ctx.guild.id: newprefix})
+    async def prefix_add(self, ctx, newprefix):
+        try:
+            if await self.bot.prefixes.add(ctx.guild.id, newprefix):
+                await ctx.send("Added ``%s`` as bot prefix" % newprefix)
+            else:
+                await ctx.send("``%s`` is already a bot prefix" % newprefix)
+        except Exception as e:
+            print(e)
+
+    @prefix.command(name="remove")
+    @commands.guild_only()
+    @commands.has_permissions(manage_guild=True)
+    async def prefix_remove(self, ctx, oldprefix):
+        try:
+            if await self.bot.prefixes.remove(ctx.guild.id, oldprefix):
+                await ctx.send("Removed ``%s`` from the bot prefixes" % oldprefix)
+            else:
+                await ctx.send("``%s`` is not a bot prefix here" % oldprefix)
+        except Exception as e:
+            print(e)
+
+    @prefix.command(name="list")
+    @commands.guild_only()
+    async def prefix_list(self, ctx):
+        prefixes = self.bot.prefixes.for_guild(ctx.guild.id) + self.bot.prefixes.defaults
+        await ctx.send("Bot prefixes: " + ", ".join("``%s``" % p for p in prefixes))
 
 
     @commands.command()
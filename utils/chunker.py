@@ -0,0 +1,171 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2022-Present Marble
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+FENCE = "```"
+# Longest code block language carried over into a reopened fence
+MAX_LANGUAGE = 20
+
+
+def scan_fences(text: str, fence: str | None, line_start: bool = True) -> str | None:
+    """Code block state after ``text``: None outside a block, else its language
+
+    ``fence`` is the state before ``text`` and ``line_start`` whether
+    ``text`` begins at the start of a line. Only looks at the positions of
+    backtick runs, so prose costs a single ``find``.
+    """
+    index = text.find(FENCE)
+    while index != -1:
+        line_begin = text.rfind("\n", 0, index) + 1
+        if (line_begin or line_start) and not text[line_begin:index].strip():
+            line_end = text.find("\n", index)
+            if line_end == -1:
+                line_end = len(text)
+            if fence is None:
+                fence = text[index + 3 : line_end].strip()[:MAX_LANGUAGE]
+            else:
+                fence = None
+            index = text.find(FENCE, line_end)
+        else:
+            index = text.find(FENCE, index + 3)
+    return fence
+
+
+class Chunker:
+    """Splits a reply into messages of at most ``limit`` characters as it arrives
+
+    Text can be fed all at once or delta by delta. A chunk is cut at the
+    last paragraph break, else line break, else space in the second half
+    of the space available, and hard-wrapped when there is none. A chunk
+    that ends inside a code block gets the fence closed and the next one
+    reopens it with the same language. Each character is copied a bounded
+    number of times, so splitting is linear in the length of the reply.
+    """
+
+    def __init__(self, limit: int = 2000) -> None:
+        self.limit = limit
+        # Unsplit text is _text[_pos:] followed by _parts
+        self._text = ""
+        self._pos = 0
+        self._parts: list[str] = []
+        self._size = 0
+        # Code block open at _pos, and whether _pos starts a line
+        self._fence: str | None = None
+        self._line_start = True
+        self._pending_cr = False
+
+    def _budget(self) -> int:
+        # Room for reopening the fence in front and closing it at the end
+        reopen = len(self._fence) + 4 if self._fence is not None else 0
+        return self.limit - reopen - 4
+
+    def _normalize(self, text: str) -> str:
+        if self._pending_cr:
+            text = "\r" + text
+            self._pending_cr = False
+        if text.endswith("\r"):
+            # Might be the first half of a \r\n split across deltas
+            text = text[:-1]
+            self._pending_cr = True
+        return text.replace("\r\n", "\n").replace("\r", "\n")
+
+    def _join(self) -> None:
+        if self._parts:
+            self._text = self._text[self._pos :] + "".join(self._parts)
+            self._pos = 0
+            self._parts.clear()
+
+    def _render(self, body: str, fence_before: str | None, fence_after: str | None) -> str | None:
+        if fence_before is not None:
+            body = f"{FENCE}{fence_before}\n{body}"
+        if fence_after is not None:
+            body += f"\n{FENCE}"
+        return body if body.strip() else None
+
+    def _take(self) -> str | None:
+        budget = self._budget()
+        text, pos = self._text, self._pos
+        end = pos + budget
+        if len(text) <= end:
+            cut, skip = len(text), 0
+        else:
+            half = pos + budget // 2
+            cut, skip = text.rfind("\n\n", half, end), 2
+            if cut == -1:
+                cut, skip = text.rfind("\n", half, end), 1
+            if cut == -1:
+                cut, skip = text.rfind(" ", half, end), 1
+            if cut == -1:
+                cut, skip = end, 0
+            elif skip and cut > pos:
+                # Don't end a chunk on a line that opens a code block
+                line_begin = text.rfind("\n", pos, cut) + 1
+                if line_begin > pos and text[line_begin:cut].lstrip().startswith(FENCE):
+                    if scan_fences(text[pos : line_begin - 1], self._fence, self._line_start) is None:
+                        cut, skip = line_begin - 1, 1
+
+        fence_before = self._fence
+        head = text[pos:cut]
+        self._fence = scan_fences(head, fence_before, self._line_start)
+        self._line_start = skip > 0 and text[cut] == "\n"
+        self._pos = cut + skip
+        self._size -= cut + skip - pos
+        return self._render(head, fence_before, self._fence)
+
+    def feed(self, text: str) -> list[str]:
+        """Add text, returns the chunks that are complete now"""
+        text = self._normalize(text)
+        if text:
+            self._parts.append(text)
+            self._size += len(text)
+        chunks = []
+        while self._size > self._budget():
+            self._join()
+            chunk = self._take()
+            if chunk is not None:
+                chunks.append(chunk)
+        return chunks
+
+    def flush(self) -> list[str]:
+        """The remaining chunks once the reply is complete"""
+        if self._pending_cr:
+            self._pending_cr = False
+            self._parts.append("\n")
+            self._size += 1
+        self._join()
+        chunks = []
+        while self._size > 0:
+            chunk = self._take()
+            if chunk is not None:
+                chunks.append(chunk)
+        return chunks
+
+    def preview(self) -> str | None:
+        """What the unfinished chunk would look like if the reply ended here"""
+        body = self._text[self._pos :] + "".join(self._parts)
+        return self._render(body, self._fence, scan_fences(body, self._fence, self._line_start))
+
+
+def chunk_text(text: str, limit: int = 2000) -> list[str]:
+    """Split a complete reply into Discord sized messages"""
+    chunker = Chunker(limit)
+    return chunker.feed(text) + chunker.flush()
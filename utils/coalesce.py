@@ -0,0 +1,130 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2022-Present Marble
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Generic, Hashable, TypeVar
+
+log = logging.getLogger(__name__)
+
+K = TypeVar("K", bound=Hashable)
+T = TypeVar("T")
+
+
+class _Burst(Generic[T]):
+    __slots__ = ("items", "first", "last", "task", "full")
+
+    def __init__(self) -> None:
+        self.items: list[T] = []
+        self.first = self.last = time.monotonic()
+        self.task: asyncio.Task | None = None
+        self.full = asyncio.Event()
+
+
+class Coalescer(Generic[K, T]):
+    """Debounces items per key and hands each burst to ``handler`` at once
+
+    A burst is flushed after ``window`` seconds without a new item, after
+    ``max_wait`` seconds since its first item, or once it holds
+    ``max_items``, after which further items start a new burst. Handlers
+    for keys mapping to the same ``serialize_by`` value never run
+    concurrently, and items arriving while a handler runs collect into the
+    next burst instead of starting a parallel one.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[K, list[T]], Awaitable[Any]],
+        *,
+        window: float = 1.0,
+        max_wait: float = 4.0,
+        max_items: int = 8,
+        serialize_by: Callable[[K], Hashable] = lambda key: key,
+    ) -> None:
+        self.handler = handler
+        self.window = window
+        self.max_wait = max_wait
+        self.max_items = max_items
+        self.serialize_by = serialize_by
+        self._bursts: dict[K, _Burst[T]] = {}
+        # Lock and number of bursts using it, dropped when that reaches 0
+        self._locks: dict[Hashable, tuple[asyncio.Lock, int]] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        return len(self._bursts)
+
+    def push(self, key: K, item: T) -> None:
+        burst = self._bursts.get(key)
+        if burst is None or burst.full.is_set():
+            burst = self._bursts[key] = _Burst()
+            burst.task = asyncio.create_task(self._flush(key, burst))
+            self._tasks.add(burst.task)
+            burst.task.add_done_callback(self._tasks.discard)
+        else:
+            self.coalesced += 1
+            burst.last = time.monotonic()
+        burst.items.append(item)
+        if len(burst.items) >= self.max_items:
+            burst.full.set()
+
+    async def _flush(self, key: K, burst: _Burst[T]) -> None:
+        while not burst.full.is_set():
+            deadline = min(burst.last + self.window, burst.first + self.max_wait)
+            delay = deadline - time.monotonic()
+            if delay <= 0:
+                break
+            try:
+                await asyncio.wait_for(burst.full.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+        serial = self.serialize_by(key)
+        lock, users = self._locks.get(serial, (None, 0))
+        if lock is None:
+            lock = asyncio.Lock()
+        self._locks[serial] = (lock, users + 1)
+        try:
+            async with lock:
+                # Stop collecting, anything newer starts the next burst
+                if self._bursts.get(key) is burst:
+                    del self._bursts[key]
+                try:
+                    await self.handler(key, burst.items)
+                except Exception:
+                    log.exception("Handler failed for burst %r", key)
+        finally:
+            lock, users = self._locks[serial]
+            if users == 1:
+                del self._locks[serial]
+            else:
+                self._locks[serial] = (lock, users - 1)
+
+    async def close(self) -> None:
+        tasks = tuple(self._tasks)
+        self._bursts.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
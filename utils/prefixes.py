@@ -0,0 +1,150 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2022-Present Marble
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+from typing import Any, Callable, Iterable
+
+import discord
+
+DEFAULT_PREFIXES = ("yo bro",)
+
+
+class _Prefixes:
+    """Everything a message can start with in one guild"""
+
+    __slots__ = ("prefixes", "first_chars")
+
+    def __init__(self, prefixes: Iterable[str]) -> None:
+        # Longest first, so "yo bro" wins over a guild prefix of "y"
+        self.prefixes: tuple[str, ...] = tuple(sorted(set(prefixes), key=len, reverse=True))
+        self.first_chars: frozenset[str] = frozenset(p[0] for p in self.prefixes)
+
+
+class PrefixResolver:
+    """Precomputed command prefixes per guild
+
+    Every guild maps to an immutable tuple of its own prefixes, the bot
+    mentions and the global defaults, built when a prefix changes rather
+    than on every message. Writes go to the database first and then
+    replace the guild's entry in one assignment, so a message never sees
+    a half updated set.
+
+    A mention only counts as a prefix when the word after it passes
+    ``is_command``, otherwise it is someone talking to the bot.
+    """
+
+    def __init__(
+        self,
+        db: Any,
+        defaults: Iterable[str] = DEFAULT_PREFIXES,
+        is_command: Callable[[str], bool] | None = None,
+    ) -> None:
+        self.db = db
+        self.defaults = tuple(defaults)
+        self.is_command = is_command
+        self.mentions: tuple[str, ...] = ()
+        self.custom: dict[int, tuple[str, ...]] = {}
+        self.default = _Prefixes(self.defaults)
+        self.guilds: dict[int, _Prefixes] = {}
+
+    async def load(self) -> None:
+        self.custom = {guild: tuple(prefixes) for guild, prefixes in (await self.db.prefixes()).items()}
+        self._rebuild()
+
+    def set_user(self, user_id: int) -> None:
+        """Accept mentions of the bot account as a prefix"""
+        # Same forms as commands.when_mentioned
+        mentions = (f"<@{user_id}> ", f"<@!{user_id}> ")
+        if mentions != self.mentions:
+            self.mentions = mentions
+            self._rebuild()
+
+    def _build(self, custom: Iterable[str]) -> _Prefixes:
+        return _Prefixes((*custom, *self.mentions, *self.defaults))
+
+    def _rebuild(self) -> None:
+        self.default = self._build(())
+        self.guilds = {guild: self._build(custom) for guild, custom in self.custom.items()}
+
+    def _entry(self, message: discord.Message) -> _Prefixes:
+        if message.guild is None:
+            return self.default
+        return self.guilds.get(message.guild.id, self.default)
+
+    def get(self, message: discord.Message) -> tuple[str, ...]:
+        return self._entry(message).prefixes
+
+    def may_match(self, message: discord.Message) -> bool:
+        """Cheap pre-check, False when no prefix can start with the first character"""
+        return message.content[:1] in self._entry(message).first_chars
+
+    def match(self, message: discord.Message) -> str | None:
+        """The prefix the message starts with, if any"""
+        entry = self._entry(message)
+        content = message.content
+        if content[:1] not in entry.first_chars:
+            return None
+        for prefix in entry.prefixes:
+            if content.startswith(prefix):
+                if prefix in self.mentions and not self._invokes_command(content[len(prefix) :]):
+                    continue
+                return prefix
+        return None
+
+    def _invokes_command(self, rest: str) -> bool:
+        if self.is_command is None:
+            return True
+        words = rest.split(maxsplit=1)
+        return bool(words) and self.is_command(words[0])
+
+    def for_guild(self, guild_id: int) -> tuple[str, ...]:
+        """The guild's own prefixes, without mentions and defaults"""
+        return self.custom.get(guild_id, ())
+
+    def _update(self, guild_id: int, custom: tuple[str, ...]) -> None:
+        if custom:
+            self.custom[guild_id] = custom
+            self.guilds[guild_id] = self._build(custom)
+        else:
+            self.custom.pop(guild_id, None)
+            self.guilds.pop(guild_id, None)
+
+    async def set(self, guild_id: int, prefix: str) -> bool:
+        """Make ``prefix`` the guild's only prefix, returns True if it had any before"""
+        existed = await self.db.set_prefix(guild_id, prefix)
+        self._update(guild_id, (prefix,))
+        return existed
+
+    async def add(self, guild_id: int, prefix: str) -> bool:
+        """Add another prefix, returns False if the guild already had it"""
+        if prefix in self.for_guild(guild_id):
+            return False
+        await self.db.add_prefix(guild_id, prefix)
+        self._update(guild_id, (*self.for_guild(guild_id), prefix))
+        return True
+
+    async def remove(self, guild_id: int, prefix: str) -> bool:
+        if prefix not in self.for_guild(guild_id):
+            return False
+        await self.db.remove_prefix(guild_id, prefix)
+        self._update(guild_id, tuple(p for p in self.for_guild(guild_id) if p != prefix))
+        return True
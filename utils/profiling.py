@@ -0,0 +1,206 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2022-Present Marble
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+import asyncio
+import cProfile
+import io
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from types import CodeType
+
+_site_markers = ("site-packages" + os.sep, "dist-packages" + os.sep)
+_stdlib = os.path.dirname(os.__file__) + os.sep
+_site_prefix = re.compile(r"\S*?(?:site|dist)-packages" + re.escape(os.sep))
+
+
+def short_path(path: str) -> str:
+    """Path relative to the bot, site-packages or the standard library"""
+    for marker in _site_markers:
+        index = path.rfind(marker)
+        if index != -1:
+            return path[index + len(marker) :]
+    if path.startswith(_stdlib):
+        return path[len(_stdlib) :]
+    cwd = os.getcwd() + os.sep
+    if path.startswith(cwd):
+        return path[len(cwd) :]
+    return path
+
+
+def frame_label(code: CodeType) -> str:
+    # Collapsed stacks use ";" between frames
+    name = getattr(code, "co_qualname", code.co_name).replace(";", ":")
+    return f"{name} ({short_path(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """Samples one thread's Python stack from a background thread
+
+    Every ``interval`` seconds the target thread's current frame is walked
+    and the stack counted, so the cost is a few microseconds per sample
+    no matter how busy the target is. Labels are cached per code object.
+    """
+
+    def __init__(self, thread_id: int, *, interval: float = 0.005, max_depth: int = 128) -> None:
+        self.thread_id = thread_id
+        self.interval = interval
+        self.max_depth = max_depth
+        # root -> leaf label tuples
+        self.stacks: Counter[tuple[str, ...]] = Counter()
+        self.samples = 0
+        self._labels: dict[CodeType, str] = {}
+
+    def _label(self, code: CodeType) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = frame_label(code)
+        return label
+
+    def sample(self) -> None:
+        frame = sys._current_frames().get(self.thread_id)
+        if frame is None:
+            return
+        stack = []
+        while frame is not None and len(stack) < self.max_depth:
+            stack.append(self._label(frame.f_code))
+            frame = frame.f_back
+        stack.reverse()
+        self.stacks[tuple(stack)] += 1
+        self.samples += 1
+
+    def run(self, seconds: float) -> None:
+        """Sample until ``seconds`` have passed, blocks the calling thread"""
+        # The sampler needs the GIL to look. With the default 5ms switch
+        # interval it mostly gets it when the loop idles in select(), which
+        # would hide short bursts of CPU work, so ask for it sooner.
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(min(switch_interval, 0.0005))
+        try:
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                self.sample()
+                time.sleep(self.interval)
+        finally:
+            sys.setswitchinterval(switch_interval)
+
+    def collapsed(self) -> str:
+        """Stacks in the folded format flamegraph.pl, inferno and speedscope read"""
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self.stacks.most_common())
+
+    def top(self, limit: int = 15) -> tuple[list[tuple[str, int]], list[tuple[str, int]]]:
+        """Functions by samples anywhere on the stack (cumulative) and on top (self)"""
+        cumulative: Counter[str] = Counter()
+        own: Counter[str] = Counter()
+        for stack, count in self.stacks.items():
+            for label in set(stack):
+                cumulative[label] += count
+            if stack:
+                own[stack[-1]] += count
+        return cumulative.most_common(limit), own.most_common(limit)
+
+
+async def sample_stacks(seconds: float, *, interval: float = 0.005) -> StackSampler:
+    """Sample the event loop thread for ``seconds`` from a worker thread"""
+    sampler = StackSampler(threading.get_ident(), interval=interval)
+    await asyncio.to_thread(sampler.run, seconds)
+    return sampler
+
+
+async def run_cprofile(seconds: float) -> pstats.Stats:
+    """Deterministically profile the event loop thread for ``seconds``"""
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        profiler.disable()
+    return pstats.Stats(profiler)
+
+
+def format_stats(stats: pstats.Stats, sort: str, limit: int = 15) -> str:
+    """pstats' table for the top ``limit`` functions, paths shortened"""
+    stream = io.StringIO()
+    stats.stream = stream
+    stats.sort_stats(sort).print_stats(limit)
+    text = stream.getvalue()
+    # Everything before the column header is a summary we show separately
+    start = text.find("   ncalls")
+    text = text[start:] if start != -1 else text
+    return _site_prefix.sub("", text).replace(_stdlib, "").replace(os.getcwd() + os.sep, "")
+
+
+class AllocationReport:
+    """Allocation sites at the end of a window, and what grew during it"""
+
+    def __init__(
+        self,
+        top: list[tracemalloc.Statistic],
+        growth: list[tracemalloc.StatisticDiff],
+        traced: int,
+        peak: int,
+    ) -> None:
+        self.top = top
+        self.growth = growth
+        self.traced = traced
+        self.peak = peak
+
+
+_memory_filters = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+async def trace_allocations(seconds: float, *, limit: int = 15, frames: int = 1) -> AllocationReport:
+    """Snapshot allocations, wait ``seconds``, snapshot again and compare
+
+    Tracing slows allocation down noticeably, so it is only switched on
+    for the window unless something else already started it.
+    """
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start(frames)
+    try:
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot().filter_traces(_memory_filters)
+        await asyncio.sleep(seconds)
+        after = tracemalloc.take_snapshot().filter_traces(_memory_filters)
+        traced, peak = tracemalloc.get_traced_memory()
+    finally:
+        if started:
+            tracemalloc.stop()
+    key = "traceback" if frames > 1 else "lineno"
+    return AllocationReport(
+        after.statistics(key)[:limit],
+        [diff for diff in after.compare_to(before, key) if diff.size_diff > 0][:limit],
+        traced,
+        peak,
+    )
@@ -0,0 +1,258 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2022-Present Marble
+
+Permission is hereby granted, free of charge, to any person obtaining a
+copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+DEALINGS IN THE SOFTWARE.
+"""
+from collections import deque
+from typing import Iterator
+
+EXACT = "exact"
+PREFIX = "prefix"
+CONTAINS = "contains"
+MATCH_TYPES = (EXACT, PREFIX, CONTAINS)
+
+
+class AhoCorasick:
+    """Multi-pattern substring matcher
+
+    Built once from all patterns, ``search`` then walks the text a single
+    time and reports every pattern occurrence, so the cost depends on the
+    text length and the number of hits rather than the number of patterns.
+    """
+
+    __slots__ = ("_goto", "_fail", "_out")
+
+    def __init__(self, patterns: list[tuple[str, object]]) -> None:
+        goto: list[dict[str, int]] = [{}]
+        out: list[list[tuple[int, object]]] = [[]]
+
+        for pattern, value in patterns:
+            node = 0
+            for char in pattern:
+                nxt = goto[node].get(char)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[node][char] = nxt
+                    goto.append({})
+                    out.append([])
+                node = nxt
+            out[node].append((len(pattern), value))
+
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in goto[node].items():
+                queue.append(child)
+                state = fail[node]
+                while state and char not in goto[state]:
+                    state = fail[state]
+                target = goto[state].get(char, 0)
+                fail[child] = target if target != child else 0
+                # Inherit the matches of the longest proper suffix
+                if out[fail[child]]:
+                    out[child] = out[child] + out[fail[child]]
+
+        self._goto = goto
+        self._fail = fail
+        self._out = out
+
+    def search(self, text: str) -> Iterator[tuple[int, int, object]]:
+        """Yield ``(start, end, value)`` for every occurrence in ``text``"""
+        goto, fail, out = self._goto, self._fail, self._out
+        node = 0
+        for index, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if out[node]:
+                for length, value in out[node]:
+                    yield index - length + 1, index + 1, value
+
+
+class Trigger:
+    """One auto-response row of the ``message`` table"""
+
+    __slots__ = ("id", "channel", "author", "message", "response", "match_type", "ignore_case")
+
+    def __init__(
+        self,
+        id: int,
+        channel: int,
+        author: int,
+        message: str,
+        response: str,
+        match_type: str = EXACT,
+        ignore_case: bool = False,
+    ) -> None:
+        self.id = id
+        self.channel = channel
+        self.author = author
+        self.message = message
+        self.response = response
+        self.match_type = match_type
+        self.ignore_case = bool(ignore_case)
+
+    @property
+    def key(self) -> str:
+        return self.message.casefold() if self.ignore_case else self.message
+
+
+class _Channel:
+    __slots__ = ("by_message", "exact", "iexact", "patterns", "automata")
+
+    def __init__(self) -> None:
+        # message -> author -> trigger, mirrors the table's unique key
+        self.by_message: dict[str, dict[int, Trigger]] = {}
+        # (author, content) -> trigger, split by case mode. Messages that
+        # only differ in case share a folded key, so those keep a list
+        self.exact: dict[tuple[int, str], Trigger] = {}
+        self.iexact: dict[tuple[int, str], list[Trigger]] = {}
+        self.patterns: dict[int, Trigger] = {}
+        # (case sensitive, case folded) automata, None until needed
+        self.automata: tuple[AhoCorasick | None, AhoCorasick | None] | None = None
+
+
+class TriggerIndex:
+    """Per-channel auto-response lookup
+
+    Exact triggers are a dict lookup on ``(author, content)``. Prefix and
+    substring triggers share one Aho-Corasick automaton per channel and
+    case mode, which is rebuilt lazily for just the channel that changed.
+    """
+
+    def __init__(self, triggers: list[Trigger] = ()) -> None:
+        self.channels: dict[int, _Channel] = {}
+        for trigger in triggers:
+            self.add(trigger)
+
+    def __len__(self) -> int:
+        return sum(
+            len(authors) for c in self.channels.values() for authors in c.by_message.values()
+        )
+
+    def add(self, trigger: Trigger) -> None:
+        channel = self.channels.get(trigger.channel)
+        if channel is None:
+            channel = self.channels[trigger.channel] = _Channel()
+
+        authors = channel.by_message.setdefault(trigger.message, {})
+        # Same (channel, author, message) replaces the old response
+        old = authors.get(trigger.author)
+        if old is not None:
+            self._discard(channel, old)
+        authors[trigger.author] = trigger
+
+        if trigger.match_type == EXACT:
+            if trigger.ignore_case:
+                channel.iexact.setdefault((trigger.author, trigger.key), []).append(trigger)
+            else:
+                channel.exact[(trigger.author, trigger.key)] = trigger
+        else:
+            channel.patterns[trigger.id] = trigger
+            channel.automata = None
+
+    def remove(self, channel_id: int, message: str) -> int:
+        """Drop every trigger for ``message`` in a channel, returns how many"""
+        channel = self.channels.get(channel_id)
+        if channel is None:
+            return 0
+        authors = channel.by_message.pop(message, {})
+        for trigger in authors.values():
+            self._discard(channel, trigger)
+        if not channel.by_message:
+            del self.channels[channel_id]
+        return len(authors)
+
+    def _discard(self, channel: _Channel, trigger: Trigger) -> None:
+        if trigger.match_type == EXACT:
+            key = (trigger.author, trigger.key)
+            if not trigger.ignore_case:
+                if channel.exact.get(key) is trigger:
+                    del channel.exact[key]
+                return
+            same = channel.iexact.get(key, [])
+            if trigger in same:
+                same.remove(trigger)
+                if not same:
+                    del channel.iexact[key]
+        else:
+            channel.patterns.pop(trigger.id, None)
+            channel.automata = None
+
+    def _automata(self, channel: _Channel) -> tuple[AhoCorasick | None, AhoCorasick | None]:
+        if channel.automata is None:
+            sensitive = [(t.message, t) for t in channel.patterns.values() if not t.ignore_case]
+            folded = [(t.key, t) for t in channel.patterns.values() if t.ignore_case]
+            channel.automata = (
+                AhoCorasick(sensitive) if sensitive else None,
+                AhoCorasick(folded) if folded else None,
+            )
+        return channel.automata
+
+    def match(self, channel_id: int, author_id: int, content: str) -> tuple[Trigger | None, list[Trigger]]:
+        """Find the responses for a message
+
+        Returns the author specific trigger to reply with, if any, and
+        otherwise every matching trigger meant for anyone in the channel.
+        """
+        channel = self.channels.get(channel_id)
+        if channel is None:
+            return None, []
+
+        folded = None
+        personal: list[Trigger] = []
+        public: list[Trigger] = []
+
+        for author, bucket in ((author_id, personal), (0, public)):
+            trigger = channel.exact.get((author, content))
+            if trigger is not None:
+                bucket.append(trigger)
+            if channel.iexact:
+                if folded is None:
+                    folded = content.casefold()
+                bucket.extend(channel.iexact.get((author, folded), ()))
+
+        if channel.patterns:
+            sensitive, insensitive = self._automata(channel)
+            if insensitive is not None and folded is None:
+                folded = content.casefold()
+            seen: set[int] = set()
+            for automaton, text in ((sensitive, content), (insensitive, folded)):
+                if automaton is None:
+                    continue
+                for start, _, trigger in automaton.search(text):
+                    if trigger.id in seen:
+                        continue
+                    if trigger.match_type == PREFIX and start != 0:
+                        continue
+                    if trigger.author == author_id:
+                        personal.append(trigger)
+                    elif trigger.author == 0:
+                        public.append(trigger)
+                    else:
+                        continue
+                    seen.add(trigger.id)
+
+        if personal:
+            return min(personal, key=lambda t: t.id), []
+        public.sort(key=lambda t: t.id)
+        return None, public